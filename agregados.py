@@ -0,0 +1,290 @@
+"""Estatísticas incrementais da base por segmento, atualizadas a cada envio.
+
+Para cada alvo (geral, dimensão, seção ou questão) × poder × esfera × UF — com "todos"
+em cada eixo — guardam-se contagem, soma, média e variância (Welford), mínimo,
+máximo e um histograma de largura fixa na escala 0–3 que serve de esboço de
+quantis. Tudo é somável: réplicas gravam fotografias próprias em disco e a
+leitura combina as fotografias.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from itertools import product
+from pathlib import Path
+from typing import Iterable
+
+import metricas
+from base_comparacao import GERAL, RESOLUCAO, chave_segmento, faixa
+from pontuacao import coluna_questao
+
+logger = logging.getLogger("observatorio.base")
+
+PREFIXO_SECAO = "s:"
+PREFIXO_QUESTAO = "q:"
+
+
+def alvo_secao(secao: str) -> str:
+    return PREFIXO_SECAO + secao
+
+
+def alvo_questao(qid: str) -> str:
+    return PREFIXO_QUESTAO + qid
+
+
+class EstatisticaSegmento:
+    __slots__ = ("n", "soma", "media", "m2", "minimo", "maximo", "histograma")
+
+    def __init__(self):
+        self.n = 0
+        self.soma = 0.0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = math.inf
+        self.maximo = -math.inf
+        self.histograma = {}
+
+    def adicionar(self, valor: float):
+        self.n += 1
+        self.soma += valor
+        delta = valor - self.media
+        self.media += delta / self.n
+        self.m2 += delta * (valor - self.media)
+        self.minimo = min(self.minimo, valor)
+        self.maximo = max(self.maximo, valor)
+        f = faixa(valor)
+        self.histograma[f] = self.histograma.get(f, 0) + 1
+
+    def mesclar(self, outro: "EstatisticaSegmento"):
+        if outro.n == 0:
+            return
+        n = self.n + outro.n
+        delta = outro.media - self.media
+        self.m2 += outro.m2 + delta * delta * self.n * outro.n / n
+        self.media += delta * outro.n / n
+        self.n = n
+        self.soma += outro.soma
+        self.minimo = min(self.minimo, outro.minimo)
+        self.maximo = max(self.maximo, outro.maximo)
+        for f, contagem in outro.histograma.items():
+            self.histograma[f] = self.histograma.get(f, 0) + contagem
+
+    def variancia(self) -> float:
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def quantil(self, q: float):
+        if self.n == 0:
+            return None
+        alvo = q * self.n
+        acumulado = 0
+        for f in sorted(self.histograma):
+            acumulado += self.histograma[f]
+            if acumulado >= alvo:
+                return round(f * RESOLUCAO, 2)
+        return self.maximo
+
+    def para_dict(self) -> dict:
+        return {
+            "n": self.n, "soma": self.soma, "media": self.media, "m2": self.m2,
+            "min": self.minimo if self.n else None, "max": self.maximo if self.n else None,
+            "hist": {str(k): v for k, v in self.histograma.items()},
+        }
+
+    @classmethod
+    def de_dict(cls, dados: dict) -> "EstatisticaSegmento":
+        est = cls()
+        est.n = int(dados["n"])
+        est.soma = float(dados["soma"])
+        est.media = float(dados["media"])
+        est.m2 = float(dados["m2"])
+        est.minimo = dados["min"] if dados.get("min") is not None else math.inf
+        est.maximo = dados["max"] if dados.get("max") is not None else -math.inf
+        est.histograma = {int(k): int(v) for k, v in dados.get("hist", {}).items()}
+        return est
+
+
+class AgregadosIncrementais:
+    """Agregados em memória com fotografia periódica em `caminho` (JSON, troca atômica)."""
+
+    def __init__(self, caminho: Path, colunas_dimensao: dict = None, questoes: Iterable[str] = (),
+                 secoes: dict = None, intervalo_fotografia: float = 30.0):
+        """`secoes` mapeia cada seção às questões que a compõem; a nota da seção é a média delas."""
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self.colunas_dimensao = dict(colunas_dimensao or {})
+        self.questoes = list(questoes)
+        self.secoes = {secao: list(qids) for secao, qids in (secoes or {}).items()}
+        self.intervalo_fotografia = intervalo_fotografia
+        self._segmentos = {}
+        self._lock = threading.Lock()
+        self._alterado = False
+        self._parar = threading.Event()
+        self._thread = None
+
+    # -------------------
+    # Atualização
+    # -------------------
+    def _valores(self, registro: dict):
+        yield GERAL, registro.get("score_geral")
+        for dim, coluna in self.colunas_dimensao.items():
+            yield dim, registro.get(coluna)
+        for qid in self.questoes:
+            yield alvo_questao(qid), registro.get(coluna_questao(qid))
+        for secao, qids in self.secoes.items():
+            notas = [float(v) for v in (registro.get(coluna_questao(q)) for q in qids) if v not in (None, "")]
+            yield alvo_secao(secao), sum(notas) / len(notas) if notas else None
+
+    def alvos(self) -> list:
+        return (
+            [GERAL] + list(self.colunas_dimensao) + [alvo_questao(q) for q in self.questoes]
+            + [alvo_secao(s) for s in self.secoes]
+        )
+
+    def registrar(self, registro: dict):
+        """Custo constante por envio: alvos × 8 combinações de segmento."""
+        segmentos = list(product(
+            (registro.get("poder"), None),
+            (registro.get("esfera"), None),
+            (registro.get("estado_uf"), None),
+        ))
+        with self._lock:
+            for alvo, valor in self._valores(registro):
+                if valor in (None, ""):
+                    continue
+                valor = float(valor)
+                for poder, esfera, uf in segmentos:
+                    chave = chave_segmento(alvo, poder, esfera, uf)
+                    est = self._segmentos.get(chave)
+                    if est is None:
+                        est = self._segmentos[chave] = EstatisticaSegmento()
+                    est.adicionar(valor)
+            self._alterado = True
+        metricas.incrementar("agregados_registros_total")
+
+    def reconstruir(self, lotes: Iterable[list]) -> int:
+        """Recomeça do zero a partir de todas as respostas (partida sem fotografia válida)."""
+        with self._lock:
+            self._segmentos = {}
+        total = 0
+        for lote in lotes:
+            for registro in lote:
+                self.registrar(registro)
+                total += 1
+        return total
+
+    def mesclar(self, outro: "AgregadosIncrementais"):
+        with self._lock:
+            for chave, est in outro.segmentos().items():
+                atual = self._segmentos.get(chave)
+                if atual is None:
+                    atual = self._segmentos[chave] = EstatisticaSegmento()
+                atual.mesclar(est)
+            self._alterado = True
+
+    # -------------------
+    # Consulta
+    # -------------------
+    def segmentos(self) -> dict:
+        with self._lock:
+            return {chave: EstatisticaSegmento.de_dict(est.para_dict()) for chave, est in self._segmentos.items()}
+
+    def estatistica(self, alvo: str = GERAL, poder=None, esfera=None, uf=None):
+        with self._lock:
+            return self._segmentos.get(chave_segmento(alvo, poder, esfera, uf))
+
+    def total(self) -> int:
+        est = self.estatistica(GERAL)
+        return est.n if est else 0
+
+    def somas(self) -> dict:
+        with self._lock:
+            return {chave: (est.soma, est.n) for chave, est in self._segmentos.items()}
+
+    # -------------------
+    # Fotografia em disco
+    # -------------------
+    def para_dict(self) -> dict:
+        with self._lock:
+            return {
+                "gerado_em": time.time(),
+                "alvos": self.alvos(),
+                "segmentos": [
+                    {"chave": list(chave), **est.para_dict()} for chave, est in self._segmentos.items()
+                ],
+            }
+
+    def fotografar(self):
+        inicio = time.perf_counter()
+        dados = self.para_dict()
+        temporario = self.caminho.with_suffix(self.caminho.suffix + ".tmp")
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(dados, f, ensure_ascii=False)
+        os.replace(temporario, self.caminho)
+        with self._lock:
+            self._alterado = False
+        metricas.observar("agregados_fotografia_segundos", time.perf_counter() - inicio)
+        metricas.definir("agregados_segmentos", len(dados["segmentos"]))
+
+    def carregar(self, exigir_alvos: bool = True) -> bool:
+        """Lê a fotografia; com `exigir_alvos`, recusa fotografias de outro conjunto de alvos."""
+        if not self.caminho.exists():
+            return False
+        with open(self.caminho, encoding="utf-8") as f:
+            dados = json.load(f)
+        if exigir_alvos and dados.get("alvos") != self.alvos():
+            return False
+        with self._lock:
+            self._segmentos = {
+                tuple(item["chave"]): EstatisticaSegmento.de_dict(item) for item in dados.get("segmentos", [])
+            }
+        return True
+
+    @classmethod
+    def de_arquivo(cls, caminho: Path) -> "AgregadosIncrementais":
+        agregados = cls(caminho)
+        agregados.carregar(exigir_alvos=False)
+        return agregados
+
+    def iniciar(self):
+        if self.intervalo_fotografia <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="agregados-fotografia", daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout: float = 5.0):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._alterado:
+            self.fotografar()
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo_fotografia):
+            if not self._alterado:
+                continue
+            try:
+                self.fotografar()
+            except Exception as e:
+                logger.warning("Falha ao gravar a fotografia dos agregados: %s", e)
+
+
+def combinar_fotografias(local: AgregadosIncrementais, outras: Iterable[Path]) -> dict:
+    """Segmentos da réplica local somados às fotografias das demais réplicas."""
+    segmentos = local.segmentos()
+    for caminho in outras:
+        if Path(caminho).resolve() == local.caminho.resolve():
+            continue
+        try:
+            outra = AgregadosIncrementais.de_arquivo(caminho)
+        except Exception as e:
+            logger.warning("Fotografia de agregados ilegível em %s: %s", caminho, e)
+            continue
+        for chave, est in outra.segmentos().items():
+            if chave in segmentos:
+                segmentos[chave].mesclar(est)
+            else:
+                segmentos[chave] = est
+    return segmentos
@@ -0,0 +1,89 @@
+"""Execução antecipada da primeira análise da IA, em segundo plano.
+
+Um pool de threads limitado gera a análise enquanto o relatório é exibido e o
+e-mail é enviado. Cada tarefa recebe um sinal de cancelamento, verificado entre
+os pedaços da resposta, para que regerar o diagnóstico descarte o trabalho em curso.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import metricas
+
+logger = logging.getLogger("observatorio.ia")
+
+
+class TarefaAntecipada:
+    def __init__(self, futuro, cancelado: threading.Event):
+        self.futuro = futuro
+        self.cancelado = cancelado
+        self.criada_em = time.monotonic()
+
+    def pronta(self) -> bool:
+        return self.futuro.done()
+
+    def resultado(self, timeout: float = None):
+        """Texto gerado, ou None se a tarefa falhou ou foi cancelada."""
+        if self.futuro.cancelled():
+            return None
+        try:
+            return self.futuro.result(timeout=timeout)
+        except Exception as e:
+            logger.warning("Análise antecipada indisponível: %s", e)
+            return None
+
+    def cancelar(self):
+        self.cancelado.set()
+        if self.futuro.cancel():
+            metricas.incrementar("ia_antecipadas_canceladas_total")
+
+
+class ExecutorAntecipado:
+    """Pool com `trabalhadores` threads e no máximo `pendentes_maximos` tarefas aceitas.
+
+    Acima do limite a tarefa não é agendada (`agendar` devolve None) e o chat
+    segue pelo caminho normal, com a pergunta do usuário.
+    """
+
+    def __init__(self, trabalhadores: int = 4, pendentes_maximos: int = 16):
+        self.trabalhadores = max(1, trabalhadores)
+        self._vagas = threading.BoundedSemaphore(self.trabalhadores + max(0, pendentes_maximos))
+        self._executor = ThreadPoolExecutor(max_workers=self.trabalhadores, thread_name_prefix="analise-ia")
+
+    def agendar(self, funcao: Callable, *args, **kwargs) -> Optional[TarefaAntecipada]:
+        if not self._vagas.acquire(blocking=False):
+            metricas.incrementar("ia_antecipadas_descartadas_total")
+            return None
+
+        cancelado = threading.Event()
+        agendada_em = time.perf_counter()
+
+        def _executar():
+            if cancelado.is_set():
+                return None
+            metricas.observar("ia_antecipadas_espera_segundos", time.perf_counter() - agendada_em)
+            return funcao(*args, cancelado=cancelado, **kwargs)
+
+        try:
+            futuro = self._executor.submit(_executar)
+        except Exception:
+            self._vagas.release()
+            raise
+
+        def _concluir(f):
+            self._vagas.release()
+            if f.cancelled() or cancelado.is_set():
+                return
+            if f.exception() is not None:
+                metricas.incrementar("ia_antecipadas_erros_total")
+            else:
+                metricas.observar("ia_antecipadas_duracao_segundos", time.perf_counter() - agendada_em)
+
+        futuro.add_done_callback(_concluir)
+        metricas.incrementar("ia_antecipadas_agendadas_total")
+        return TarefaAntecipada(futuro, cancelado)
+
+    def encerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
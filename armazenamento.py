@@ -0,0 +1,164 @@
+"""Armazenamento local das respostas em SQLite (modo WAL).
+
+É a base primária de gravação; o Google Sheets passa a ser um espelho assíncrono.
+Os campos de consulta ficam em colunas indexadas e o registro completo em JSON.
+"""
+import csv
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+COLUNAS_INDEXADAS = ["id_resposta", "instituicao", "poder", "esfera", "estado_uf", "data_hora"]
+COLUNAS_AGRUPAVEIS = {"instituicao", "poder", "esfera", "estado_uf", "versao_instrumento", "nivel_maturidade"}
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS respostas (
+    id_resposta TEXT PRIMARY KEY,
+    data_hora TEXT,
+    versao_instrumento TEXT,
+    instituicao TEXT,
+    poder TEXT,
+    esfera TEXT,
+    estado_uf TEXT,
+    score_geral REAL,
+    nivel_maturidade TEXT,
+    registro TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_respostas_instituicao ON respostas (instituicao);
+CREATE INDEX IF NOT EXISTS idx_respostas_poder ON respostas (poder);
+CREATE INDEX IF NOT EXISTS idx_respostas_esfera ON respostas (esfera);
+CREATE INDEX IF NOT EXISTS idx_respostas_estado_uf ON respostas (estado_uf);
+CREATE INDEX IF NOT EXISTS idx_respostas_data_hora ON respostas (data_hora);
+"""
+
+
+class RepositorioRespostas:
+    def __init__(self, caminho: Path):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conexao()
+        conn.executescript(_ESQUEMA)
+
+    def _conexao(self) -> sqlite3.Connection:
+        # Uma conexão por thread: no modo WAL leitores não bloqueiam o gravador
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.caminho), timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # -------------------
+    # Gravação
+    # -------------------
+    def inserir(self, registro: dict) -> bool:
+        """Grava o registro; devolve False se o id_resposta já estava na base (reenvio)."""
+        cursor = self._conexao().execute(
+            "INSERT OR IGNORE INTO respostas "
+            "(id_resposta, data_hora, versao_instrumento, instituicao, poder, esfera, estado_uf,"
+            " score_geral, nivel_maturidade, registro) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                registro.get("id_resposta"),
+                registro.get("data_hora"),
+                registro.get("versao_instrumento"),
+                registro.get("instituicao"),
+                registro.get("poder"),
+                registro.get("esfera"),
+                registro.get("estado_uf"),
+                registro.get("score_geral"),
+                registro.get("nivel_maturidade"),
+                json.dumps(registro, ensure_ascii=False, default=str),
+            ),
+        )
+        return cursor.rowcount == 1
+
+    def remover(self, id_resposta: str):
+        self._conexao().execute("DELETE FROM respostas WHERE id_resposta = ?", (id_resposta,))
+
+    # -------------------
+    # Consultas
+    # -------------------
+    def obter(self, id_resposta: str):
+        linha = self._conexao().execute(
+            "SELECT registro FROM respostas WHERE id_resposta = ?", (id_resposta,)
+        ).fetchone()
+        return json.loads(linha["registro"]) if linha else None
+
+    def _filtros_sql(self, filtros: dict):
+        clausulas, params = [], []
+        for coluna, valor in filtros.items():
+            if valor is None:
+                continue
+            if coluna == "desde":
+                clausulas.append("data_hora >= ?")
+            elif coluna == "ate":
+                clausulas.append("data_hora < ?")
+            elif coluna in COLUNAS_INDEXADAS:
+                clausulas.append(f"{coluna} = ?")
+            else:
+                raise ValueError(f"Filtro não suportado: {coluna}")
+            params.append(valor)
+        where = (" WHERE " + " AND ".join(clausulas)) if clausulas else ""
+        return where, params
+
+    def buscar(self, limite: int = 100, **filtros) -> list:
+        where, params = self._filtros_sql(filtros)
+        linhas = self._conexao().execute(
+            f"SELECT registro FROM respostas{where} ORDER BY data_hora DESC LIMIT ?",
+            params + [limite],
+        ).fetchall()
+        return [json.loads(l["registro"]) for l in linhas]
+
+    def contar(self, **filtros) -> int:
+        where, params = self._filtros_sql(filtros)
+        return self._conexao().execute(f"SELECT COUNT(*) FROM respostas{where}", params).fetchone()[0]
+
+    def agregar(self, por: str, **filtros) -> list:
+        if por not in COLUNAS_AGRUPAVEIS:
+            raise ValueError(f"Agrupamento não suportado: {por}")
+        where, params = self._filtros_sql(filtros)
+        linhas = self._conexao().execute(
+            f"SELECT {por} AS grupo, COUNT(*) AS n, AVG(score_geral) AS media_score"
+            f" FROM respostas{where} GROUP BY {por} ORDER BY n DESC",
+            params,
+        ).fetchall()
+        return [{"grupo": l["grupo"], "n": l["n"], "media_score": l["media_score"]} for l in linhas]
+
+    def iterar(self, tamanho_lote: int = 1000, **filtros):
+        """Percorre os registros em lotes, sem carregar a base inteira em memória."""
+        where, params = self._filtros_sql(filtros)
+        cursor = self._conexao().execute(
+            f"SELECT registro FROM respostas{where} ORDER BY data_hora", params
+        )
+        while True:
+            linhas = cursor.fetchmany(tamanho_lote)
+            if not linhas:
+                break
+            yield [json.loads(l["registro"]) for l in linhas]
+
+    def exportar_csv(self, destino, **filtros) -> int:
+        """Exporta os registros para CSV (caminho ou arquivo aberto). Retorna o total de linhas."""
+        colunas = []
+        for lote in self.iterar(**filtros):
+            for registro in lote:
+                for k in registro:
+                    if k not in colunas:
+                        colunas.append(k)
+
+        abrir = isinstance(destino, (str, Path))
+        arquivo = open(destino, "w", newline="", encoding="utf-8") if abrir else destino
+        try:
+            escritor = csv.DictWriter(arquivo, fieldnames=colunas, extrasaction="ignore")
+            escritor.writeheader()
+            total = 0
+            for lote in self.iterar(**filtros):
+                escritor.writerows(lote)
+                total += len(lote)
+            return total
+        finally:
+            if abrir:
+                arquivo.close()
@@ -0,0 +1,84 @@
+"""Ativos estáticos (logo, folha de estilo) lidos uma vez por processo.
+
+O conteúdo fica em memória e só é relido quando o mtime do arquivo muda. A versão
+(hash do conteúdo) entra na URL dos arquivos servidos em /app/static, o que permite
+cache longo no navegador e no proxy sem risco de servir conteúdo antigo.
+"""
+import base64
+import hashlib
+import threading
+import time
+from pathlib import Path
+
+import metricas
+
+
+class Ativo:
+    def __init__(self, caminho: Path, conteudo: bytes, mtime: float):
+        self.caminho = caminho
+        self.conteudo = conteudo
+        self.mtime = mtime
+        self.versao = hashlib.sha256(conteudo).hexdigest()[:12]
+        self._base64 = None
+
+    def texto(self) -> str:
+        return self.conteudo.decode("utf-8")
+
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.conteudo).decode("utf-8")
+        return self._base64
+
+
+class RegistroAtivos:
+    """Cache de ativos por caminho; confere o mtime no máximo a cada `intervalo_verificacao` segundos."""
+
+    def __init__(self, diretorio_estatico: Path = Path("static"), prefixo_url: str = "app/static",
+                 intervalo_verificacao: float = 2.0):
+        self.diretorio_estatico = Path(diretorio_estatico).resolve()
+        self.prefixo_url = prefixo_url.rstrip("/")
+        self.intervalo_verificacao = intervalo_verificacao
+        self._ativos = {}
+        self._verificado_em = {}
+        self._lock = threading.Lock()
+
+    def obter(self, caminho: Path):
+        """Ativo em memória, ou None se o arquivo não existe ou não pode ser lido."""
+        caminho = Path(caminho).resolve()
+        agora = time.monotonic()
+        with self._lock:
+            ativo = self._ativos.get(caminho)
+            if ativo is not None and agora - self._verificado_em.get(caminho, 0) < self.intervalo_verificacao:
+                return ativo
+            self._verificado_em[caminho] = agora
+            try:
+                mtime = caminho.stat().st_mtime
+            except OSError:
+                self._ativos.pop(caminho, None)
+                return None
+            if ativo is not None and ativo.mtime == mtime:
+                return ativo
+            try:
+                conteudo = caminho.read_bytes()
+            except OSError:
+                return None
+            ativo = Ativo(caminho, conteudo, mtime)
+            self._ativos[caminho] = ativo
+            metricas.incrementar("ativos_leituras_disco_total", ativo=caminho.name)
+            return ativo
+
+    def texto(self, caminho: Path) -> str:
+        ativo = self.obter(caminho)
+        return ativo.texto() if ativo else ""
+
+    def base64(self, caminho: Path):
+        ativo = self.obter(caminho)
+        return ativo.base64() if ativo else None
+
+    def url(self, caminho: Path):
+        """URL versionada do arquivo servido pelo Streamlit (ou pelo nginx) em /app/static."""
+        ativo = self.obter(caminho)
+        if ativo is None:
+            return None
+        relativo = ativo.caminho.relative_to(self.diretorio_estatico).as_posix()
+        return f"{self.prefixo_url}/{relativo}?v={ativo.versao}"
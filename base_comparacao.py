@@ -0,0 +1,308 @@
+"""Médias de referência da base do Observatório, por dimensão × poder × esfera × UF.
+
+As referências vêm de arquivos de dados versionados (observatorio_base.json e os
+CSVs que ele lista) e são complementadas pelos agregados incrementais das respostas
+(agregados.py), relidos periodicamente em segundo plano. A tabela em uso é imutável
+e trocada inteira a cada atualização; cada consulta é um acesso a dicionário. A
+versão da tabela inclui um resumo do conteúdo, então muda junto com as médias.
+"""
+import csv
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+import metricas
+
+logger = logging.getLogger("observatorio.base")
+
+GERAL = "geral"
+TODOS = "*"
+
+ESCALA_MAXIMA = 3.0
+RESOLUCAO = 0.01  # largura das faixas dos histogramas de distribuição
+FAIXAS = int(round(ESCALA_MAXIMA / RESOLUCAO)) + 1
+
+_SUBSTITUICOES = {
+    "poder executivo": "executivo",
+    "poder legislativo": "legislativo",
+    "poder judiciário": "judiciário",
+    "judiciario": "judiciário",
+    "org. internacional": "organismo internacional",
+    "organismo int.": "organismo internacional",
+    "organismo internacional e terceiro setor": "organismo internacional",
+    "terceiro setor": "privado",
+}
+
+
+def normalizar_segmento(texto: str):
+    if not texto:
+        return None
+    t = texto.strip().lower()
+    return _SUBSTITUICOES.get(t, t)
+
+
+def chave_segmento(dimensao, poder=None, esfera=None, uf=None):
+    return (
+        dimensao or GERAL,
+        normalizar_segmento(poder) or TODOS,
+        normalizar_segmento(esfera) or TODOS,
+        (uf or "").strip().upper() or TODOS,
+    )
+
+
+def faixa(valor: float) -> int:
+    return int(round(min(max(valor, 0.0), ESCALA_MAXIMA) / RESOLUCAO))
+
+
+def segmentos_candidatos(poder=None, esfera=None, uf=None):
+    """Do segmento mais específico ao nacional."""
+    return ((poder, esfera, uf), (poder, esfera, None), (poder, None, None), (None, esfera, None), (None, None, None))
+
+
+def _formatar_decimal(valor: float) -> str:
+    return f"{valor:.2f}".replace(".", ",")
+
+
+class DistribuicoesBase:
+    """Distribuições acumuladas por segmento numa matriz (segmentos × faixas).
+
+    O percentil de cada valor é um acesso à matriz; vários alvos de um mesmo
+    respondente são posicionados numa única indexação vetorizada.
+    """
+
+    def __init__(self, histogramas: dict = None, minimo_respostas: int = 1):
+        histogramas = {
+            chave: hist for chave, hist in (histogramas or {}).items() if sum(hist.values()) >= minimo_respostas
+        }
+        self._linhas = {chave: i for i, chave in enumerate(histogramas)}
+        contagens = np.zeros((len(histogramas), FAIXAS), dtype=np.int64)
+        for chave, hist in histogramas.items():
+            for f, n in hist.items():
+                contagens[self._linhas[chave], f] = n
+        self._iguais = contagens
+        self._abaixo = np.cumsum(contagens, axis=1) - contagens
+        self._total = contagens.sum(axis=1)
+
+    def __len__(self):
+        return len(self._linhas)
+
+    def segmento(self, poder=None, esfera=None, uf=None):
+        """Segmento mais específico com distribuição publicada: ((poder, esfera, uf), n) ou None."""
+        for p, e, u in segmentos_candidatos(poder, esfera, uf):
+            linha = self._linhas.get(chave_segmento(GERAL, p, e, u))
+            if linha is not None:
+                return (p, e, u), int(self._total[linha])
+        return None
+
+    def percentis(self, valores: dict, poder=None, esfera=None, uf=None) -> dict:
+        """Percentil (0–100, posto médio) de cada {alvo: valor} no segmento de `segmento()`."""
+        encontrado = self.segmento(poder, esfera, uf)
+        if encontrado is None:
+            return {}
+        p, e, u = encontrado[0]
+        alvos, linhas, faixas = [], [], []
+        for alvo, valor in valores.items():
+            linha = self._linhas.get(chave_segmento(alvo, p, e, u))
+            if linha is None or valor is None:
+                continue
+            alvos.append(alvo)
+            linhas.append(linha)
+            faixas.append(faixa(float(valor)))
+        if not alvos:
+            return {}
+        linhas = np.array(linhas)
+        faixas = np.array(faixas)
+        pct = (self._abaixo[linhas, faixas] + 0.5 * self._iguais[linhas, faixas]) * 100.0 / self._total[linhas]
+        return dict(zip(alvos, np.rint(pct).astype(int).tolist()))
+
+
+class TabelaBase:
+    """Fotografia imutável das médias de referência."""
+
+    def __init__(self, versao: str, medias: dict, perfil: list, descricao: str = "", origem_respostas: int = 0,
+                 distribuicoes: DistribuicoesBase = None):
+        """`versao` é a da definição; `self.versao` soma a ela o resumo das médias, do perfil e da descrição."""
+        conteudo = json.dumps([sorted(medias.items()), list(perfil), descricao], ensure_ascii=False, default=str)
+        self.versao_definicao = versao
+        self.versao = f"{versao}+{hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:12]}"
+        self.distribuicoes = distribuicoes or DistribuicoesBase()
+        self.descricao = descricao
+        self.perfil = list(perfil)
+        self.origem_respostas = origem_respostas
+        self._medias = dict(medias)  # chave -> (media, n)
+        self._nacional = {
+            chave[0]: media
+            for chave, (media, _) in self._medias.items()
+            if chave[1:] == (TODOS, TODOS, TODOS) and chave[0] != GERAL
+        }
+        self._texto = self._montar_texto()
+
+    def media(self, dimensao: str = GERAL, poder: str = None, esfera: str = None, uf: str = None) -> Optional[float]:
+        """Média exata do segmento (None nos campos = todos)."""
+        item = self._medias.get(chave_segmento(dimensao, poder, esfera, uf))
+        return item[0] if item else None
+
+    def referencia(self, dimensao: str = GERAL, poder: str = None, esfera: str = None, uf: str = None):
+        """Média do segmento mais específico disponível: (media, poder, esfera, uf) ou None."""
+        for p, e, u in segmentos_candidatos(poder, esfera, uf):
+            item = self._medias.get(chave_segmento(dimensao, p, e, u))
+            if item:
+                return item[0], p, e, u
+        return None
+
+    def medias_dimensao(self) -> dict:
+        """Médias nacionais por dimensão."""
+        return dict(self._nacional)
+
+    def texto_sintetico(self) -> str:
+        return self._texto
+
+    def _montar_texto(self) -> str:
+        linhas = ["", f"{self.descricao or 'Base nacional do Observatório de Maturidade'} – resumo sintético", ""]
+        if self.perfil:
+            linhas.append("1. Perfil da base")
+            linhas.extend(f"- {p}" for p in self.perfil)
+            linhas.append("")
+        geral = self.media(GERAL)
+        if geral is not None:
+            linhas.append("2. Maturidade geral")
+            linhas.append(f"- Média nacional de maturidade: {_formatar_decimal(geral)} (escala 0 a 3).")
+            linhas.append("")
+        if self._nacional:
+            linhas.append("3. Médias por dimensão")
+            linhas.extend(f"- {dim}: {_formatar_decimal(media)}" for dim, media in self._nacional.items())
+        return "\n".join(linhas) + "\n"
+
+
+# -------------------
+# Carga dos arquivos
+# -------------------
+def _ler_csv_medias(caminho: Path) -> dict:
+    medias = {}
+    with open(caminho, newline="", encoding="utf-8") as f:
+        for linha in csv.DictReader(f):
+            dimensao = (linha.get("dimensao") or linha.get("dimension") or "").strip()
+            valor = linha.get("media") or linha.get("mean_score")
+            if not dimensao or valor in (None, ""):
+                continue
+            chave = chave_segmento(dimensao, linha.get("poder"), linha.get("esfera"), linha.get("estado_uf"))
+            medias[chave] = (float(valor), int(linha["n"]) if linha.get("n") else None)
+    return medias
+
+
+def carregar_arquivos(caminho_json: Path):
+    """Lê o arquivo de definição da base e os CSVs referenciados por ele."""
+    caminho_json = Path(caminho_json)
+    with open(caminho_json, encoding="utf-8") as f:
+        definicao = json.load(f)
+
+    medias = {}
+    for arquivo in definicao.get("arquivos_medias", []):
+        medias.update(_ler_csv_medias(caminho_json.parent / arquivo))
+    for item in definicao.get("medias", []):
+        chave = chave_segmento(item.get("dimensao"), item.get("poder"), item.get("esfera"), item.get("estado_uf"))
+        medias[chave] = (float(item["media"]), item.get("n"))
+
+    return {
+        "versao": str(definicao.get("versao", "")),
+        "descricao": definicao.get("descricao", ""),
+        "perfil": definicao.get("perfil", []),
+        "medias": medias,
+    }
+
+
+# -------------------
+# Respostas armazenadas
+# -------------------
+def combinar(medias_arquivo: dict, somas_respostas: dict, minimo_respostas: int) -> dict:
+    """Os arquivos prevalecem; as respostas preenchem segmentos sem referência publicada."""
+    medias = dict(medias_arquivo)
+    for chave, (soma, n) in somas_respostas.items():
+        if chave not in medias and n >= minimo_respostas:
+            medias[chave] = (round(soma / n, 2), n)
+    return medias
+
+
+class MotorBase:
+    def __init__(
+        self,
+        caminho_definicao: Path,
+        fonte_segmentos: Callable[[], dict] = None,
+        intervalo: float = 60.0,
+        minimo_respostas: int = 30,
+    ):
+        """`fonte_segmentos` devolve {chave_segmento: estatística} das respostas recebidas,
+        com `soma`, `n` e `histograma` ({faixa: contagem})."""
+        self.caminho_definicao = Path(caminho_definicao)
+        self.fonte_segmentos = fonte_segmentos
+        self.intervalo = intervalo
+        self.minimo_respostas = minimo_respostas
+
+        self._arquivos = carregar_arquivos(self.caminho_definicao)
+        self._arquivos_mtime = self._mtime_definicao()
+        self._tabela = self._montar_tabela({})
+        self._parar = threading.Event()
+        self._thread = None
+
+    @property
+    def tabela(self) -> TabelaBase:
+        return self._tabela
+
+    def _montar_tabela(self, segmentos: dict) -> TabelaBase:
+        somas = {chave: (est.soma, est.n) for chave, est in segmentos.items()}
+        return TabelaBase(
+            self._arquivos["versao"],
+            combinar(self._arquivos["medias"], somas, self.minimo_respostas),
+            self._arquivos["perfil"],
+            descricao=self._arquivos["descricao"],
+            origem_respostas=somas.get((GERAL, TODOS, TODOS, TODOS), (0.0, 0))[1],
+            distribuicoes=DistribuicoesBase(
+                {chave: est.histograma for chave, est in segmentos.items()}, self.minimo_respostas
+            ),
+        )
+
+    def _mtime_definicao(self):
+        try:
+            return self.caminho_definicao.stat().st_mtime
+        except OSError:
+            return None
+
+    def atualizar(self):
+        inicio = time.perf_counter()
+        # Definição publicada de novo (arquivo trocado no volume): relida sem reiniciar
+        mtime = self._mtime_definicao()
+        if mtime != self._arquivos_mtime:
+            self._arquivos = carregar_arquivos(self.caminho_definicao)
+            self._arquivos_mtime = mtime
+        segmentos = self.fonte_segmentos() if self.fonte_segmentos else {}
+        self._tabela = self._montar_tabela(segmentos)
+        metricas.observar("base_atualizacao_segundos", time.perf_counter() - inicio)
+        metricas.definir("base_respostas_consideradas", self._tabela.origem_respostas)
+
+    def iniciar(self):
+        if self.fonte_segmentos is None or self.intervalo <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="base-observatorio", daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout: float = 5.0):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        # A primeira atualização também sai da thread do script
+        while not self._parar.is_set():
+            try:
+                self.atualizar()
+            except Exception as e:
+                metricas.incrementar("base_atualizacao_falhas_total")
+                logger.warning("Falha ao atualizar a base a partir das respostas: %s", e)
+            self._parar.wait(self.intervalo)
@@ -0,0 +1,154 @@
+"""Cache persistente de respostas do copiloto para perguntas repetidas.
+
+A chave combina a pergunta normalizada com a impressão canônica do perfil
+(médias arredondadas e segmento poder/esfera). Entradas expiram por TTL e o
+excesso é removido por LRU. Mudar a versão (prompt de sistema, base, modelo)
+descarta o conteúdo antigo. Com várias réplicas, CacheRespostasCompartilhado
+guarda as mesmas entradas no backend de estado compartilhado.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import metricas
+
+
+def normalizar_pergunta(pergunta: str) -> str:
+    texto = unicodedata.normalize("NFKD", (pergunta or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s.]", " ", texto)
+    texto = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", texto)
+    return " ".join(texto.split())
+
+
+def versao_cache(*partes) -> str:
+    return hashlib.sha256("\x1f".join(str(p) for p in partes).encode("utf-8")).hexdigest()[:16]
+
+
+def chave_resposta(versao: str, pergunta: str, impressao_perfil: dict) -> str:
+    conteudo = json.dumps(
+        {"v": versao, "p": normalizar_pergunta(pergunta), "perfil": impressao_perfil},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+class CacheRespostasIA:
+    def __init__(self, caminho: Path, versao: str, max_itens: int = 5000, ttl_segundos: float = 7 * 24 * 3600):
+        self.versao = versao
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self.acertos = 0
+        self.falhas = 0
+
+        caminho = Path(caminho)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(caminho), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS respostas ("
+            " chave TEXT PRIMARY KEY, versao TEXT NOT NULL, resposta TEXT NOT NULL,"
+            " criado_em REAL NOT NULL, acessado_em REAL NOT NULL, acessos INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_respostas_acesso ON respostas (acessado_em)")
+        # Prompt ou base mudaram: o que foi gerado com a versão anterior não vale mais
+        self._conn.execute("DELETE FROM respostas WHERE versao != ?", (versao,))
+
+    def chave(self, pergunta: str, impressao_perfil: dict) -> str:
+        return chave_resposta(self.versao, pergunta, impressao_perfil)
+
+    def obter(self, chave: str):
+        agora = time.time()
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT resposta, criado_em FROM respostas WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha and agora - linha[1] > self.ttl_segundos:
+                self._conn.execute("DELETE FROM respostas WHERE chave = ?", (chave,))
+                linha = None
+            if linha:
+                self._conn.execute(
+                    "UPDATE respostas SET acessado_em = ?, acessos = acessos + 1 WHERE chave = ?",
+                    (agora, chave),
+                )
+                self.acertos += 1
+            else:
+                self.falhas += 1
+        metricas.incrementar("ia_cache_acertos_total" if linha else "ia_cache_falhas_total")
+        metricas.definir("ia_cache_taxa_acerto", self.taxa_acerto())
+        return linha[0] if linha else None
+
+    def guardar(self, chave: str, resposta: str):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respostas (chave, versao, resposta, criado_em, acessado_em)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (chave, self.versao, resposta, agora, agora),
+            )
+            excesso = self._conn.execute("SELECT COUNT(*) FROM respostas").fetchone()[0] - self.max_itens
+            if excesso > 0:
+                self._conn.execute(
+                    "DELETE FROM respostas WHERE chave IN"
+                    " (SELECT chave FROM respostas ORDER BY acessado_em LIMIT ?)",
+                    (excesso,),
+                )
+                metricas.incrementar("ia_cache_despejos_total", excesso)
+
+    def invalidar(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM respostas")
+
+    def taxa_acerto(self) -> float:
+        total = self.acertos + self.falhas
+        return self.acertos / total if total else 0.0
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            itens = self._conn.execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+        return {"itens": itens, "acertos": self.acertos, "falhas": self.falhas, "taxa_acerto": self.taxa_acerto()}
+
+
+class CacheRespostasCompartilhado:
+    """Mesma interface de CacheRespostasIA sobre o backend compartilhado entre réplicas.
+
+    A versão entra na chave, então entradas de versões antigas só deixam de ser
+    lidas e somem pelo TTL; o limite de itens fica a cargo do backend. Por isso o
+    app o coloca num Redis próprio (IA_CACHE_URL, `maxmemory` com
+    `maxmemory-policy allkeys-lru`), separado do estado compartilhado, que usa
+    noeviction: lá, um cache cheio faria falhar as escritas da fila e do índice.
+    """
+
+    def __init__(self, backend, versao: str, ttl_segundos: float = 7 * 24 * 3600):
+        self._backend = backend
+        self.versao = versao
+        self.ttl_segundos = ttl_segundos
+        self.acertos = 0
+        self.falhas = 0
+
+    def chave(self, pergunta: str, impressao_perfil: dict) -> str:
+        return chave_resposta(self.versao, pergunta, impressao_perfil)
+
+    def obter(self, chave: str):
+        resposta = self._backend.obter(f"ia_resposta:{chave}")
+        if resposta:
+            self.acertos += 1
+        else:
+            self.falhas += 1
+        metricas.incrementar("ia_cache_acertos_total" if resposta else "ia_cache_falhas_total")
+        metricas.definir("ia_cache_taxa_acerto", self.taxa_acerto())
+        return resposta
+
+    def guardar(self, chave: str, resposta: str):
+        self._backend.definir(f"ia_resposta:{chave}", resposta, self.ttl_segundos)
+
+    def taxa_acerto(self) -> float:
+        total = self.acertos + self.falhas
+        return self.acertos / total if total else 0.0
@@ -0,0 +1,149 @@
+"""Janela de contexto do copiloto com orçamento fixo de tokens e contabilidade de custo.
+
+Turnos antigos que não cabem no orçamento são condensados num resumo corrente;
+os mais recentes seguem na íntegra. O consumo (tokens e custo) é somado por sessão.
+"""
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger("observatorio.ia")
+
+try:
+    import tiktoken
+
+    _codificador = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken ausente ou sem acesso ao arquivo de codificação
+    _codificador = None
+
+# Tokens extras que a API cobra por mensagem (papel, separadores)
+_TOKENS_POR_MENSAGEM = 4
+
+
+def contar_tokens(texto: str) -> int:
+    if not texto:
+        return 0
+    if _codificador is not None:
+        return len(_codificador.encode(texto))
+    # Aproximação para português: ~4 caracteres por token
+    return max(1, len(texto) // 4)
+
+
+def contar_tokens_mensagens(mensagens: list) -> int:
+    return sum(contar_tokens(m.get("content") or "") + _TOKENS_POR_MENSAGEM for m in mensagens)
+
+
+def _resumo_extrativo(resumo: str, mensagens: list, limite_caracteres: int = 1600) -> str:
+    linhas = [resumo] if resumo else []
+    for m in mensagens:
+        autor = "Usuário" if m.get("role") == "user" else "IA"
+        texto = " ".join((m.get("content") or "").split())
+        linhas.append(f"- {autor}: {texto[:200]}")
+    return "\n".join(linhas)[-limite_caracteres:]
+
+
+class GerenciadorContexto:
+    def __init__(
+        self,
+        orcamento_tokens: int = 6000,
+        reserva_resposta: int = 800,
+        mensagens_minimas: int = 2,
+        tokens_maximos_resumo: int = 400,
+        fracao_apos_resumo: float = 0.6,
+        preco_entrada_1m: float = 0.15,
+        preco_saida_1m: float = 0.60,
+        limite_tokens: Optional[int] = None,
+        limite_custo_usd: Optional[float] = None,
+    ):
+        self.orcamento_tokens = orcamento_tokens
+        self.reserva_resposta = reserva_resposta
+        self.mensagens_minimas = mensagens_minimas
+        self.tokens_maximos_resumo = tokens_maximos_resumo
+        self.fracao_apos_resumo = fracao_apos_resumo
+        self.preco_entrada_1m = preco_entrada_1m
+        self.preco_saida_1m = preco_saida_1m
+        self.limite_tokens = limite_tokens
+        self.limite_custo_usd = limite_custo_usd
+
+        self.resumo = ""
+        self.resumidas = 0  # mensagens do chat_history já incorporadas ao resumo
+        self.chamadas = 0
+        self.tokens_entrada = 0
+        self.tokens_saida = 0
+        self.custo_usd = 0.0
+
+    # -------------------
+    # Montagem da janela
+    # -------------------
+    def _mensagem_resumo(self):
+        return {"role": "system", "content": "Resumo da conversa anterior com o usuário:\n" + self.resumo}
+
+    def montar_mensagens(self, fixas: list, chat_history: list,
+                         resumir: Callable[[str, list], str] = None) -> list:
+        disponivel = self.orcamento_tokens - self.reserva_resposta - contar_tokens_mensagens(fixas)
+        if self.resumo:
+            disponivel -= contar_tokens_mensagens([self._mensagem_resumo()])
+
+        pendentes = chat_history[self.resumidas:]
+        recentes = self._recentes_que_cabem(pendentes, disponivel)
+        if len(recentes) < len(pendentes):
+            # Ao estourar, resume até uma fração do orçamento para não resumir a cada turno
+            recentes = self._recentes_que_cabem(pendentes, int(disponivel * self.fracao_apos_resumo))
+            self._resumir(pendentes[: len(pendentes) - len(recentes)], resumir)
+
+        mensagens = list(fixas)
+        if self.resumo:
+            mensagens.append(self._mensagem_resumo())
+        mensagens.extend(recentes)
+        return mensagens
+
+    def _recentes_que_cabem(self, mensagens: list, disponivel: int) -> list:
+        recentes, usado = [], 0
+        for msg in reversed(mensagens):
+            custo = contar_tokens_mensagens([msg])
+            if len(recentes) >= self.mensagens_minimas and usado + custo > disponivel:
+                break
+            recentes.insert(0, msg)
+            usado += custo
+        return recentes
+
+    def _resumir(self, excedentes: list, resumir):
+        novo = None
+        if resumir is not None:
+            try:
+                novo = resumir(self.resumo, excedentes)
+            except Exception as e:
+                logger.warning("Falha ao resumir a conversa; usando resumo extrativo: %s", e)
+        if not novo:
+            novo = _resumo_extrativo(self.resumo, excedentes)
+        # Mantém o próprio resumo dentro do teto
+        while contar_tokens(novo) > self.tokens_maximos_resumo and len(novo) > 200:
+            novo = novo[len(novo) // 4:]
+        self.resumo = novo
+        self.resumidas += len(excedentes)
+
+    # -------------------
+    # Contabilidade
+    # -------------------
+    def registrar_uso(self, tokens_entrada: int, tokens_saida: int):
+        self.chamadas += 1
+        self.tokens_entrada += int(tokens_entrada or 0)
+        self.tokens_saida += int(tokens_saida or 0)
+        self.custo_usd += (
+            (tokens_entrada or 0) * self.preco_entrada_1m + (tokens_saida or 0) * self.preco_saida_1m
+        ) / 1_000_000
+
+    def excedeu_limite(self) -> bool:
+        if self.limite_tokens is not None and self.tokens_entrada + self.tokens_saida >= self.limite_tokens:
+            return True
+        if self.limite_custo_usd is not None and self.custo_usd >= self.limite_custo_usd:
+            return True
+        return False
+
+    def consumo(self) -> dict:
+        return {
+            "chamadas": self.chamadas,
+            "tokens_entrada": self.tokens_entrada,
+            "tokens_saida": self.tokens_saida,
+            "custo_usd": round(self.custo_usd, 6),
+            "mensagens_resumidas": self.resumidas,
+        }
@@ -0,0 +1,578 @@
+"""Estado compartilhado entre réplicas: chave-valor com TTL, baldes de tokens e filas com reserva.
+
+Com várias réplicas atrás do nginx, a fila de gravação da planilha, as chaves de
+idempotência, os limites de chamadas às APIs e o cache de respostas da IA
+precisam valer para o conjunto, não para cada processo. Dois backends oferecem
+as mesmas operações, escolhidos pela URL em ESTADO_COMPARTILHADO_URL:
+
+- `redis://host:6379/0`: réplicas em qualquer máquina (pacote `redis`);
+- `sqlite:///caminho/arquivo.db`: réplicas no mesmo host, com o arquivo num volume em comum.
+
+As operações compostas (consumir de vários baldes, reservar itens da fila) são
+atômicas nos dois casos: scripts Lua no Redis, transações BEGIN IMMEDIATE no SQLite.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import metricas
+
+
+# -------------------
+# Baldes de tokens
+# -------------------
+class BaldeTokens:
+    """Balde com reposição contínua de `por_minuto` unidades, até `capacidade`."""
+
+    def __init__(self, por_minuto: float, capacidade: float = None):
+        self.taxa = max(float(por_minuto), 1e-9) / 60.0
+        self.capacidade = float(capacidade if capacidade is not None else por_minuto)
+        self._nivel = self.capacidade
+        self._atualizado = time.monotonic()
+
+    def _repor(self, agora: float):
+        self._nivel = min(self.capacidade, self._nivel + (agora - self._atualizado) * self.taxa)
+        self._atualizado = agora
+
+    def espera(self, quantidade: float, agora: float) -> float:
+        """Segundos até haver saldo; pedidos maiores que a capacidade entram com o balde cheio."""
+        self._repor(agora)
+        necessario = min(quantidade, self.capacidade)
+        return 0.0 if self._nivel >= necessario else (necessario - self._nivel) / self.taxa
+
+    def consumir(self, quantidade: float):
+        # Pode ficar negativo: o excesso é uma dívida paga pela reposição
+        self._nivel -= quantidade
+
+    def esvaziar(self, agora: float):
+        """Zera o saldo (o provedor recusou por cota): as próximas chamadas seguem no ritmo da reposição."""
+        self._repor(agora)
+        self._nivel = min(self._nivel, 0.0)
+
+
+class BaldesLocais:
+    """Conjunto de baldes nomeados de um processo, com pausa comum a todos."""
+
+    def __init__(self, limites: dict):
+        self._baldes = {nome: BaldeTokens(por_minuto) for nome, por_minuto in limites.items()}
+        self._pausado_ate = 0.0
+        self._lock = threading.Lock()
+
+    def tentar(self, pedidos: dict) -> float:
+        """Consome `pedidos` (nome -> quantidade) de uma vez se todos os baldes tiverem saldo;
+        senão não consome nada e devolve os segundos de espera."""
+        with self._lock:
+            agora = time.monotonic()
+            espera = max([self._pausado_ate - agora, 0.0] + [
+                self._baldes[nome].espera(quantidade, agora) for nome, quantidade in pedidos.items()
+            ])
+            if espera == 0.0:
+                for nome, quantidade in pedidos.items():
+                    self._baldes[nome].consumir(quantidade)
+            return espera
+
+    def ajustar(self, nome: str, quantidade: float):
+        with self._lock:
+            self._baldes[nome].consumir(quantidade)
+
+    def esvaziar(self, nome: str):
+        with self._lock:
+            self._baldes[nome].esvaziar(time.monotonic())
+
+    def pausar(self, segundos: float):
+        with self._lock:
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+
+    def pausado_por(self) -> float:
+        with self._lock:
+            return max(0.0, self._pausado_ate - time.monotonic())
+
+
+class BaldesCompartilhados:
+    """Mesma interface de BaldesLocais, com o saldo guardado no backend compartilhado."""
+
+    def __init__(self, backend, prefixo: str, limites: dict):
+        self._backend = backend
+        self._prefixo = prefixo
+        # nome -> (taxa por segundo, capacidade)
+        self._limites = {nome: (max(float(pm), 1e-9) / 60.0, float(pm)) for nome, pm in limites.items()}
+
+    def _chave(self, nome: str) -> str:
+        return f"{self._prefixo}:balde:{nome}"
+
+    def tentar(self, pedidos: dict) -> float:
+        return self._backend.tentar_baldes(
+            f"{self._prefixo}:pausa",
+            [(self._chave(nome), quantidade, *self._limites[nome]) for nome, quantidade in pedidos.items()],
+        )
+
+    def ajustar(self, nome: str, quantidade: float):
+        self._backend.ajustar_balde(self._chave(nome), quantidade, *self._limites[nome])
+
+    def esvaziar(self, nome: str):
+        self._backend.ajustar_balde(self._chave(nome), 0.0, *self._limites[nome], zerar=True)
+
+    def pausar(self, segundos: float):
+        self._backend.pausar(f"{self._prefixo}:pausa", segundos)
+
+    def pausado_por(self) -> float:
+        return self._backend.pausa_restante(f"{self._prefixo}:pausa")
+
+
+def criar_baldes(limites: dict, backend=None, prefixo: str = ""):
+    return BaldesCompartilhados(backend, prefixo, limites) if backend is not None else BaldesLocais(limites)
+
+
+# -------------------
+# Fila com reserva
+# -------------------
+class FilaCompartilhada:
+    """Itens ficam reservados por `prazo` segundos para quem os pegou; sem confirmação
+    (réplica caiu no meio da gravação), voltam a ficar disponíveis para as outras."""
+
+    def __init__(self, backend, nome: str, prazo: float = 300.0):
+        # A FilaGravacao renova a reserva enquanto grava o lote (a cada prazo/3), então o prazo
+        # só vence quando a réplica para de responder
+        self._backend = backend
+        self.nome = nome
+        self.prazo = prazo
+
+    def incluir(self, payload: str):
+        self._backend.fila_incluir(self.nome, payload)
+
+    def reservar(self, quantidade: int) -> list:
+        """Lista de (id, payload, tentativas), na ordem de chegada."""
+        return self._backend.fila_reservar(self.nome, quantidade, self.prazo)
+
+    def confirmar(self, ids: list):
+        self._backend.fila_confirmar(self.nome, ids)
+
+    def falhar(self, ids: list, contar: bool = True):
+        """Libera a reserva já; `contar` soma a falha às tentativas que levam ao descarte."""
+        self._backend.fila_falhar(self.nome, ids, contar)
+
+    def renovar(self, ids: list) -> int:
+        """Estende por mais `prazo` a reserva dos itens ainda reservados; devolve quantos renovou
+        (menos que len(ids): alguma reserva venceu e pode ter ido para outra réplica)."""
+        return self._backend.fila_renovar(self.nome, ids, self.prazo)
+
+    def descartar(self, ids: list, erro: str):
+        """Tira os itens da fila e os guarda, com o erro, entre os descartados."""
+        self._backend.fila_descartar(self.nome, ids, erro)
+
+    def profundidade(self) -> int:
+        return self._backend.fila_profundidade(self.nome)
+
+
+# -------------------
+# Backend SQLite
+# -------------------
+_ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS kv (chave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira_em REAL);
+CREATE INDEX IF NOT EXISTS idx_kv_expira ON kv (expira_em);
+CREATE TABLE IF NOT EXISTS baldes (chave TEXT PRIMARY KEY, nivel REAL NOT NULL, atualizado REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS fila (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    criado_em REAL NOT NULL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    reservado_ate REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_fila_nome ON fila (nome, reservado_ate, seq);
+CREATE TABLE IF NOT EXISTS fila_descartados (
+    seq INTEGER PRIMARY KEY,
+    nome TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    criado_em REAL NOT NULL,
+    tentativas INTEGER NOT NULL,
+    erro TEXT,
+    descartado_em REAL NOT NULL
+);
+"""
+
+
+class BackendSQLite:
+    def __init__(self, caminho: Path):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conexao().executescript(_ESQUEMA_SQLITE)
+
+    def __repr__(self):
+        return f"BackendSQLite({str(self.caminho)!r})"
+
+    def _conexao(self) -> sqlite3.Connection:
+        # Uma conexão por thread; entre processos, o bloqueio do próprio SQLite serializa as escritas
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.caminho), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transacao(self):
+        conn = self._conexao()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # Chave-valor
+    def obter(self, chave: str):
+        linha = self._conexao().execute(
+            "SELECT valor FROM kv WHERE chave = ? AND (expira_em IS NULL OR expira_em > ?)", (chave, time.time())
+        ).fetchone()
+        return linha[0] if linha else None
+
+    def definir(self, chave: str, valor: str, ttl: float = None):
+        expira = time.time() + ttl if ttl else None
+        self._conexao().execute("INSERT OR REPLACE INTO kv (chave, valor, expira_em) VALUES (?, ?, ?)",
+                                (chave, valor, expira))
+
+    def definir_se_ausente(self, chave: str, valor: str, ttl: float = None) -> bool:
+        agora = time.time()
+        with self._transacao() as conn:
+            # Expirados saem aqui, aproveitando a transação de escrita
+            conn.execute("DELETE FROM kv WHERE expira_em <= ?", (agora,))
+            inseridos = conn.execute(
+                "INSERT OR IGNORE INTO kv (chave, valor, expira_em) VALUES (?, ?, ?)",
+                (chave, valor, agora + ttl if ttl else None),
+            ).rowcount
+        return inseridos == 1
+
+    def remover(self, chave: str):
+        self._conexao().execute("DELETE FROM kv WHERE chave = ?", (chave,))
+
+    # Baldes
+    @staticmethod
+    def _nivel(conn, chave: str, taxa: float, capacidade: float, agora: float) -> float:
+        linha = conn.execute("SELECT nivel, atualizado FROM baldes WHERE chave = ?", (chave,)).fetchone()
+        if linha is None:
+            return capacidade
+        return min(capacidade, linha[0] + max(0.0, agora - linha[1]) * taxa)
+
+    def tentar_baldes(self, chave_pausa: str, pedidos: list) -> float:
+        """`pedidos`: (chave, quantidade, taxa por segundo, capacidade) de cada balde."""
+        with self._transacao() as conn:
+            agora = time.time()
+            linha = conn.execute("SELECT valor FROM kv WHERE chave = ?", (chave_pausa,)).fetchone()
+            espera = max(0.0, float(linha[0]) - agora) if linha else 0.0
+            niveis = []
+            for chave, quantidade, taxa, capacidade in pedidos:
+                nivel = self._nivel(conn, chave, taxa, capacidade, agora)
+                necessario = min(quantidade, capacidade)
+                if nivel < necessario:
+                    espera = max(espera, (necessario - nivel) / taxa)
+                niveis.append(nivel - quantidade)
+            if espera == 0.0:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO baldes (chave, nivel, atualizado) VALUES (?, ?, ?)",
+                    [(pedido[0], nivel, agora) for pedido, nivel in zip(pedidos, niveis)],
+                )
+        return espera
+
+    def ajustar_balde(self, chave: str, quantidade: float, taxa: float, capacidade: float, zerar: bool = False):
+        with self._transacao() as conn:
+            agora = time.time()
+            nivel = self._nivel(conn, chave, taxa, capacidade, agora) - quantidade
+            conn.execute("INSERT OR REPLACE INTO baldes (chave, nivel, atualizado) VALUES (?, ?, ?)",
+                         (chave, min(nivel, 0.0) if zerar else nivel, agora))
+
+    def pausar(self, chave: str, segundos: float):
+        with self._transacao() as conn:
+            ate = time.time() + segundos
+            linha = conn.execute("SELECT valor FROM kv WHERE chave = ?", (chave,)).fetchone()
+            if linha is None or float(linha[0]) < ate:
+                conn.execute("INSERT OR REPLACE INTO kv (chave, valor, expira_em) VALUES (?, ?, ?)",
+                             (chave, repr(ate), ate))
+
+    def pausa_restante(self, chave: str) -> float:
+        valor = self.obter(chave)
+        return max(0.0, float(valor) - time.time()) if valor else 0.0
+
+    # Fila
+    def fila_incluir(self, nome: str, payload: str):
+        self._conexao().execute("INSERT INTO fila (nome, payload, criado_em) VALUES (?, ?, ?)",
+                                (nome, payload, time.time()))
+
+    def fila_reservar(self, nome: str, quantidade: int, prazo: float) -> list:
+        with self._transacao() as conn:
+            agora = time.time()
+            linhas = conn.execute(
+                "SELECT seq, payload, tentativas FROM fila WHERE nome = ? AND reservado_ate <= ?"
+                " ORDER BY seq LIMIT ?",
+                (nome, agora, quantidade),
+            ).fetchall()
+            conn.executemany("UPDATE fila SET reservado_ate = ? WHERE seq = ?",
+                             [(agora + prazo, linha[0]) for linha in linhas])
+        return linhas
+
+    def fila_confirmar(self, nome: str, ids: list):
+        self._conexao().executemany("DELETE FROM fila WHERE seq = ?", [(i,) for i in ids])
+
+    def fila_falhar(self, nome: str, ids: list, contar: bool = True):
+        self._conexao().executemany(
+            "UPDATE fila SET tentativas = tentativas + ?, reservado_ate = 0 WHERE seq = ?",
+            [(1 if contar else 0, i) for i in ids],
+        )
+
+    def fila_renovar(self, nome: str, ids: list, prazo: float) -> int:
+        with self._transacao() as conn:
+            agora = time.time()
+            return sum(
+                conn.execute("UPDATE fila SET reservado_ate = ? WHERE seq = ? AND reservado_ate > ?",
+                             (agora + prazo, i, agora)).rowcount
+                for i in ids
+            )
+
+    def fila_descartar(self, nome: str, ids: list, erro: str):
+        with self._transacao() as conn:
+            agora = time.time()
+            for seq in ids:
+                conn.execute(
+                    "INSERT OR REPLACE INTO fila_descartados"
+                    " (seq, nome, payload, criado_em, tentativas, erro, descartado_em)"
+                    " SELECT seq, nome, payload, criado_em, tentativas + 1, ?, ? FROM fila WHERE seq = ?",
+                    (erro, agora, seq),
+                )
+                conn.execute("DELETE FROM fila WHERE seq = ?", (seq,))
+
+    def fila_profundidade(self, nome: str) -> int:
+        return self._conexao().execute("SELECT COUNT(*) FROM fila WHERE nome = ?", (nome,)).fetchone()[0]
+
+
+# -------------------
+# Backend Redis
+# -------------------
+# Valores numéricos voltam como texto: o Redis trunca números do Lua para inteiros
+_LUA_AGORA = "local t = redis.call('TIME') local agora = tonumber(t[1]) + tonumber(t[2]) / 1000000 "
+
+_LUA_NIVEL = """
+local function nivel(chave, taxa, capacidade, agora)
+  local estado = redis.call('HMGET', chave, 'nivel', 'atualizado')
+  if not estado[1] then return capacidade end
+  return math.min(capacidade, tonumber(estado[1]) + math.max(0, agora - tonumber(estado[2])) * taxa)
+end
+"""
+
+_LUA_TENTAR = _LUA_AGORA + _LUA_NIVEL + """
+local espera = math.max(0, (tonumber(redis.call('GET', KEYS[1]) or '0')) - agora)
+local niveis = {}
+for i = 2, #KEYS do
+  local base = (i - 2) * 3
+  local quantidade, taxa, capacidade = tonumber(ARGV[base + 1]), tonumber(ARGV[base + 2]), tonumber(ARGV[base + 3])
+  local n = nivel(KEYS[i], taxa, capacidade, agora)
+  local necessario = math.min(quantidade, capacidade)
+  if n < necessario then espera = math.max(espera, (necessario - n) / taxa) end
+  niveis[i] = n - quantidade
+end
+if espera > 0 then return tostring(espera) end
+for i = 2, #KEYS do
+  redis.call('HSET', KEYS[i], 'nivel', tostring(niveis[i]), 'atualizado', tostring(agora))
+  redis.call('EXPIRE', KEYS[i], 3600)
+end
+return '0'
+"""
+
+_LUA_AJUSTAR = _LUA_AGORA + _LUA_NIVEL + """
+local n = nivel(KEYS[1], tonumber(ARGV[2]), tonumber(ARGV[3]), agora) - tonumber(ARGV[1])
+if ARGV[4] == '1' then n = math.min(n, 0) end
+redis.call('HSET', KEYS[1], 'nivel', tostring(n), 'atualizado', tostring(agora))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(n)
+"""
+
+_LUA_PAUSAR = _LUA_AGORA + """
+local ate = agora + tonumber(ARGV[1])
+if ate > tonumber(redis.call('GET', KEYS[1]) or '0') then
+  redis.call('SET', KEYS[1], tostring(ate), 'PX', math.ceil(tonumber(ARGV[1]) * 1000))
+end
+return tostring(ate)
+"""
+
+_LUA_PAUSA_RESTANTE = _LUA_AGORA + """
+return tostring(math.max(0, (tonumber(redis.call('GET', KEYS[1]) or '0')) - agora))
+"""
+
+# KEYS: prontos (zset id -> disponível a partir de), itens (hash id -> payload), sequência
+_LUA_INCLUIR = _LUA_AGORA + """
+local id = redis.call('INCR', KEYS[3])
+redis.call('HSET', KEYS[2], id, ARGV[1])
+redis.call('ZADD', KEYS[1], agora, id)
+return id
+"""
+
+# KEYS: prontos, itens, tentativas (hash id -> falhas)
+_LUA_RESERVAR = _LUA_AGORA + """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', agora, 'LIMIT', 0, tonumber(ARGV[1]))
+local itens = {}
+for _, id in ipairs(ids) do
+  redis.call('ZADD', KEYS[1], agora + tonumber(ARGV[2]), id)
+  table.insert(itens, id)
+  table.insert(itens, redis.call('HGET', KEYS[2], id))
+  table.insert(itens, redis.call('HGET', KEYS[3], id) or '0')
+end
+return itens
+"""
+
+# ARGV[1]: '1' para contar a falha; demais: ids
+_LUA_FALHAR = _LUA_AGORA + """
+for i = 2, #ARGV do
+  local id = ARGV[i]
+  if redis.call('ZSCORE', KEYS[1], id) then
+    redis.call('ZADD', KEYS[1], agora, id)
+    if ARGV[1] == '1' then redis.call('HINCRBY', KEYS[2], id, 1) end
+  end
+end
+return #ARGV - 1
+"""
+
+# KEYS: prontos; ARGV[1]: prazo, demais: ids. Só renova reservas ainda vigentes
+_LUA_RENOVAR = _LUA_AGORA + """
+local renovados = 0
+for i = 2, #ARGV do
+  local ate = redis.call('ZSCORE', KEYS[1], ARGV[i])
+  if ate and tonumber(ate) > agora then
+    redis.call('ZADD', KEYS[1], agora + tonumber(ARGV[1]), ARGV[i])
+    renovados = renovados + 1
+  end
+end
+return renovados
+"""
+
+# KEYS: prontos, itens, tentativas, descartados (hash id -> JSON com payload, tentativas e erro)
+_LUA_DESCARTAR = """
+for i = 2, #ARGV do
+  local id = ARGV[i]
+  local payload = redis.call('HGET', KEYS[2], id)
+  if payload then
+    local tentativas = tonumber(redis.call('HGET', KEYS[3], id) or '0') + 1
+    redis.call('HSET', KEYS[4], id, cjson.encode({payload = payload, tentativas = tentativas, erro = ARGV[1]}))
+  end
+  redis.call('ZREM', KEYS[1], id)
+  redis.call('HDEL', KEYS[2], id)
+  redis.call('HDEL', KEYS[3], id)
+end
+return #ARGV - 1
+"""
+
+
+class BackendRedis:
+    def __init__(self, url: str, prefixo: str = "publix", cliente=None):
+        """`cliente`: conexão já criada, com decode_responses (ex.: fakeredis em verificar_estado.py)."""
+        if cliente is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise Exception(f"Erro ao configurar o estado compartilhado: pacote redis não instalado ({e})")
+            cliente = redis.Redis.from_url(url, decode_responses=True)
+        self.url = url
+        self.prefixo = prefixo
+        self._redis = cliente
+        self._tentar = self._redis.register_script(_LUA_TENTAR)
+        self._ajustar = self._redis.register_script(_LUA_AJUSTAR)
+        self._pausar = self._redis.register_script(_LUA_PAUSAR)
+        self._pausa_restante = self._redis.register_script(_LUA_PAUSA_RESTANTE)
+        self._incluir = self._redis.register_script(_LUA_INCLUIR)
+        self._reservar = self._redis.register_script(_LUA_RESERVAR)
+        self._falhar = self._redis.register_script(_LUA_FALHAR)
+        self._renovar = self._redis.register_script(_LUA_RENOVAR)
+        self._descartar = self._redis.register_script(_LUA_DESCARTAR)
+
+    def __repr__(self):
+        return f"BackendRedis({self.url!r})"
+
+    def _k(self, chave: str) -> str:
+        return f"{self.prefixo}:{chave}"
+
+    # Chave-valor
+    def obter(self, chave: str):
+        return self._redis.get(self._k(chave))
+
+    def definir(self, chave: str, valor: str, ttl: float = None):
+        self._redis.set(self._k(chave), valor, px=int(ttl * 1000) if ttl else None)
+
+    def definir_se_ausente(self, chave: str, valor: str, ttl: float = None) -> bool:
+        return bool(self._redis.set(self._k(chave), valor, px=int(ttl * 1000) if ttl else None, nx=True))
+
+    def remover(self, chave: str):
+        self._redis.delete(self._k(chave))
+
+    # Baldes
+    def tentar_baldes(self, chave_pausa: str, pedidos: list) -> float:
+        chaves = [self._k(chave_pausa)] + [self._k(p[0]) for p in pedidos]
+        argumentos = [repr(float(v)) for p in pedidos for v in p[1:]]
+        return float(self._tentar(keys=chaves, args=argumentos))
+
+    def ajustar_balde(self, chave: str, quantidade: float, taxa: float, capacidade: float, zerar: bool = False):
+        self._ajustar(keys=[self._k(chave)],
+                      args=[repr(float(quantidade)), repr(taxa), repr(capacidade), "1" if zerar else "0"])
+
+    def pausar(self, chave: str, segundos: float):
+        self._pausar(keys=[self._k(chave)], args=[repr(float(segundos))])
+
+    def pausa_restante(self, chave: str) -> float:
+        return float(self._pausa_restante(keys=[self._k(chave)]))
+
+    # Fila
+    def _chaves_fila(self, nome: str) -> list:
+        return [self._k(f"fila:{nome}:prontos"), self._k(f"fila:{nome}:itens"), self._k(f"fila:{nome}:seq")]
+
+    def fila_incluir(self, nome: str, payload: str):
+        self._incluir(keys=self._chaves_fila(nome), args=[payload])
+
+    def fila_reservar(self, nome: str, quantidade: int, prazo: float) -> list:
+        chaves = self._chaves_fila(nome)[:2] + [self._k(f"fila:{nome}:tentativas")]
+        itens = self._reservar(keys=chaves, args=[int(quantidade), repr(float(prazo))])
+        return [(int(itens[i]), itens[i + 1], int(itens[i + 2])) for i in range(0, len(itens), 3)]
+
+    def fila_confirmar(self, nome: str, ids: list):
+        if not ids:
+            return
+        prontos, itens, _ = self._chaves_fila(nome)
+        with self._redis.pipeline() as pipe:
+            pipe.zrem(prontos, *ids)
+            pipe.hdel(itens, *ids)
+            pipe.hdel(self._k(f"fila:{nome}:tentativas"), *ids)
+            pipe.execute()
+
+    def fila_falhar(self, nome: str, ids: list, contar: bool = True):
+        if ids:
+            self._falhar(keys=[self._chaves_fila(nome)[0], self._k(f"fila:{nome}:tentativas")],
+                         args=["1" if contar else "0"] + [str(i) for i in ids])
+
+    def fila_renovar(self, nome: str, ids: list, prazo: float) -> int:
+        if not ids:
+            return 0
+        return int(self._renovar(keys=[self._chaves_fila(nome)[0]], args=[repr(float(prazo))] + [str(i) for i in ids]))
+
+    def fila_descartar(self, nome: str, ids: list, erro: str):
+        if ids:
+            chaves = self._chaves_fila(nome)[:2] + [self._k(f"fila:{nome}:tentativas"),
+                                                     self._k(f"fila:{nome}:descartados")]
+            self._descartar(keys=chaves, args=[erro or ""] + [str(i) for i in ids])
+
+    def fila_profundidade(self, nome: str) -> int:
+        return int(self._redis.zcard(self._chaves_fila(nome)[0]))
+
+
+def criar_backend(url: str):
+    """Backend pela URL (redis://, rediss:// ou sqlite:///caminho); vazio devolve None (estado só do processo)."""
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        backend = BackendRedis(url)
+    elif url.startswith("sqlite:///"):
+        backend = BackendSQLite(Path(url[len("sqlite:///"):]))
+    else:
+        raise Exception(f"Erro ao configurar o estado compartilhado: URL não suportada: {url}")
+    metricas.definir("estado_compartilhado_ativo", 1, backend=type(backend).__name__)
+    return backend
@@ -0,0 +1,307 @@
+"""Fila persistente de e-mails de saída com conexões SMTP reaproveitadas.
+
+Cada envio é registrado por id_resposta em SQLite; workers de fundo drenam a fila
+mantendo a conexão SMTP autenticada aberta entre mensagens, com novas tentativas
+em backoff exponencial. O status de entrega fica consultável a qualquer momento.
+"""
+import json
+import logging
+import random
+import smtplib
+import sqlite3
+import ssl
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+import metricas
+
+logger = logging.getLogger("observatorio.email")
+
+PENDENTE = "pendente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+FALHOU = "falhou"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    id_resposta TEXT PRIMARY KEY,
+    destinatario TEXT NOT NULL,
+    dados TEXT NOT NULL,
+    status TEXT NOT NULL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    proxima_tentativa REAL NOT NULL,
+    ultimo_erro TEXT,
+    criado_em REAL NOT NULL,
+    atualizado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_emails_fila ON emails (status, proxima_tentativa);
+"""
+
+
+class ConexaoSMTP:
+    """Conexão SMTP autenticada mantida aberta entre envios.
+
+    `seguranca`: "ssl" (SMTP_SSL), "starttls" ou "nenhuma" (servidor local de testes).
+    """
+
+    def __init__(self, host: str, porta: int, usuario: str = None, senha: str = None,
+                 seguranca: str = "starttls", timeout: float = 30.0, ocioso_maximo: float = 120.0):
+        self.host = host
+        self.porta = porta
+        self.usuario = usuario
+        self.senha = senha
+        self.seguranca = seguranca
+        self.timeout = timeout
+        self.ocioso_maximo = ocioso_maximo
+        self._server = None
+        self._ultimo_uso = 0.0
+
+    def _abrir(self):
+        inicio = time.perf_counter()
+        context = ssl.create_default_context()
+        if self.seguranca == "ssl":
+            server = smtplib.SMTP_SSL(self.host, self.porta, context=context, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.porta, timeout=self.timeout)
+            server.ehlo()
+            if self.seguranca == "starttls":
+                server.starttls(context=context)
+                server.ehlo()
+        if self.usuario and self.senha:
+            server.login(self.usuario, self.senha)
+        metricas.incrementar("smtp_conexoes_abertas_total")
+        metricas.observar("smtp_abertura_conexao_segundos", time.perf_counter() - inicio)
+        self._server = server
+
+    def _viva(self) -> bool:
+        if self._server is None:
+            return False
+        if time.monotonic() - self._ultimo_uso > self.ocioso_maximo:
+            self.fechar()
+            return False
+        try:
+            return self._server.noop()[0] == 250
+        except Exception:
+            self._server = None
+            return False
+
+    def enviar(self, msg):
+        # Conexão velha só é trocada antes da transação (o noop de _viva). Uma queda durante o
+        # send_message não é reenviada aqui: o servidor pode já ter aceitado a mensagem, e a
+        # nova tentativa fica com a fila, que conta a tentativa e espera o backoff
+        if not self._viva():
+            self._abrir()
+        try:
+            self._server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            try:
+                self._server.close()
+            except Exception:
+                pass
+            self._server = None
+            raise
+        self._ultimo_uso = time.monotonic()
+
+    def fechar(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+        self._server = None
+
+
+class FilaEmail:
+    def __init__(
+        self,
+        caminho: Path,
+        preparar_mensagem: Callable[[str, dict], object],
+        criar_conexao: Callable[[], ConexaoSMTP],
+        trabalhadores: int = 1,
+        max_tentativas: int = 6,
+        espera_inicial: float = 5.0,
+        espera_maxima: float = 600.0,
+        intervalo: float = 1.0,
+    ):
+        self.preparar_mensagem = preparar_mensagem
+        self.criar_conexao = criar_conexao
+        self.trabalhadores = max(1, trabalhadores)
+        self.max_tentativas = max_tentativas
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.intervalo = intervalo
+
+        caminho = Path(caminho)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(caminho), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_ESQUEMA)
+        # Envios interrompidos por reinício voltam para a fila
+        self._conn.execute("UPDATE emails SET status = ? WHERE status = ?", (PENDENTE, ENVIANDO))
+        self._lock = threading.Lock()
+        self._sinal = threading.Event()
+        self._parar = threading.Event()
+        self._threads = []
+
+    # -------------------
+    # API pública
+    # -------------------
+    def enfileirar(self, id_resposta: str, destinatario: str, dados: dict):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO emails (id_resposta, destinatario, dados, status,"
+                " proxima_tentativa, criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (id_resposta, destinatario, json.dumps(dados, ensure_ascii=False, default=str),
+                 PENDENTE, agora, agora, agora),
+            )
+        metricas.incrementar("email_enfileirados_total")
+        self._atualizar_profundidade()
+        self._sinal.set()
+
+    def importar(self, caminho: Path) -> int:
+        """Move para esta fila os e-mails não entregues de uma fila antiga que deixou de ser lida
+        (ex.: dados/fila_email.db de antes do REPLICA_ID). Retorna quantos vieram.
+
+        A fila antiga fica travada durante a cópia, para que réplicas que sobem juntas não enviem
+        o mesmo e-mail duas vezes; o histórico de enviados e falhos continua lá.
+        """
+        caminho = Path(caminho)
+        if not caminho.exists():
+            return 0
+        conn = sqlite3.connect(str(caminho), timeout=30, isolation_level=None)
+        try:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'emails'").fetchone():
+                return 0
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                linhas = conn.execute(
+                    "SELECT id_resposta, destinatario, dados, tentativas, proxima_tentativa, ultimo_erro, criado_em"
+                    " FROM emails WHERE status IN (?, ?)",
+                    (PENDENTE, ENVIANDO),
+                ).fetchall()
+                agora = time.time()
+                with self._lock:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO emails (id_resposta, destinatario, dados, status, tentativas,"
+                        " proxima_tentativa, ultimo_erro, criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(i, d, dados, PENDENTE, t, p, e, c, agora) for i, d, dados, t, p, e, c in linhas],
+                    )
+                conn.executemany("DELETE FROM emails WHERE id_resposta = ?", [(l[0],) for l in linhas])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        if linhas:
+            metricas.incrementar("email_importados_total", len(linhas))
+            logger.warning("%d e-mail(s) não entregue(s) importado(s) de %s", len(linhas), caminho)
+            self._atualizar_profundidade()
+            self._sinal.set()
+        return len(linhas)
+
+    def status(self, id_resposta: str):
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT status, tentativas, ultimo_erro, atualizado_em FROM emails WHERE id_resposta = ?",
+                (id_resposta,),
+            ).fetchone()
+        if not linha:
+            return None
+        return {"status": linha[0], "tentativas": linha[1], "ultimo_erro": linha[2], "atualizado_em": linha[3]}
+
+    def profundidade(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM emails WHERE status IN (?, ?)", (PENDENTE, ENVIANDO)
+            ).fetchone()[0]
+
+    def iniciar(self):
+        if any(t.is_alive() for t in self._threads):
+            return
+        self._parar.clear()
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"fila-email-{i}", daemon=True)
+            for i in range(self.trabalhadores)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def parar(self, timeout: float = 10.0):
+        self._parar.set()
+        self._sinal.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    # -------------------
+    # Worker
+    # -------------------
+    def _reservar(self):
+        agora = time.time()
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT id_resposta, destinatario, dados, tentativas FROM emails"
+                " WHERE status = ? AND proxima_tentativa <= ? ORDER BY proxima_tentativa LIMIT 1",
+                (PENDENTE, agora),
+            ).fetchone()
+            if linha:
+                self._conn.execute(
+                    "UPDATE emails SET status = ?, atualizado_em = ? WHERE id_resposta = ?",
+                    (ENVIANDO, agora, linha[0]),
+                )
+        return linha
+
+    def _loop(self):
+        # Cada worker mantém a sua conexão, criada no primeiro envio
+        conexao = [None]
+        try:
+            while not self._parar.is_set():
+                item = self._reservar()
+                if item is None:
+                    self._sinal.wait(self.intervalo)
+                    self._sinal.clear()
+                    continue
+                self._processar(conexao, *item)
+        finally:
+            if conexao[0] is not None:
+                conexao[0].fechar()
+
+    def _processar(self, conexao: list, id_resposta: str, destinatario: str, dados: str, tentativas: int):
+        inicio = time.perf_counter()
+        try:
+            msg = self.preparar_mensagem(destinatario, json.loads(dados))
+            if conexao[0] is None:
+                conexao[0] = self.criar_conexao()
+            conexao[0].enviar(msg)
+        except Exception as e:
+            tentativas += 1
+            definitivo = tentativas >= self.max_tentativas
+            espera = min(self.espera_inicial * (2 ** (tentativas - 1)), self.espera_maxima)
+            espera *= random.uniform(0.8, 1.2)
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE emails SET status = ?, tentativas = ?, proxima_tentativa = ?,"
+                    " ultimo_erro = ?, atualizado_em = ? WHERE id_resposta = ?",
+                    (FALHOU if definitivo else PENDENTE, tentativas, time.time() + espera,
+                     str(e), time.time(), id_resposta),
+                )
+            metricas.incrementar("email_falhas_total", definitivo=definitivo)
+            logger.warning("Falha no envio do e-mail %s (tentativa %d): %s", id_resposta, tentativas, e)
+            self._atualizar_profundidade()
+            return
+
+        with self._lock:
+            self._conn.execute(
+                "UPDATE emails SET status = ?, tentativas = ?, ultimo_erro = NULL, atualizado_em = ?"
+                " WHERE id_resposta = ?",
+                (ENVIADO, tentativas + 1, time.time(), id_resposta),
+            )
+        metricas.observar("email_envio_segundos", time.perf_counter() - inicio)
+        metricas.incrementar("email_enviados_total")
+        self._atualizar_profundidade()
+
+    def _atualizar_profundidade(self):
+        metricas.definir("email_fila_profundidade", self.profundidade())
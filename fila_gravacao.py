@@ -0,0 +1,321 @@
+"""Fila de gravação write-behind com diário local em SQLite.
+
+Os registros entram no diário (durável) e uma thread de fundo descarrega lotes
+para o destino final. O que não foi descarregado sobrevive a reinícios e quedas.
+Com várias réplicas, o diário pode ser uma FilaCompartilhada: cada lote fica
+reservado para a réplica que o pegou, e qualquer uma drena o que as outras deixaram.
+
+Quando um lote falha por causa dos dados (não do destino), os registros passam a
+ser gravados um a um; o que continuar falhando depois de `max_tentativas` vai
+para a tabela de descartados, com o erro, e deixa de bloquear os seguintes.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+import metricas
+
+logger = logging.getLogger("observatorio.fila")
+
+
+class DiarioLocal:
+    """Diário SQLite de um único processo, com a mesma interface da FilaCompartilhada."""
+
+    def __init__(self, caminho: Path):
+        caminho = Path(caminho)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(caminho), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pendentes ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload TEXT NOT NULL,"
+            " criado_em REAL NOT NULL,"
+            " tentativas INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS descartados ("
+            " seq INTEGER PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " criado_em REAL NOT NULL,"
+            " tentativas INTEGER NOT NULL,"
+            " erro TEXT,"
+            " descartado_em REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def incluir(self, payload: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pendentes (payload, criado_em) VALUES (?, ?)",
+                (payload, time.time()),
+            )
+
+    def reservar(self, quantidade: int) -> list:
+        """Lista de (seq, payload, tentativas); sem reserva: só a thread da fila (serializada) lê o diário."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, payload, tentativas FROM pendentes ORDER BY seq LIMIT ?",
+                (quantidade,),
+            ).fetchall()
+
+    def confirmar(self, ids: list):
+        with self._lock:
+            self._conn.executemany("DELETE FROM pendentes WHERE seq = ?", [(s,) for s in ids])
+
+    def falhar(self, ids: list, contar: bool = True):
+        """Devolve os itens à fila; `contar` soma a falha às tentativas que levam ao descarte."""
+        if not contar:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE pendentes SET tentativas = tentativas + 1 WHERE seq = ?",
+                [(s,) for s in ids],
+            )
+
+    def renovar(self, ids: list) -> int:
+        # Sem reserva a renovar: o diário local é de um processo só
+        return len(ids)
+
+    def descartar(self, ids: list, erro: str):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for seq in ids:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO descartados (seq, payload, criado_em, tentativas, erro, descartado_em)"
+                    " SELECT seq, payload, criado_em, tentativas + 1, ?, ? FROM pendentes WHERE seq = ?",
+                    (erro, time.time(), seq),
+                )
+                self._conn.execute("DELETE FROM pendentes WHERE seq = ?", (seq,))
+            self._conn.execute("COMMIT")
+
+    def profundidade(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pendentes").fetchone()[0]
+
+
+class FilaGravacao:
+    def __init__(
+        self,
+        caminho_diario: Path,
+        gravar_lote: Callable[[list], None],
+        nome: str = "planilha",
+        tamanho_lote: int = 50,
+        intervalo: float = 2.0,
+        janela_agrupamento: float = 0.5,
+        espera_maxima: float = 60.0,
+        diario=None,
+        max_tentativas: int = 5,
+        erro_do_registro: Callable[[Exception], bool] = None,
+    ):
+        self.nome = nome
+        self.gravar_lote = gravar_lote
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.janela_agrupamento = janela_agrupamento
+        self.espera_maxima = espera_maxima
+        self.max_tentativas = max(1, max_tentativas)
+        # Diz se a falha pode ser culpa dos dados (ex.: 400); as demais (destino fora do ar, cota)
+        # só adiam o lote. Sem ela, toda falha conta para o descarte.
+        self.erro_do_registro = erro_do_registro
+
+        # `diario` (ex.: FilaCompartilhada) substitui o arquivo local em caminho_diario
+        self._diario = diario if diario is not None else DiarioLocal(caminho_diario)
+        self._lock_descarga = threading.Lock()
+        self._sinal = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        # Registros ainda a gravar um a um depois de um lote recusado
+        self._isolar = 0
+        self._atualizar_profundidade()
+
+    # -------------------
+    # API pública
+    # -------------------
+    def enfileirar(self, registro: dict):
+        self._diario.incluir(json.dumps(registro, ensure_ascii=False, default=str))
+        metricas.incrementar("fila_enfileirados_total", fila=self.nome)
+        self._atualizar_profundidade()
+        self._sinal.set()
+
+    def profundidade(self) -> int:
+        return self._diario.profundidade()
+
+    def importar_diario(self, caminho: Path) -> int:
+        """Move para esta fila os pendentes de um diário local que deixou de ser lido (ex.: dados/fila_planilha.db
+        de antes do REPLICA_ID ou do estado compartilhado). Retorna quantos vieram.
+
+        O diário antigo fica travado (BEGIN IMMEDIATE) durante a cópia: réplicas que sobem juntas
+        importam cada registro uma única vez. Os descartados continuam lá, para consulta.
+        """
+        caminho = Path(caminho)
+        if not caminho.exists():
+            return 0
+        conn = sqlite3.connect(str(caminho), timeout=30, isolation_level=None)
+        try:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pendentes'").fetchone():
+                return 0
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                linhas = conn.execute("SELECT seq, payload FROM pendentes ORDER BY seq").fetchall()
+                for seq, payload in linhas:
+                    self._diario.incluir(payload)
+                    conn.execute("DELETE FROM pendentes WHERE seq = ?", (seq,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        if linhas:
+            metricas.incrementar("fila_importados_total", len(linhas), fila=self.nome)
+            logger.warning("Fila '%s': %d registro(s) pendente(s) importado(s) de %s", self.nome, len(linhas), caminho)
+            self._atualizar_profundidade()
+            self._sinal.set()
+        return len(linhas)
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"fila-{self.nome}", daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout: float = 10.0):
+        """Interrompe o worker tentando uma última descarga; o restante fica no diário."""
+        self._parar.set()
+        self._sinal.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def esvaziar(self, timeout: float = 30.0) -> bool:
+        """Descarrega tudo o que estiver pendente na thread atual (uso em scripts e testes)."""
+        limite = time.monotonic() + timeout
+        while self.profundidade() and time.monotonic() < limite:
+            descarregou = self._descarregar_lote()
+            if descarregou is False:
+                return False
+            if descarregou is None:
+                time.sleep(0.1)
+        return self.profundidade() == 0
+
+    # -------------------
+    # Worker
+    # -------------------
+    def _loop(self):
+        espera = self.intervalo
+        while not self._parar.is_set():
+            acordou = self._sinal.wait(espera)
+            self._sinal.clear()
+            if acordou and not self._parar.is_set():
+                # Dá uma janela curta para agrupar envios simultâneos no mesmo lote
+                time.sleep(self.janela_agrupamento)
+
+            ok = True
+            while ok and self.profundidade():
+                descarregou = self._descarregar_lote()
+                if descarregou is None:
+                    # O que resta está reservado por outra réplica
+                    break
+                ok = descarregou
+            espera = self.intervalo if ok else min(max(espera, self.intervalo) * 2, self.espera_maxima)
+
+        # Última tentativa ao encerrar
+        if self.profundidade():
+            self._descarregar_lote()
+
+    def _descarregar_lote(self):
+        """True/False conforme a gravação do lote; None quando não havia nada disponível."""
+        with self._lock_descarga:
+            return self._descarregar_lote_serializado()
+
+    def _descarregar_lote_serializado(self):
+        linhas = self._diario.reservar(1 if self._isolar else self.tamanho_lote)
+        if not linhas:
+            return None
+
+        seqs, registros = [], []
+        for seq, payload, tentativas in linhas:
+            try:
+                registros.append(json.loads(payload))
+                seqs.append(seq)
+            except ValueError as e:
+                self._descartar([seq], f"payload inválido: {e}")
+        if not seqs:
+            return True
+
+        inicio = time.perf_counter()
+        try:
+            with self._reserva_mantida(seqs):
+                self.gravar_lote(registros)
+        except Exception as e:
+            metricas.incrementar("fila_falhas_total", fila=self.nome)
+            logger.warning("Falha ao descarregar lote da fila '%s' (%d registros): %s", self.nome, len(registros), e)
+            if self.erro_do_registro is not None and not self.erro_do_registro(e):
+                # Destino indisponível: não conta contra os registros
+                self._diario.falhar(seqs, contar=False)
+                return False
+            if len(seqs) > 1:
+                # Algum registro do lote é recusado: os próximos saem um a um até passar por este trecho
+                self._diario.falhar(seqs, contar=False)
+                self._isolar = len(seqs)
+                return True
+            if linhas[0][2] + 1 >= self.max_tentativas:
+                self._descartar(seqs, str(e))
+                self._isolar = max(0, self._isolar - 1)
+                return True
+            self._diario.falhar(seqs)
+            return False
+
+        duracao = time.perf_counter() - inicio
+        self._diario.confirmar(seqs)
+        self._isolar = max(0, self._isolar - len(seqs))
+
+        metricas.observar("fila_latencia_descarga_segundos", duracao, fila=self.nome)
+        metricas.observar("fila_tamanho_lote", len(registros), fila=self.nome)
+        metricas.incrementar("fila_gravados_total", len(registros), fila=self.nome)
+        self._atualizar_profundidade()
+        logger.info("Fila '%s': %d registros gravados em %.3fs", self.nome, len(registros), duracao)
+        return True
+
+    @contextmanager
+    def _reserva_mantida(self, seqs: list):
+        """Renova a reserva do lote enquanto ele é gravado: esperas pela cota e backoff podem passar do
+        prazo, e um lote vencido seria pego e gravado de novo por outra réplica."""
+        prazo = getattr(self._diario, "prazo", None)
+        if not prazo:
+            yield
+            return
+        gravado = threading.Event()
+
+        def renovar():
+            while not gravado.wait(prazo / 3):
+                renovados = self._diario.renovar(seqs)
+                if renovados < len(seqs):
+                    metricas.incrementar("fila_reservas_perdidas_total", len(seqs) - renovados, fila=self.nome)
+                    logger.warning("Fila '%s': reserva de %d registro(s) venceu durante a gravação",
+                                   self.nome, len(seqs) - renovados)
+                    return
+
+        thread = threading.Thread(target=renovar, name=f"fila-{self.nome}-reserva", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            gravado.set()
+            thread.join()
+
+    def _descartar(self, seqs: list, erro: str):
+        self._diario.descartar(seqs, erro)
+        metricas.incrementar("fila_descartados_total", len(seqs), fila=self.nome)
+        logger.error("Fila '%s': %d registro(s) descartado(s) após falhas repetidas: %s", self.nome, len(seqs), erro)
+        self._atualizar_profundidade()
+
+    def _atualizar_profundidade(self):
+        metricas.definir("fila_profundidade", self.profundidade(), fila=self.nome)
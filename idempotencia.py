@@ -0,0 +1,85 @@
+"""Índice de submissões recentes, para que o envio do diagnóstico seja idempotente.
+
+A chave combina o identificador da sessão com o conteúdo enviado (instrumento,
+dados institucionais e pessoais, respostas). A primeira execução guarda o
+registro montado e marca cada efeito concluído (gravação, e-mail); uma repetição
+com a mesma chave — clique duplo, reenvio após reconexão — reaproveita o registro
+salvo e só refaz o que ficou pendente. Entradas expiram por TTL.
+"""
+import hashlib
+import json
+
+import metricas
+
+SALVO = "salvo"
+EMAIL = "email"
+
+
+def chave_submissao(id_sessao: str, versao: str, dados_institucionais: dict, dados_pessoais: dict,
+                    respostas: dict) -> str:
+    conteudo = json.dumps(
+        {
+            "s": id_sessao,
+            "v": versao,
+            "inst": dados_institucionais or {},
+            # O e-mail é comparado sem caixa e espaços, como na confirmação do formulário
+            "pes": {k: (v.strip().lower() if k == "email_respondente" and isinstance(v, str) else v)
+                    for k, v in (dados_pessoais or {}).items()},
+            "r": respostas or {},
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+class Submissao:
+    __slots__ = ("chave", "registro", "etapas")
+
+    def __init__(self, chave: str, registro: dict, etapas: set):
+        self.chave = chave
+        self.registro = registro
+        self.etapas = etapas
+
+    def concluiu(self, etapa: str) -> bool:
+        return etapa in self.etapas
+
+
+class IndiceSubmissoes:
+    """Entradas num backend de estado: BackendSQLite local à réplica ou o compartilhado entre réplicas."""
+
+    def __init__(self, backend, ttl_segundos: float = 24 * 3600):
+        self._backend = backend
+        self.ttl_segundos = ttl_segundos
+
+    @staticmethod
+    def _chave(chave: str) -> str:
+        return f"submissao:{chave}"
+
+    @staticmethod
+    def _submissao(chave: str, valor: str) -> Submissao:
+        dados = json.loads(valor)
+        return Submissao(chave, dados["registro"], set(dados["etapas"]))
+
+    @staticmethod
+    def _valor(registro: dict, etapas) -> str:
+        return json.dumps({"registro": registro, "etapas": sorted(etapas)}, ensure_ascii=False, default=str)
+
+    def obter(self, chave: str):
+        """Submissão ainda válida com esta chave, ou None."""
+        valor = self._backend.obter(self._chave(chave))
+        if valor is None:
+            return None
+        metricas.incrementar("submissoes_repetidas_total")
+        return self._submissao(chave, valor)
+
+    def registrar(self, chave: str, registro: dict) -> Submissao:
+        """Guarda o registro antes dos efeitos; se a chave já existe, vale o registro guardado primeiro."""
+        self._backend.definir_se_ausente(self._chave(chave), self._valor(registro, ()), self.ttl_segundos)
+        return self._submissao(chave, self._backend.obter(self._chave(chave)))
+
+    def concluir(self, submissao: Submissao, etapa: str):
+        submissao.etapas.add(etapa)
+        self._backend.definir(self._chave(submissao.chave), self._valor(submissao.registro, submissao.etapas),
+                              self.ttl_segundos)
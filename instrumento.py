@@ -0,0 +1,189 @@
+"""Instrumentos de diagnóstico definidos em arquivos de dados versionados (instrumentos/*.json).
+
+Cada arquivo traz partes → seções → questões. Ao carregar, o instrumento é
+compilado uma vez em estruturas imutáveis (índice por id, parte e seção de cada
+questão, membros de cada seção e dimensão, fatias de página e motor de
+pontuação), compartilhadas pelo app e pelos jobs de linha de comando. Vários
+módulos e versões podem ser servidos ao mesmo tempo.
+"""
+import json
+import math
+import threading
+from pathlib import Path
+from types import MappingProxyType
+
+from pontuacao import MotorPontuacao
+
+DIRETORIO_INSTRUMENTOS = Path(__file__).resolve().parent / "instrumentos"
+
+# Faixas usadas quando o instrumento não define "prioridades": limites em fração da escala
+_PRIORIDADES_GENERICAS = (
+    (0.5, "Prioridade alta", "Estruturar as práticas fundamentais desta dimensão."),
+    (2 / 3, "Prioridade média", "Fortalecer a consistência e a institucionalização das práticas desta dimensão."),
+    (None, "Prioridade de consolidação", "Padronizar e ampliar a disseminação interna das práticas já existentes."),
+)
+
+
+def _faixas_prioridade(faixas: list, versao: str) -> tuple:
+    """Compila [{"ate", "prioridade", "recomendacao"}, ...]; a última faixa, sem "ate", cobre o resto da escala."""
+    compiladas = []
+    for i, faixa in enumerate(faixas):
+        ate = faixa.get("ate")
+        if (ate is None) != (i == len(faixas) - 1):
+            raise Exception(f"Erro no instrumento {versao}: só a última faixa de prioridade fica sem \"ate\"")
+        compiladas.append((math.inf if ate is None else float(ate), faixa["prioridade"], faixa["recomendacao"]))
+    if [f[0] for f in compiladas] != sorted(f[0] for f in compiladas):
+        raise Exception(f"Erro no instrumento {versao}: faixas de prioridade fora de ordem")
+    return tuple(compiladas)
+
+
+class Instrumento:
+    def __init__(self, definicao: dict, origem: str = ""):
+        self.versao = definicao["versao"]
+        self.modulo = definicao.get("modulo", "")
+        self.origem = origem
+        escala = definicao.get("escala", {})
+        self.escala = (int(escala.get("minimo", 0)), int(escala.get("maximo", 3)))
+        self.rotulos_escala = tuple(escala.get("rotulos", ()))
+        self.titulo_relatorio = definicao.get("titulo_relatorio") or " — ".join(
+            filter(None, ["Relatório de Diagnóstico", self.modulo])
+        )
+        # Prioridade e recomendação por faixa de média: da parte (dimensão), do módulo ou genéricas
+        minimo, maximo = self.escala
+        genericas = [
+            {"ate": None if fracao is None else minimo + fracao * (maximo - minimo), "prioridade": p, "recomendacao": r}
+            for fracao, p, r in _PRIORIDADES_GENERICAS
+        ]
+        self._prioridades_modulo = _faixas_prioridade(definicao.get("prioridades") or genericas, self.versao)
+        prioridades_dimensao = {}
+
+        partes, secoes, questoes = {}, {}, []
+        parte_de, secao_de, por_secao = {}, {}, {}
+        for parte in definicao["partes"]:
+            partes[parte["id"]] = parte.get("titulo", "")
+            if parte.get("prioridades"):
+                dimensao = parte.get("dimensao") or parte.get("titulo", "")
+                prioridades_dimensao[dimensao] = _faixas_prioridade(parte["prioridades"], self.versao)
+            for secao in parte.get("secoes", []):
+                secoes[secao["id"]] = secao.get("titulo", "")
+                ids_secao = []
+                for q in secao.get("questoes", []):
+                    qid = q["id"]
+                    if qid in secao_de:
+                        raise Exception(f"Erro no instrumento {self.versao}: questão {qid} repetida")
+                    questoes.append(MappingProxyType({
+                        "id": qid,
+                        "texto": q["texto"],
+                        "dimensao": q.get("dimensao") or parte.get("dimensao") or parte.get("titulo", ""),
+                        "secao": secao["id"],
+                        "parte": parte["id"],
+                    }))
+                    parte_de[qid] = parte["id"]
+                    secao_de[qid] = secao["id"]
+                    ids_secao.append(qid)
+                por_secao[secao["id"]] = tuple(ids_secao)
+
+        self.questoes = tuple(questoes)
+        self.ids = tuple(q["id"] for q in questoes)
+        self.indice = MappingProxyType({qid: i for i, qid in enumerate(self.ids)})
+        self.titulos_partes = MappingProxyType(partes)
+        self.titulos_secoes = MappingProxyType(secoes)
+        self.parte_de = MappingProxyType(parte_de)
+        self.secao_de = MappingProxyType(secao_de)
+        self.questoes_por_secao = MappingProxyType(por_secao)
+        self.dimensoes = tuple(dict.fromkeys(q["dimensao"] for q in questoes))
+        self.motor = MotorPontuacao(self.questoes, secoes)
+        self._prioridades_dimensao = MappingProxyType(prioridades_dimensao)
+        self._paginas = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.questoes)
+
+    def legenda_escala(self) -> str:
+        """Ex.: "0 = Inexistente | 1 = Muito incipiente | ..."; sem rótulos, só os extremos."""
+        minimo, maximo = self.escala
+        if not self.rotulos_escala:
+            return f"{minimo} a {maximo}"
+        return " | ".join(f"{valor} = {rotulo}" for valor, rotulo in zip(range(minimo, maximo + 1), self.rotulos_escala))
+
+    def prioridade(self, dimensao: str, media: float) -> tuple:
+        """(prioridade, recomendação) da faixa em que cai a média da dimensão."""
+        for ate, prioridade, recomendacao in self._prioridades_dimensao.get(dimensao, self._prioridades_modulo):
+            if media < ate:
+                return prioridade, recomendacao
+
+    def recomendacoes(self, medias_dim: dict) -> dict:
+        """Dimensão -> (prioridade, recomendação); é o que os relatórios recebem prontos."""
+        return {dim: self.prioridade(dim, media) for dim, media in medias_dim.items()}
+
+    def questao(self, qid: str):
+        i = self.indice.get(qid)
+        return self.questoes[i] if i is not None else None
+
+    def paginas(self, por_pagina: int) -> tuple:
+        """Fatias das páginas do questionário, calculadas uma vez por tamanho de página."""
+        fatias = self._paginas.get(por_pagina)
+        if fatias is None:
+            total = max(1, math.ceil(len(self.questoes) / por_pagina))
+            fatias = tuple(slice(i * por_pagina, min((i + 1) * por_pagina, len(self.questoes))) for i in range(total))
+            with self._lock:
+                self._paginas[por_pagina] = fatias
+        return fatias
+
+    def pagina(self, numero: int, por_pagina: int) -> tuple:
+        """Questões da página `numero` (a partir de 1)."""
+        return self.questoes[self.paginas(por_pagina)[numero - 1]]
+
+    def pontuar(self, respostas: dict):
+        return self.motor.pontuar(respostas)
+
+
+class CatalogoInstrumentos:
+    """Instrumentos por versão; o padrão é o indicado por `padrao`, ou o marcado com "padrao": true."""
+
+    def __init__(self, diretorio: Path = DIRETORIO_INSTRUMENTOS, padrao: str = None):
+        self.diretorio = Path(diretorio)
+        self._instrumentos = {}
+        marcado = None
+        for caminho in sorted(self.diretorio.glob("*.json")):
+            try:
+                with open(caminho, encoding="utf-8") as f:
+                    definicao = json.load(f)
+                instrumento = Instrumento(definicao, origem=caminho.name)
+            except Exception as e:
+                raise Exception(f"Erro ao carregar o instrumento {caminho.name}: {e}")
+            self._instrumentos[instrumento.versao] = instrumento
+            if definicao.get("padrao"):
+                marcado = instrumento.versao
+        if not self._instrumentos:
+            raise Exception(f"Erro ao carregar instrumentos: nenhum arquivo em {self.diretorio}")
+        self.padrao = padrao or marcado or next(iter(self._instrumentos))
+        if self.padrao not in self._instrumentos:
+            raise Exception(f"Erro ao carregar instrumentos: versão padrão {self.padrao} não encontrada")
+
+    def __len__(self):
+        return len(self._instrumentos)
+
+    def __iter__(self):
+        return iter(self._instrumentos.values())
+
+    def obter(self, versao: str = None) -> Instrumento:
+        """Instrumento da versão pedida; versões desconhecidas ou vazias caem no padrão."""
+        return self._instrumentos.get(versao) or self._instrumentos[self.padrao]
+
+    def versoes(self) -> list:
+        return list(self._instrumentos)
+
+
+_catalogos = {}
+_catalogos_lock = threading.Lock()
+
+
+def carregar_catalogo(diretorio: Path = DIRETORIO_INSTRUMENTOS, padrao: str = None) -> CatalogoInstrumentos:
+    """Catálogo compilado uma única vez por processo para cada (diretório, padrão)."""
+    chave = (str(Path(diretorio).resolve()), padrao)
+    with _catalogos_lock:
+        if chave not in _catalogos:
+            _catalogos[chave] = CatalogoInstrumentos(diretorio, padrao)
+        return _catalogos[chave]
@@ -0,0 +1,229 @@
+"""Controle de admissão das chamadas à OpenAI, compartilhado por todas as sessões do processo.
+
+Cada chamada precisa de uma vaga de concorrência e de saldo em dois baldes de
+tokens — requisições por minuto e tokens por minuto — antes de ir ao provedor.
+Quem não pode entrar espera numa fila FIFO (só a cabeça da fila é admitida,
+então chamadas grandes não são ultrapassadas indefinidamente pelas pequenas);
+com a fila cheia ou a espera longa demais, a chamada é recusada com
+`LimiteIAExcedido` para a interface avisar o usuário. Um 429 com Retry-After
+pausa as admissões de todo o processo, e as novas tentativas usam jitter.
+
+Com um backend de estado compartilhado, os baldes e a pausa valem para todas as
+réplicas; a fila e as vagas simultâneas continuam por processo.
+"""
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import metricas
+from estado_compartilhado import criar_baldes
+
+logger = logging.getLogger("observatorio.ia")
+
+
+class LimiteIAExcedido(Exception):
+    """A chamada não foi admitida: fila cheia ou espera acima do limite."""
+
+    def __init__(self, mensagem: str, espera_estimada: float = None):
+        super().__init__(mensagem)
+        self.espera_estimada = espera_estimada
+
+
+class Permissao:
+    """Vaga concedida; liberar ao fim da chamada (inclusive do streaming)."""
+
+    def __init__(self, limitador: "LimitadorIA", tokens_reservados: int):
+        self._limitador = limitador
+        self.tokens_reservados = tokens_reservados
+        self._liberada = False
+
+    def registrar_uso(self, tokens: int):
+        """Acerta o balde de tokens com o consumo real informado pela API."""
+        self._limitador._ajustar_tokens(tokens - self.tokens_reservados)
+        self.tokens_reservados = tokens
+
+    def liberar(self):
+        if not self._liberada:
+            self._liberada = True
+            self._limitador._liberar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+class LimitadorIA:
+    def __init__(self, requisicoes_por_minuto: float = 500, tokens_por_minuto: float = 200000,
+                 simultaneas: int = 16, fila_maxima: int = 64, espera_maxima: float = 60.0, backend=None):
+        self.simultaneas = max(1, simultaneas)
+        self.fila_maxima = max(0, fila_maxima)
+        self.espera_maxima = espera_maxima
+        self._baldes = criar_baldes(
+            {"requisicoes": requisicoes_por_minuto, "tokens": tokens_por_minuto}, backend, prefixo="ia"
+        )
+        self._cond = threading.Condition()
+        self._fila = deque()
+        self._em_curso = 0
+
+    # -------------------
+    # Admissão
+    # -------------------
+    def _tentar(self, tokens: int) -> Optional[float]:
+        """Admite a cabeça da fila se houver vaga e saldo (0.0); senão, segundos de espera,
+        ou None quando depende de uma vaga ser liberada."""
+        if self._em_curso >= self.simultaneas:
+            return None
+        return self._baldes.tentar({"requisicoes": 1, "tokens": tokens})
+
+    def adquirir(self, tokens: int, timeout: float = None, ao_esperar: Callable = None) -> Permissao:
+        """Bloqueia até a vez desta chamada. `ao_esperar(posicao, espera_estimada)` é chamado fora do
+        lock enquanto a chamada aguarda, para a interface mostrar a fila."""
+        timeout = self.espera_maxima if timeout is None else timeout
+        chegada = time.monotonic()
+        limite = chegada + timeout
+        bilhete = object()
+        with self._cond:
+            if len(self._fila) >= self.fila_maxima and (self._fila or self._em_curso >= self.simultaneas):
+                metricas.incrementar("ia_admissao_recusadas_total", motivo="fila_cheia")
+                raise LimiteIAExcedido("Fila de chamadas à IA cheia")
+            self._fila.append(bilhete)
+            metricas.definir("ia_fila_profundidade", len(self._fila))
+
+        try:
+            while True:
+                with self._cond:
+                    agora = time.monotonic()
+                    espera = self._tentar(tokens) if self._fila[0] is bilhete else None
+                    if espera == 0.0:
+                        self._fila.popleft()
+                        self._em_curso += 1
+                        metricas.definir("ia_fila_profundidade", len(self._fila))
+                        metricas.definir("ia_chamadas_em_curso", self._em_curso)
+                        metricas.observar("ia_admissao_espera_segundos", agora - chegada)
+                        self._cond.notify_all()
+                        return Permissao(self, tokens)
+                    restante = limite - agora
+                    if restante <= 0:
+                        metricas.incrementar("ia_admissao_recusadas_total", motivo="espera")
+                        raise LimiteIAExcedido("Tempo de espera pela IA esgotado", espera)
+                    posicao = self._fila.index(bilhete) + 1
+                    self._cond.wait(min(restante, espera if espera else 1.0, 1.0))
+                if ao_esperar is not None:
+                    ao_esperar(posicao, espera)
+        except BaseException:
+            with self._cond:
+                if bilhete in self._fila:
+                    self._fila.remove(bilhete)
+                    metricas.definir("ia_fila_profundidade", len(self._fila))
+                self._cond.notify_all()
+            raise
+
+    def cobrar_nova_tentativa(self, tokens: int, timeout: float = None):
+        """Debita dos baldes a nova tentativa de uma chamada já admitida (a vaga continua a mesma);
+        espera o saldo sem passar pela fila."""
+        timeout = self.espera_maxima if timeout is None else timeout
+        limite = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                espera = self._baldes.tentar({"requisicoes": 1, "tokens": tokens})
+                if espera == 0.0:
+                    return
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    metricas.incrementar("ia_admissao_recusadas_total", motivo="espera_retentativa")
+                    raise LimiteIAExcedido("Tempo de espera pela IA esgotado", espera)
+                self._cond.wait(min(restante, espera, 1.0))
+
+    def _liberar(self):
+        with self._cond:
+            self._em_curso -= 1
+            metricas.definir("ia_chamadas_em_curso", self._em_curso)
+            self._cond.notify_all()
+
+    def _ajustar_tokens(self, diferenca: int):
+        self._baldes.ajustar("tokens", diferenca)
+        with self._cond:
+            self._cond.notify_all()
+
+    def pausar(self, segundos: float):
+        """Suspende novas admissões (Retry-After do provedor vale para o processo inteiro)."""
+        self._baldes.pausar(segundos)
+        with self._cond:
+            self._cond.notify_all()
+
+    def situacao(self) -> dict:
+        with self._cond:
+            return {
+                "fila": len(self._fila),
+                "em_curso": self._em_curso,
+                "pausado_por": self._baldes.pausado_por(),
+            }
+
+
+# -------------------
+# Novas tentativas
+# -------------------
+STATUS_TRANSITORIOS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def segundos_retry_after(erro) -> Optional[float]:
+    """Retry-After (segundos ou data HTTP) ou retry-after-ms da resposta de erro, se houver."""
+    cabecalhos = getattr(getattr(erro, "response", None), "headers", None) or {}
+    try:
+        ms = cabecalhos.get("retry-after-ms")
+        if ms:
+            return max(0.0, float(ms) / 1000)
+        valor = cabecalhos.get("retry-after")
+        if not valor:
+            return None
+        try:
+            return max(0.0, float(valor))
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def erro_transitorio(erro) -> bool:
+    status = getattr(erro, "status_code", None)
+    if status is not None:
+        return status in STATUS_TRANSITORIOS
+    import openai
+
+    return isinstance(erro, openai.APIConnectionError)
+
+
+def executar_com_retentativas(funcao: Callable, limitador: LimitadorIA = None, tentativas: int = 3,
+                              base: float = 0.5, teto: float = 20.0, permissao: Permissao = None):
+    """Chama `funcao()` com até `tentativas` novas tentativas em erros transitórios.
+
+    Com Retry-After, espera o indicado (+ até 20% de jitter) e pausa o limitador;
+    sem ele, backoff exponencial com jitter completo. Cada nova tentativa é uma
+    requisição a mais para o provedor: com `limitador`, debita de novo os baldes
+    (os tokens reservados em `permissao`) antes de repetir.
+    """
+    for tentativa in range(tentativas + 1):
+        if tentativa and limitador is not None:
+            limitador.cobrar_nova_tentativa(permissao.tokens_reservados if permissao is not None else 0)
+        try:
+            return funcao()
+        except Exception as e:
+            if tentativa >= tentativas or not erro_transitorio(e):
+                raise
+            retry_after = segundos_retry_after(e)
+            if retry_after is not None:
+                espera = retry_after * random.uniform(1.0, 1.2)
+                if limitador is not None:
+                    limitador.pausar(retry_after)
+            else:
+                espera = random.uniform(0, min(teto, base * 2 ** tentativa))
+            status = getattr(e, "status_code", None) or type(e).__name__
+            metricas.incrementar("ia_retentativas_total", motivo=status)
+            logger.info("Chamada à IA falhou (%s); nova tentativa em %.1f s", status, espera)
+            time.sleep(espera)
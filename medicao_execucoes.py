@@ -0,0 +1,111 @@
+"""Medição das execuções do script do Streamlit.
+
+Conta execuções completas e de fragmentos, o tempo de cada uma e os bytes de
+mensagens enviados ao navegador, para comparar o custo de cada interação.
+
+O Streamlit não expõe os bytes enviados; eles são somados envolvendo, só durante
+a medição, a função interna que enfileira as mensagens da sessão. Numa versão
+sem ela, execuções e tempos continuam medidos e os bytes ficam de fora.
+"""
+import functools
+import time
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import metricas
+
+
+class _ContadorBytes:
+    """Soma os bytes das mensagens da sessão enquanto instalado; `remover` devolve a função original."""
+
+    def __init__(self, ctx):
+        self.total = 0
+        self._ctx = ctx
+        self._original = getattr(ctx, "_enqueue", None)
+        self._envolvida = None
+        if callable(self._original):
+            original = self._original
+
+            def _enqueue(msg):
+                self.total += msg.ByteSize()
+                original(msg)
+
+            self._envolvida = _enqueue
+            ctx._enqueue = _enqueue
+
+    @property
+    def ativo(self) -> bool:
+        return self._envolvida is not None
+
+    def remover(self):
+        # Só desfaz se ninguém envolveu por cima depois (contadores são removidos na ordem inversa)
+        if self._envolvida is not None and self._ctx._enqueue is self._envolvida:
+            self._ctx._enqueue = self._original
+        self._envolvida = None
+
+
+def _execucao_de_fragmento(ctx) -> bool:
+    return bool(ctx.fragment_ids_this_run)
+
+
+def execucao_de_fragmento() -> bool:
+    """True quando a execução atual reexecuta só fragmentos (não o script inteiro)."""
+    ctx = get_script_run_ctx()
+    return ctx is not None and _execucao_de_fragmento(ctx)
+
+
+def iniciar_execucao(estado):
+    """Chamar no topo do script; `estado` é o st.session_state da sessão."""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    anterior = estado.get("_execucao_em_curso")
+    if anterior:
+        # A anterior terminou com st.rerun/st.stop antes de chegar ao fim do script
+        anterior[1].remover()
+        metricas.incrementar("streamlit_execucoes_total", tipo="interrompida")
+    estado["_execucao_em_curso"] = (time.perf_counter(), _ContadorBytes(ctx))
+
+
+def concluir_execucao(estado):
+    """Chamar no fim do script."""
+    ctx = get_script_run_ctx()
+    em_curso = estado.get("_execucao_em_curso")
+    if ctx is None or not em_curso:
+        return
+    inicio, contador = em_curso
+    estado["_execucao_em_curso"] = None
+    medir_bytes = contador.ativo
+    contador.remover()
+    metricas.incrementar("streamlit_execucoes_total", tipo="completa")
+    metricas.observar("streamlit_execucao_segundos", time.perf_counter() - inicio, tipo="completa")
+    if medir_bytes:
+        metricas.observar("streamlit_payload_bytes", contador.total, tipo="completa")
+
+
+def medir_fragmento(nome: str):
+    """Decorador aplicado sob @st.fragment: mede cada execução do corpo do fragmento."""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            ctx = get_script_run_ctx()
+            if ctx is None:
+                return funcao(*args, **kwargs)
+            contador = _ContadorBytes(ctx)
+            medir_bytes = contador.ativo
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                contador.remover()
+                duracao = time.perf_counter() - inicio
+                metricas.observar("streamlit_fragmento_segundos", duracao, fragmento=nome)
+                if medir_bytes:
+                    metricas.observar("streamlit_fragmento_payload_bytes", contador.total, fragmento=nome)
+                if _execucao_de_fragmento(ctx):
+                    metricas.incrementar("streamlit_execucoes_total", tipo="fragmento")
+                    metricas.observar("streamlit_execucao_segundos", duracao, tipo="fragmento")
+                    if medir_bytes:
+                        metricas.observar("streamlit_payload_bytes", contador.total, tipo="fragmento")
+        return envolvida
+    return decorador
@@ -0,0 +1,124 @@
+"""Conta as execuções do script no preenchimento do questionário, por modo.
+
+Percorre com o AppTest do Streamlit, do primeiro slider até "Gerar diagnóstico",
+o instrumento padrão com todas as respostas alteradas, no modo formulário (um
+envio por bloco) e no modo interativo (QUESTIONARIO_FORMULARIO=0, uma execução
+por slider). Cada modo roda num processo próprio, com os dublês do teste de
+carga sem latência, e o relatório traz execuções do script (completas e de
+fragmentos, lidas das métricas do app), tempo de CPU e se as respostas
+pontuadas são as mesmas que foram marcadas.
+
+Uso:
+    python medir_questionario.py
+    python medir_questionario.py --modo interativo --json questionario.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODOS = {"formulario": "1", "interativo": "0"}
+
+
+def _execucoes() -> int:
+    import metricas
+
+    return int(sum(
+        valor for chave, valor in metricas.resumo()["contadores"].items()
+        if chave.startswith("streamlit_execucoes_total")
+    ))
+
+
+def medir_modo(modo: str, timeout: float = 120.0) -> dict:
+    """Executa a jornada do questionário neste processo; chamar uma vez por processo."""
+    import teste_carga
+
+    os.environ["QUESTIONARIO_FORMULARIO"] = MODOS[modo]
+    os.environ["PUBLIX_DATA_DIR"] = tempfile.mkdtemp(prefix="publix-questionario-")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-medicao")
+    os.environ.setdefault("LOG_ETAPAS", "0")
+    teste_carga.instalar_dubles(teste_carga.Servico("planilha"), teste_carga.Servico("smtp"),
+                                teste_carga.Servico("ia"))
+
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file("streamlit_app.py", default_timeout=timeout)
+    jornada = teste_carga.Jornada(0, "streamlit_app.py", timeout, "")
+    jornada.at = at
+
+    def etapa1():
+        jornada._campo(at.text_input, "1.1").input("Organização de medição")
+        jornada._campo(at.selectbox, "1.2").select("Executivo")
+        jornada._campo(at.selectbox, "1.3").select("Federal")
+        jornada._campo(at.selectbox, "1.4").select("DF")
+        at.checkbox[0].check()
+        jornada._campo(at.button, "Continuar").click()
+
+    jornada._executar("abertura")
+    jornada._executar("etapa1", etapa1)
+
+    # Do primeiro slider ao diagnóstico: cada resposta sai do valor inicial
+    marcadas = {}
+    antes, cpu = _execucoes(), time.process_time()
+    while True:
+        for i in range(len(at.slider)):
+            slider = at.slider[i]  # no modo interativo a árvore muda a cada execução
+            qid = slider.key.removeprefix("slider_")
+            novo = slider.max if slider.value != slider.max else slider.min
+            marcadas[qid] = novo
+            slider.set_value(novo)
+            if modo == "interativo":
+                at.run()
+        proximo = jornada._campo(at.button, "Próximo")
+        if proximo.disabled:
+            break
+        jornada._executar("questionario", proximo.click)
+    jornada._executar("gerar", jornada._campo(at.button, "Gerar diagnóstico").click)
+    cpu = time.process_time() - cpu
+
+    return {
+        "modo": modo,
+        "questoes": len(marcadas),
+        "execucoes": _execucoes() - antes,
+        "cpu_s": round(cpu, 3),
+        "respostas_iguais": at.session_state["diagnostico_respostas"] == marcadas,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Execuções do script no preenchimento do questionário.")
+    parser.add_argument("--modo", choices=[*MODOS, "ambos"], default="ambos")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Limite por execução do script, em segundos")
+    parser.add_argument("--json", help="Grava o resultado neste arquivo")
+    parser.add_argument("--filho", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.filho:
+        print(json.dumps(medir_modo(args.modo, args.timeout)))
+        return 0
+
+    resultados = []
+    for modo in (MODOS if args.modo == "ambos" else [args.modo]):
+        saida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--filho", "--modo", modo, "--timeout", str(args.timeout)],
+            capture_output=True, text=True,
+        )
+        if saida.returncode != 0:
+            raise Exception(f"Erro ao medir o modo {modo}: {saida.stderr.strip()[-2000:]}")
+        resultados.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+
+    print(f"{'modo':<12}{'questões':>10}{'execuções':>11}{'CPU (s)':>10}  respostas iguais")
+    for r in resultados:
+        print(f"{r['modo']:<12}{r['questoes']:>10}{r['execucoes']:>11}{r['cpu_s']:>10.2f}  "
+              f"{'sim' if r['respostas_iguais'] else 'não'}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+    return 0 if all(r["respostas_iguais"] for r in resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""Métricas internas do Observatório: contadores, gauges e latências em memória.
+
+As observações alimentam tanto os percentis recentes de `resumo()` quanto
+histogramas acumulados, expostos no formato de texto do Prometheus por
+`ServidorMetricas`. `etapa()` mede um trecho do atendimento (duração, erros e
+tamanho do payload) e grava um log estruturado correlacionado por id_resposta.
+"""
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("observatorio.etapas")
+
+_lock = threading.Lock()
+_contadores = defaultdict(float)
+_gauges = {}
+_observacoes = defaultdict(lambda: deque(maxlen=2000))
+_histogramas = {}
+
+# Limites superiores dos baldes, escolhidos pelo sufixo do nome da métrica
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+LIMITES_BYTES = tuple(256 * 4 ** i for i in range(10))  # 256 B a 64 MB
+LIMITES_GERAIS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 100000, 1000000)
+
+
+def _chave(nome: str, rotulos: dict):
+    return nome, tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+
+
+def incrementar(nome: str, valor: float = 1.0, **rotulos):
+    with _lock:
+        _contadores[_chave(nome, rotulos)] += valor
+
+
+def definir(nome: str, valor: float, **rotulos):
+    with _lock:
+        _gauges[_chave(nome, rotulos)] = float(valor)
+
+
+def _limites(nome: str) -> tuple:
+    if nome.endswith("_segundos"):
+        return LIMITES_SEGUNDOS
+    if nome.endswith("_bytes"):
+        return LIMITES_BYTES
+    return LIMITES_GERAIS
+
+
+def observar(nome: str, valor: float, **rotulos):
+    valor = float(valor)
+    chave = _chave(nome, rotulos)
+    with _lock:
+        _observacoes[chave].append(valor)
+        histograma = _histogramas.get(chave)
+        if histograma is None:
+            limites = _limites(nome)
+            histograma = _histogramas[chave] = [limites, [0] * (len(limites) + 1), 0.0]
+        limites, contagens, _ = histograma
+        contagens[bisect_left(limites, valor)] += 1
+        histograma[2] += valor
+
+
+def _percentil(valores_ordenados, p: float):
+    if not valores_ordenados:
+        return None
+    idx = min(len(valores_ordenados) - 1, max(0, int(round(p * (len(valores_ordenados) - 1)))))
+    return valores_ordenados[idx]
+
+
+def _formatar_chave(chave):
+    nome, rotulos = chave
+    if not rotulos:
+        return nome
+    return nome + "{" + ",".join(f"{k}={v}" for k, v in rotulos) + "}"
+
+
+def resumo() -> dict:
+    """Retrato atual das métricas, com p50/p95/p99 das observações recentes."""
+    with _lock:
+        contadores = dict(_contadores)
+        gauges = dict(_gauges)
+        observacoes = {k: sorted(v) for k, v in _observacoes.items()}
+
+    saida = {"contadores": {}, "gauges": {}, "observacoes": {}}
+    for chave, valor in contadores.items():
+        saida["contadores"][_formatar_chave(chave)] = valor
+    for chave, valor in gauges.items():
+        saida["gauges"][_formatar_chave(chave)] = valor
+    for chave, valores in observacoes.items():
+        saida["observacoes"][_formatar_chave(chave)] = {
+            "n": len(valores),
+            "p50": _percentil(valores, 0.50),
+            "p95": _percentil(valores, 0.95),
+            "p99": _percentil(valores, 0.99),
+            "max": valores[-1] if valores else None,
+        }
+    return saida
+
+
+# -------------------
+# Formato Prometheus
+# -------------------
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _rotulos_prometheus(rotulos, extra=()) -> str:
+    pares = list(rotulos) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _numero(valor: float) -> str:
+    return repr(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+def exportar_prometheus() -> str:
+    """Contadores, gauges e histogramas no formato de texto 0.0.4 do Prometheus."""
+    with _lock:
+        contadores = dict(_contadores)
+        gauges = dict(_gauges)
+        histogramas = {k: (v[0], list(v[1]), v[2]) for k, v in _histogramas.items()}
+
+    linhas = []
+
+    def _agrupar(itens):
+        por_nome = defaultdict(list)
+        for (nome, rotulos), valor in itens.items():
+            por_nome[nome].append((rotulos, valor))
+        return sorted(por_nome.items())
+
+    for nome, series in _agrupar(contadores):
+        linhas.append(f"# TYPE {nome} counter")
+        linhas.extend(f"{nome}{_rotulos_prometheus(r)} {_numero(v)}" for r, v in series)
+    for nome, series in _agrupar(gauges):
+        linhas.append(f"# TYPE {nome} gauge")
+        linhas.extend(f"{nome}{_rotulos_prometheus(r)} {_numero(v)}" for r, v in series)
+    for nome, series in _agrupar(histogramas):
+        linhas.append(f"# TYPE {nome} histogram")
+        for rotulos, (limites, contagens, soma) in series:
+            acumulado = 0
+            for limite, contagem in zip(limites, contagens):
+                acumulado += contagem
+                linhas.append(f"{nome}_bucket{_rotulos_prometheus(rotulos, [('le', _numero(limite))])} {acumulado}")
+            acumulado += contagens[-1]
+            linhas.append(f"{nome}_bucket{_rotulos_prometheus(rotulos, [('le', '+Inf')])} {acumulado}")
+            linhas.append(f"{nome}_sum{_rotulos_prometheus(rotulos)} {_numero(soma)}")
+            linhas.append(f"{nome}_count{_rotulos_prometheus(rotulos)} {acumulado}")
+    return "\n".join(linhas) + "\n"
+
+
+# -------------------
+# Etapas do atendimento
+# -------------------
+_id_resposta = contextvars.ContextVar("id_resposta", default=None)
+
+
+def vincular_id_resposta(id_resposta):
+    """Etapas medidas depois disto, na mesma thread ou num contexto copiado dela, levam este id_resposta."""
+    _id_resposta.set(id_resposta)
+
+
+def id_resposta_atual():
+    return _id_resposta.get()
+
+
+class MedicaoEtapa:
+    __slots__ = ("bytes", "erro", "campos")
+
+    def __init__(self, campos: dict):
+        self.bytes = None
+        self.erro = None
+        self.campos = campos
+
+    def falhar(self, erro):
+        """Para falhas tratadas dentro da etapa, que não chegam a levantar exceção."""
+        self.erro = erro if isinstance(erro, str) else type(erro).__name__
+
+
+@contextmanager
+def etapa(nome: str, id_resposta=None, **campos):
+    """Mede um trecho: etapa_duracao_segundos, etapa_erros_total e etapa_payload_bytes (quando
+    `medicao.bytes` é preenchido), mais uma linha de log JSON em observatorio.etapas.
+
+    Interrupções que não são erro (GeneratorExit de um stream fechado no rerun, StopException e
+    RerunException do Streamlit) terminam com status "cancelado", sem contar em etapa_erros_total."""
+    medicao = MedicaoEtapa(campos)
+    inicio = time.perf_counter()
+    cancelado = False
+    try:
+        yield medicao
+    except Exception as e:
+        medicao.falhar(e)
+        raise
+    except BaseException:
+        cancelado = True
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        status = "erro" if medicao.erro else "cancelado" if cancelado else "ok"
+        observar("etapa_duracao_segundos", duracao, etapa=nome)
+        incrementar("etapa_execucoes_total", etapa=nome, status=status)
+        if medicao.erro:
+            incrementar("etapa_erros_total", etapa=nome, erro=medicao.erro)
+        if medicao.bytes is not None:
+            observar("etapa_payload_bytes", medicao.bytes, etapa=nome)
+        if logger.isEnabledFor(logging.INFO):
+            evento = {
+                "evento": "etapa",
+                "etapa": nome,
+                "id_resposta": id_resposta or _id_resposta.get(),
+                "status": status,
+                "duracao_ms": round(duracao * 1000, 1),
+            }
+            if medicao.erro:
+                evento["erro"] = medicao.erro
+            if medicao.bytes is not None:
+                evento["bytes"] = medicao.bytes
+            evento.update(medicao.campos)
+            logger.log(logging.WARNING if medicao.erro else logging.INFO, json.dumps(evento, ensure_ascii=False, default=str))
+
+
+def medir(nome: str, tamanho=None):
+    """Decorador: a função inteira vira a etapa `nome`; `tamanho(resultado)` dá o payload em bytes."""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with etapa(nome) as medicao:
+                resultado = funcao(*args, **kwargs)
+                if tamanho is not None:
+                    medicao.bytes = tamanho(resultado)
+                return resultado
+        return envolvida
+    return decorador
+
+
+# -------------------
+# Endpoint de coleta
+# -------------------
+class _ManipuladorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        corpo = exportar_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+class ServidorMetricas:
+    """GET /metrics em uma thread própria, fora do servidor do Streamlit."""
+
+    def __init__(self, porta: int, endereco: str = "0.0.0.0"):
+        self.porta = porta
+        self.endereco = endereco
+        self._servidor = None
+        self._thread = None
+
+    def iniciar(self):
+        if self._servidor is not None:
+            return
+        self._servidor = ThreadingHTTPServer((self.endereco, self.porta), _ManipuladorMetricas)
+        self._servidor.daemon_threads = True
+        self.porta = self._servidor.server_address[1]
+        self._thread = threading.Thread(target=self._servidor.serve_forever, name="metricas-http", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        if self._servidor is None:
+            return
+        self._servidor.shutdown()
+        self._servidor.server_close()
+        self._servidor = None
+
@@ -0,0 +1,324 @@
+"""Acesso ao Google Sheets: esquema de colunas em cache, gravação por nome de coluna e cota da API."""
+import logging
+import random
+import threading
+import time
+from typing import Callable
+
+from gspread.utils import rowcol_to_a1
+
+import metricas
+from estado_compartilhado import criar_baldes
+
+logger = logging.getLogger("observatorio.planilha")
+
+
+def _chave_aba(aba):
+    planilha = getattr(aba, "spreadsheet", None)
+    return (getattr(planilha, "id", None), getattr(aba, "id", None), getattr(aba, "title", None))
+
+
+class RegistroEsquemas:
+    """Guarda o cabeçalho (linha 1) de cada aba, lido uma única vez por processo.
+
+    As gravações são mapeadas pelo nome da coluna; colunas novas são acrescentadas
+    ao final do cabeçalho existente, sem inserir novas linhas de cabeçalho.
+    """
+
+    def __init__(self):
+        self._cabecalhos = {}
+        self._lock = threading.Lock()
+        # Um lock por aba para as leituras e alterações do cabeçalho: a rede (e a espera pela cota)
+        # não segura quem só consulta o cache nem quem usa outra aba
+        self._locks_aba = {}
+
+    def _lock_aba(self, chave) -> threading.Lock:
+        with self._lock:
+            return self._locks_aba.setdefault(chave, threading.Lock())
+
+    def _em_cache(self, chave):
+        with self._lock:
+            atual = self._cabecalhos.get(chave)
+            return list(atual) if atual is not None else None
+
+    def cabecalho(self, aba) -> list:
+        chave = _chave_aba(aba)
+        atual = self._em_cache(chave)
+        if atual is not None:
+            return atual
+        with self._lock_aba(chave):
+            atual = self._em_cache(chave)
+            if atual is None:
+                atual = list(aba.row_values(1))
+                metricas.incrementar("sheets_leituras_cabecalho_total")
+                with self._lock:
+                    self._cabecalhos[chave] = atual
+            return list(atual)
+
+    def invalidar(self, aba=None):
+        with self._lock:
+            if aba is None:
+                self._cabecalhos.clear()
+            else:
+                self._cabecalhos.pop(_chave_aba(aba), None)
+
+    def garantir_colunas(self, aba, colunas: list) -> list:
+        atual = self.cabecalho(aba)
+        if all(c in atual for c in colunas):
+            return atual
+
+        chave = _chave_aba(aba)
+        with self._lock_aba(chave):
+            # Relê antes de alterar: outra réplica pode ter acrescentado colunas
+            atual = list(aba.row_values(1))
+            faltando = [c for c in colunas if c not in atual]
+            if faltando:
+                inicio = len(atual) + 1
+                novo = atual + faltando
+                col_count = getattr(aba, "col_count", None)
+                if col_count is not None and len(novo) > col_count:
+                    aba.add_cols(len(novo) - col_count)
+                aba.update(
+                    values=[faltando],
+                    range_name=rowcol_to_a1(1, inicio),
+                    value_input_option="USER_ENTERED",
+                )
+                metricas.incrementar("sheets_colunas_adicionadas_total", len(faltando))
+                atual = novo
+            with self._lock:
+                self._cabecalhos[chave] = atual
+            return list(atual)
+
+
+def mapear_linhas(cabecalho: list, registros: list) -> list:
+    """Converte registros em linhas na ordem do cabeçalho, casando pelo nome da coluna."""
+    return [[_valor_celula(r.get(col)) for col in cabecalho] for r in registros]
+
+
+def _valor_celula(valor):
+    if valor is None:
+        return ""
+    return valor
+
+
+# -------------------
+# Cota da API
+# -------------------
+def status_http(erro):
+    """Status HTTP de um erro do gspread (APIError) ou None."""
+    status = getattr(getattr(erro, "response", None), "status_code", None)
+    if status is None:
+        status = getattr(erro, "code", None)
+    return status if isinstance(status, int) and status > 0 else None
+
+
+def erro_transitorio(erro) -> bool:
+    status = status_http(erro)
+    if status is not None:
+        return status == 429 or status >= 500
+    # Falhas de rede (requests.ConnectionError, Timeout) são OSError
+    return isinstance(erro, OSError)
+
+
+def erro_antes_do_envio(erro) -> bool:
+    """O Google certamente não aplicou a chamada: 429, ou a conexão nem chegou a ser aberta."""
+    if status_http(erro) == 429:
+        return True
+    from google.auth.exceptions import RefreshError
+    from urllib3.exceptions import ConnectTimeoutError
+
+    vistos = set()
+    while isinstance(erro, BaseException) and id(erro) not in vistos:
+        vistos.add(id(erro))
+        # NewConnectionError e NameResolutionError são ConnectTimeoutError; RefreshError é a renovação da credencial
+        if isinstance(erro, (ConnectTimeoutError, RefreshError)):
+            return True
+        # requests embrulha o MaxRetryError do urllib3 em args, e o MaxRetryError guarda a causa em reason
+        erro = getattr(erro, "reason", None) or erro.__cause__ or next(
+            (a for a in erro.args if isinstance(a, BaseException)), None
+        )
+    return False
+
+
+class EscritaIncerta(Exception):
+    """Escrita não idempotente (ex.: append_rows) que falhou depois de enviada: pode ter sido aplicada."""
+
+    def __init__(self, erro: Exception):
+        super().__init__(f"escrita possivelmente aplicada: {erro}")
+        self.erro = erro
+
+
+def erro_do_registro(erro) -> bool:
+    """A falha pode vir do conteúdo gravado (400: valor ou intervalo inválido), não da API ou da rede."""
+    status = status_http(erro)
+    if status is not None:
+        return status == 400
+    return isinstance(erro, (ValueError, TypeError))
+
+
+class ClienteSheets:
+    """Aba compartilhada pelo processo, com chamadas dentro da cota por minuto da API.
+
+    Leituras e escritas consomem de baldes separados (a cota do Sheets é contada
+    assim); sem saldo, a chamada espera a reposição. 429 e 5xx são repetidos com
+    backoff exponencial e jitter, e um 429 zera o balde, de modo que as chamadas
+    seguintes andam no ritmo da cota em vez de insistir. A aba é aberta na
+    primeira chamada, na thread que a fizer. Com `backend`, a cota é contada para
+    todas as réplicas juntas.
+
+    Escritas que acrescentam linhas ou colunas só são repetidas quando o Google
+    certamente não as aplicou (429, conexão recusada); nos outros erros sobem como
+    EscritaIncerta, e `anexar_registros` confere a planilha antes de regravar.
+    """
+
+    LEITURAS = frozenset({"row_values", "col_values", "get", "get_all_values", "get_all_records", "batch_get"})
+    ESCRITAS = frozenset({"update", "batch_update", "append_row", "append_rows", "insert_row", "insert_rows",
+                          "add_cols", "add_rows"})
+    NAO_IDEMPOTENTES = frozenset({"append_row", "append_rows", "insert_row", "insert_rows", "add_cols", "add_rows"})
+    CHAVE_REGISTRO = "id_resposta"
+    PRAZO_INCERTEZA = 7 * 24 * 3600
+
+    def __init__(self, abrir_aba: Callable, leituras_por_minuto: float = 60, escritas_por_minuto: float = 60,
+                 tentativas: int = 5, base: float = 1.0, teto: float = 32.0, esquemas: RegistroEsquemas = None,
+                 backend=None):
+        self._abrir_aba = abrir_aba
+        self.tentativas = tentativas
+        self.base = base
+        self.teto = teto
+        self.esquemas = esquemas or RegistroEsquemas()
+        self._baldes = criar_baldes(
+            {"leitura": leituras_por_minuto, "escrita": escritas_por_minuto}, backend, prefixo="sheets"
+        )
+        self._lock_aba = threading.Lock()
+        self._aba = None
+        # Registros de escritas incertas, a conferir na planilha antes de regravar (com `backend`, valem
+        # para a réplica que pegar o lote depois)
+        self._backend = backend
+        self._incertos = set()
+        self._lock_incertos = threading.Lock()
+
+    def aba(self) -> "_AbaComCota":
+        with self._lock_aba:
+            if self._aba is None:
+                self._aba = _AbaComCota(self.executar("leitura", self._abrir_aba), self)
+            return self._aba
+
+    def invalidar(self):
+        """Descarta a aba aberta (credencial expirada, aba recriada); a próxima chamada reabre."""
+        with self._lock_aba:
+            self._aba = None
+        self.esquemas.invalidar()
+
+    def _aguardar_cota(self, tipo: str):
+        inicio = time.monotonic()
+        while True:
+            espera = self._baldes.tentar({tipo: 1})
+            if espera == 0.0:
+                break
+            time.sleep(espera)
+        metricas.observar("sheets_cota_espera_segundos", time.monotonic() - inicio, tipo=tipo)
+
+    def executar(self, tipo: str, funcao: Callable, idempotente: bool = True):
+        """Chama `funcao()` descontando uma unidade da cota de `tipo` ("leitura" ou "escrita") por tentativa.
+
+        Sem `idempotente`, só repete o que certamente não chegou a ser aplicado; as demais falhas
+        transitórias sobem como EscritaIncerta.
+        """
+        for tentativa in range(self.tentativas + 1):
+            self._aguardar_cota(tipo)
+            try:
+                resultado = funcao()
+            except Exception as e:
+                status = status_http(e) or type(e).__name__
+                metricas.incrementar("sheets_chamadas_total", tipo=tipo, status=status)
+                if not erro_transitorio(e):
+                    raise
+                if not idempotente and not erro_antes_do_envio(e):
+                    metricas.incrementar("sheets_escritas_incertas_total", motivo=status)
+                    raise EscritaIncerta(e) from e
+                if tentativa >= self.tentativas:
+                    raise
+                if status == 429:
+                    self._baldes.esvaziar(tipo)
+                espera = random.uniform(0, min(self.teto, self.base * 2 ** tentativa))
+                metricas.incrementar("sheets_retentativas_total", tipo=tipo, motivo=status)
+                logger.info("Chamada ao Google Sheets falhou (%s); nova tentativa em %.1f s", status, espera)
+                time.sleep(espera)
+                continue
+            metricas.incrementar("sheets_chamadas_total", tipo=tipo, status="ok")
+            return resultado
+
+    # -------------------
+    # Escritas incertas
+    # -------------------
+    def _chave_incerto(self, id_registro: str) -> str:
+        return f"sheets:incerto:{id_registro}"
+
+    def _marcar_incertos(self, ids: list):
+        if self._backend is not None:
+            for i in ids:
+                self._backend.definir(self._chave_incerto(i), "1", ttl=self.PRAZO_INCERTEZA)
+            return
+        with self._lock_incertos:
+            self._incertos.update(ids)
+
+    def _algum_incerto(self, ids: list) -> bool:
+        if self._backend is not None:
+            return any(self._backend.obter(self._chave_incerto(i)) is not None for i in ids)
+        with self._lock_incertos:
+            return not self._incertos.isdisjoint(ids)
+
+    def _limpar_incertos(self, ids: list):
+        if self._backend is not None:
+            for i in ids:
+                self._backend.remover(self._chave_incerto(i))
+            return
+        with self._lock_incertos:
+            self._incertos.difference_update(ids)
+
+    def anexar_registros(self, aba, cabecalho: list, registros: list) -> list:
+        """append_rows dos registros na ordem do cabeçalho; devolve as linhas gravadas.
+
+        Se uma escrita anterior de algum deles ficou incerta, lê a coluna CHAVE_REGISTRO e
+        deixa de fora os que já estão na planilha.
+        """
+        ids = [str(r[self.CHAVE_REGISTRO]) for r in registros if r.get(self.CHAVE_REGISTRO)]
+        if ids and self.CHAVE_REGISTRO in cabecalho and self._algum_incerto(ids):
+            gravados = set(aba.col_values(cabecalho.index(self.CHAVE_REGISTRO) + 1))
+            restantes = [r for r in registros if str(r.get(self.CHAVE_REGISTRO)) not in gravados]
+            metricas.incrementar("sheets_duplicatas_evitadas_total", len(registros) - len(restantes))
+            registros = restantes
+
+        linhas = mapear_linhas(cabecalho, registros)
+        if linhas:
+            try:
+                aba.append_rows(linhas, value_input_option="USER_ENTERED")
+            except EscritaIncerta:
+                self._marcar_incertos(ids)
+                raise
+        if ids:
+            self._limpar_incertos(ids)
+        return linhas
+
+
+class _AbaComCota:
+    """Repassa a Worksheet do gspread, passando leituras e escritas pelo ClienteSheets."""
+
+    def __init__(self, aba, cliente: ClienteSheets):
+        self._aba = aba
+        self._cliente = cliente
+
+    def __getattr__(self, nome):
+        valor = getattr(self._aba, nome)
+        if nome in ClienteSheets.LEITURAS:
+            tipo = "leitura"
+        elif nome in ClienteSheets.ESCRITAS:
+            tipo = "escrita"
+        else:
+            return valor
+
+        def chamar(*args, **kwargs):
+            return self._cliente.executar(tipo, lambda: valor(*args, **kwargs),
+                                          idempotente=nome not in ClienteSheets.NAO_IDEMPOTENTES)
+
+        return chamar
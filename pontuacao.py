@@ -0,0 +1,216 @@
+"""Motor de pontuação compilado: questão → seção → dimensão → geral.
+
+O instrumento é convertido uma vez em vetores de índices inteiros; cada nível é
+uma redução por `np.bincount` sobre a matriz de respostas (N respondentes × Q
+questões), de modo que um respondente e milhares deles passam pelo mesmo código.
+As médias de seção, dimensão e geral ponderam igualmente as questões respondidas,
+como no cálculo original com pandas.
+"""
+import time
+from typing import Iterable
+
+import numpy as np
+
+
+NIVEIS = ("Inexistente / muito incipiente", "Em estruturação", "Parcialmente estruturado", "Bem estruturado")
+LIMIARES_NIVEL = (1.0, 2.0, 2.6)  # limite inferior de cada nível a partir do segundo
+
+
+def classificar_nivel(media_geral: float):
+    for nivel, limiar in zip(NIVEIS, LIMIARES_NIVEL):
+        if media_geral < limiar:
+            return nivel
+    return NIVEIS[-1]
+
+
+def classificar_niveis(medias: np.ndarray) -> np.ndarray:
+    """Versão vetorizada de classificar_nivel; NaN vira None."""
+    medias = np.asarray(medias, dtype=float)
+    niveis = np.array(NIVEIS, dtype=object)[np.searchsorted(LIMIARES_NIVEL, np.nan_to_num(medias), side="right")]
+    niveis[np.isnan(medias)] = None
+    return niveis
+
+
+def coluna_dimensao(dim: str) -> str:
+    return (
+        "score_dim_"
+        + dim.lower()
+        .replace(" ", "_")
+        .replace("ã", "a")
+        .replace("á", "a")
+        .replace("é", "e")
+        .replace("í", "i")
+        .replace("ó", "o")
+        .replace("ú", "u")
+        .replace("ç", "c")
+    )
+
+
+def coluna_questao(qid: str) -> str:
+    return f"q_{qid.replace('.', '_')}"
+
+
+def _nome_dimensao(texto: str) -> str:
+    return str(texto).strip().rstrip(",")
+
+
+class Pontuacao:
+    """Notas de um respondente, arredondadas em 2 casas (None quando não há resposta)."""
+
+    __slots__ = ("geral", "dimensoes", "secoes")
+
+    def __init__(self, geral, dimensoes: dict, secoes: dict):
+        self.geral = geral
+        self.dimensoes = dimensoes
+        self.secoes = secoes
+
+
+class MotorPontuacao:
+    def __init__(self, questoes: Iterable[dict], titulos_secoes: dict):
+        """`questoes` traz id, dimensão e seção de cada questão, na ordem do instrumento; sem
+        seção explícita, vale a chave de `titulos_secoes` mais longa que prefixa o id."""
+        questoes = list(questoes)
+        self.ids = tuple(q["id"] for q in questoes)
+        self.indice = {qid: i for i, qid in enumerate(self.ids)}
+
+        prefixos = sorted(titulos_secoes, key=len, reverse=True)
+        secao_de = [
+            q.get("secao") or next((s for s in prefixos if q["id"].startswith(s + ".")), None) for q in questoes
+        ]
+        self.secoes = tuple(s for s in titulos_secoes if s in secao_de)
+        self.dimensoes = tuple(dict.fromkeys(_nome_dimensao(q["dimensao"]) for q in questoes))
+
+        # Questões sem seção conhecida caem num grupo extra, descartado no resultado
+        indice_secao = {s: i for i, s in enumerate(self.secoes)}
+        self._secao = np.array([indice_secao.get(s, len(self.secoes)) for s in secao_de], dtype=np.intp)
+        indice_dimensao = {d: i for i, d in enumerate(self.dimensoes)}
+        self._dimensao = np.array([indice_dimensao[_nome_dimensao(q["dimensao"])] for q in questoes], dtype=np.intp)
+        self._geral = np.zeros(len(self.ids), dtype=np.intp)
+        for vetor in (self._secao, self._dimensao, self._geral):
+            vetor.setflags(write=False)
+
+    def questoes_por_secao(self) -> dict:
+        return {s: [qid for qid, i in zip(self.ids, self._secao) if i == j] for j, s in enumerate(self.secoes)}
+
+    # -------------------
+    # Matriz de respostas
+    # -------------------
+    def matriz(self, respostas: Iterable[dict]) -> np.ndarray:
+        """N×Q com NaN nas questões sem resposta; chaves fora do instrumento são ignoradas."""
+        respostas = list(respostas)
+        m = np.full((len(respostas), len(self.ids)), np.nan)
+        for i, resp in enumerate(respostas):
+            for qid, nota in resp.items():
+                j = self.indice.get(qid)
+                if j is not None and nota is not None:
+                    m[i, j] = nota
+        return m
+
+    def matriz_de_colunas(self, tabela) -> np.ndarray:
+        """N×Q a partir de um DataFrame com colunas q_* (exportação da planilha ou da base local)."""
+        import pandas as pd
+
+        colunas = [coluna_questao(qid) for qid in self.ids]
+        valores = tabela.reindex(columns=colunas).replace("", np.nan)
+        try:
+            return valores.astype(float).to_numpy()
+        except (TypeError, ValueError):
+            # Algum valor não numérico: conversão coluna a coluna, bem mais lenta
+            return valores.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+    # -------------------
+    # Pontuação
+    # -------------------
+    @staticmethod
+    def _medias(m: np.ndarray, grupo: np.ndarray, grupos: int) -> np.ndarray:
+        n = m.shape[0]
+        validas = ~np.isnan(m)
+        posicoes = (np.arange(n, dtype=np.intp)[:, None] * grupos + grupo[None, :])[validas]
+        somas = np.bincount(posicoes, weights=m[validas], minlength=n * grupos).reshape(n, grupos)
+        contagens = np.bincount(posicoes, minlength=n * grupos).reshape(n, grupos)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.round(somas / contagens, 2)
+
+    def pontuar_lote(self, m: np.ndarray) -> dict:
+        """Arrays de notas: `geral` (N), `dimensoes` (N×D) e `secoes` (N×S), com NaN onde não há resposta."""
+        m = np.asarray(m, dtype=float)
+        return {
+            "geral": self._medias(m, self._geral, 1)[:, 0],
+            "dimensoes": self._medias(m, self._dimensao, len(self.dimensoes)),
+            "secoes": self._medias(m, self._secao, len(self.secoes) + 1)[:, :len(self.secoes)],
+        }
+
+    def pontuar(self, respostas: dict) -> Pontuacao:
+        lote = self.pontuar_lote(self.matriz([respostas]))
+
+        def _valor(x):
+            return None if np.isnan(x) else float(x)
+
+        return Pontuacao(
+            _valor(lote["geral"][0]),
+            {d: _valor(v) for d, v in zip(self.dimensoes, lote["dimensoes"][0]) if not np.isnan(v)},
+            {s: _valor(v) for s, v in zip(self.secoes, lote["secoes"][0]) if not np.isnan(v)},
+        )
+
+
+# -------------------
+# Comparação com o cálculo em pandas
+# -------------------
+def _pontuar_com_pandas(questoes: list, respostas: dict):
+    import pandas as pd
+
+    df = pd.DataFrame(questoes)
+    df["dim_key"] = df["dimensao"].astype(str).str.strip().str.rstrip(",")
+    df["nota"] = df["id"].map(respostas)
+    medias = df.groupby("dim_key")["nota"].mean().round(2).to_dict()
+    geral = round(sum(respostas.values()) / len(respostas), 2) if respostas else None
+    return geral, medias
+
+
+def medir_desempenho(questoes: list, titulos_secoes: dict, respondentes: int = 2000, semente: int = 0) -> dict:
+    """Segundos para pontuar `respondentes` aleatórios pelo caminho pandas (um a um) e pelo motor (um lote)."""
+    rng = np.random.default_rng(semente)
+    ids = [q["id"] for q in questoes]
+    notas = rng.integers(0, 4, size=(respondentes, len(ids)))
+    respostas = [dict(zip(ids, linha.tolist())) for linha in notas]
+
+    inicio = time.perf_counter()
+    referencia = [_pontuar_com_pandas(questoes, r) for r in respostas]
+    pandas_s = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    motor = MotorPontuacao(questoes, titulos_secoes)
+    compilacao_s = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    lote = motor.pontuar_lote(motor.matriz(respostas))
+    lote_s = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for r in respostas[:200]:
+        motor.pontuar(r)
+    individual_s = (time.perf_counter() - inicio) / min(200, respondentes)
+
+    divergencias = sum(
+        geral != lote["geral"][i]
+        or any(medias[d] != lote["dimensoes"][i][j] for j, d in enumerate(motor.dimensoes))
+        for i, (geral, medias) in enumerate(referencia)
+    )
+    return {
+        "respondentes": respondentes,
+        "pandas_s": pandas_s,
+        "compilacao_s": compilacao_s,
+        "lote_s": lote_s,
+        "individual_s": individual_s,
+        "aceleracao": pandas_s / lote_s if lote_s else float("inf"),
+        "divergencias": int(divergencias),
+    }
+
+
+if __name__ == "__main__":
+    from instrumento import carregar_catalogo
+
+    instrumento = carregar_catalogo().obter()
+    resultado = medir_desempenho([dict(q) for q in instrumento.questoes], dict(instrumento.titulos_secoes))
+    for chave, valor in resultado.items():
+        print(f"{chave}: {valor:.6f}" if isinstance(valor, float) else f"{chave}: {valor}")
@@ -0,0 +1,269 @@
+"""HTML do relatório completo e cache dos relatórios renderizados por id_resposta.
+
+Os modelos são compilados uma vez na importação. O registro salvo não muda depois
+do envio, então HTML e PDF de um mesmo id_resposta são gerados uma única vez e
+compartilhados entre a tela, o anexo do e-mail e o download.
+"""
+import html
+import threading
+import time
+from collections import OrderedDict
+from string import Template
+from typing import Callable
+
+import metricas
+
+NIVEIS = ["Incipiente", "Em estruturação", "Parcialmente estruturado", "Bem estruturado"]
+
+_MODELO_CARTAO = Template(
+    '<div class="dim-card">'
+    '<strong>$dimensao</strong>'
+    '<div><b>Média da organização:</b> $media | <b>Base:</b> $base | <b>Diferença:</b> $diferenca</div>'
+    '<div class="compare-row"><div class="compare-label">Organização</div>'
+    '<div class="compare-track"><div class="compare-fill-org" style="width:$pct_org%;"></div></div></div>'
+    '<div class="compare-row"><div class="compare-label">Base nacional</div>'
+    '<div class="compare-track"><div class="compare-fill-base" style="width:$pct_base%;"></div></div></div>'
+    '$percentil'
+    '$prioridade'
+    '</div>'
+)
+
+_MODELO_PRIORIDADE = Template(
+    '<div class="muted" style="margin-top:6px;"><b>$prioridade:</b> $recomendacao</div>'
+)
+
+_MODELO_PERCENTIL_DIMENSAO = Template(
+    '<div class="muted" style="margin-top:6px;"><b>Percentil entre pares:</b> $percentil</div>'
+)
+
+_MODELO_POSICAO = Template(
+    '<div class="section-print-title">Posição entre pares</div>'
+    '<div class="kpi-grid">'
+    '<div class="kpi-card"><div class="label">Percentil do score geral</div><div class="value">$geral</div></div>'
+    '<div class="kpi-card"><div class="label">Grupo de comparação</div><div class="value">$segmento ($n respostas)</div></div>'
+    '</div>'
+    '<table class="posicao-tabela">'
+    '<tr><th>Item</th><th>Nota</th><th>Percentil</th></tr>'
+    '$linhas'
+    '</table>'
+)
+
+_MODELO_LINHA_POSICAO = Template('<tr><td>$item</td><td>$nota</td><td>$percentil</td></tr>')
+
+_MODELO_LOGO = Template(
+    '<div class="report-logo">'
+    '<img src="$src" alt="Logo Publix">'
+    '</div>'
+)
+
+_MODELO_RELATORIO = Template(
+    '<div id="report-print-root" class="print-only">'
+    '<div class="report-wrap">'
+    '<div class="publix-band"></div>'
+    '<div class="report-header">'
+    '<div class="report-header-left">'
+    '<div class="report-title">$titulo</div>'
+    '<div class="report-subtitle">Observatório de Governança para Resultados: Inteligência Artificial<br>Emitido em: $data</div>'
+    '</div>'
+    '$logo'
+    '</div>'
+    '<div class="section-print-title">Identificação institucional</div>'
+    '<div class="kpi-grid">'
+    '<div class="kpi-card"><div class="label">Instituição</div><div class="value">$instituicao</div></div>'
+    '<div class="kpi-card"><div class="label">Classificação</div><div class="value">$poder | $esfera | $uf</div></div>'
+    '<div class="kpi-card"><div class="label">Respondente</div><div class="value">$respondente</div></div>'
+    '<div class="kpi-card"><div class="label">Cargo / contato</div><div class="value">$cargo | $email</div></div>'
+    '</div>'
+    '<div class="section-print-title">Resultado geral</div>'
+    '<div class="kpi-grid" style="grid-template-columns: 1fr 1fr 1fr;">'
+    '<div class="kpi-card"><div class="label">Score geral</div><div class="value">$score</div></div>'
+    '<div class="kpi-card"><div class="label">Nível de maturidade</div><div class="value">$nivel</div></div>'
+    '<div class="kpi-card"><div class="label">ID do diagnóstico</div><div class="value">$id_resposta</div></div>'
+    '</div>'
+    '<div class="section-print-title">Visual executivo</div>'
+    '<div class="visual-block">'
+    '<div class="visual-title">Indicador visual de maturidade</div>'
+    '<div><b>Score geral:</b> $score / 3,0</div>'
+    '<div class="bar-track"><div class="bar-fill" style="width:$pct_score%;"></div></div>'
+    '<div class="bar-legend">Escala de 0 a 3</div>'
+    '$badges'
+    '</div>'
+    '<div class="section-print-title">Análise por dimensão</div>'
+    '$cartoes'
+    '$posicao'
+    '</div>'
+    '</div>'
+)
+
+
+def _esc(valor) -> str:
+    return html.escape(str(valor if valor is not None else ""))
+
+
+def _pct(valor: float) -> str:
+    return f"{max(0, min((valor / 3) * 100, 100)):.1f}"
+
+
+def _nivel_ativo(score: float) -> int:
+    if score < 1.0:
+        return 1
+    elif score < 2.0:
+        return 2
+    elif score < 2.6:
+        return 3
+    return 4
+
+
+def _posicao(posicao: dict) -> str:
+    linhas = [
+        _MODELO_LINHA_POSICAO.substitute(item=_esc(item), nota=f"{nota:.2f}", percentil=percentil)
+        for item, nota, percentil in posicao.get("secoes", []) + posicao.get("questoes", [])
+    ]
+    return _MODELO_POSICAO.substitute(
+        geral=posicao["geral"],
+        segmento=_esc(posicao["segmento"]),
+        n=posicao["n"],
+        linhas="".join(linhas),
+    )
+
+
+def gerar_html_relatorio(registro: dict, medias_dim: dict, medias_base: dict, logo_src: str = None,
+                         posicao: dict = None, titulo: str = "Relatório de Diagnóstico",
+                         recomendacoes: dict = None) -> str:
+    """`posicao` traz os percentis da organização entre os pares (ver posicao_na_base no app).
+
+    `titulo` e `recomendacoes` (dimensão -> (prioridade, recomendação)) vêm do instrumento da
+    resposta (Instrumento.titulo_relatorio e Instrumento.recomendacoes).
+    """
+    percentis_dim = (posicao or {}).get("dimensoes", {})
+    score_raw = float(registro.get("score_geral", 0) or 0)
+
+    ativo = _nivel_ativo(score_raw)
+    badges = (
+        '<div class="level-badges">'
+        + "".join(
+            f'<div class="level-badge{" active" if i == ativo else ""}">{nome}</div>'
+            for i, nome in enumerate(NIVEIS, start=1)
+        )
+        + '</div>'
+    )
+
+    cartoes = []
+    for dim, media in medias_dim.items():
+        base = medias_base.get(dim)
+        if base is None:
+            continue
+        recomendacao = (recomendacoes or {}).get(dim)
+        percentil = percentis_dim.get(dim)
+        cartoes.append(_MODELO_CARTAO.substitute(
+            dimensao=_esc(dim),
+            media=f"{media:.2f}",
+            base=f"{base:.2f}",
+            diferenca=f"{round(media - base, 2):+.2f}",
+            pct_org=_pct(media),
+            pct_base=_pct(base),
+            percentil=_MODELO_PERCENTIL_DIMENSAO.substitute(percentil=percentil) if percentil is not None else "",
+            prioridade=_MODELO_PRIORIDADE.substitute(
+                prioridade=_esc(recomendacao[0]), recomendacao=_esc(recomendacao[1])
+            ) if recomendacao else "",
+        ))
+
+    return _MODELO_RELATORIO.substitute(
+        titulo=_esc(titulo),
+        data=_esc(registro.get("data_hora")),
+        logo=_MODELO_LOGO.substitute(src=_esc(logo_src)) if logo_src else "",
+        instituicao=_esc(registro.get("instituicao")),
+        poder=_esc(registro.get("poder")),
+        esfera=_esc(registro.get("esfera")),
+        uf=_esc(registro.get("estado_uf")),
+        respondente=_esc(registro.get("nome_respondente")),
+        cargo=_esc(registro.get("cargo_funcao")),
+        email=_esc(registro.get("email_respondente")),
+        score=_esc(registro.get("score_geral")),
+        nivel=_esc(registro.get("nivel_maturidade")),
+        id_resposta=_esc(registro.get("id_resposta")),
+        pct_score=_pct(score_raw),
+        badges=badges,
+        cartoes="".join(cartoes),
+        posicao=_posicao(posicao) if posicao else "",
+    )
+
+
+class CacheRelatorios:
+    """LRU limitado de relatórios renderizados, por (id_resposta, formato, versão).
+
+    Pedidos simultâneos da mesma chave (tela e fila de e-mail, por exemplo)
+    esperam uma única renderização.
+    """
+
+    def __init__(self, max_itens: int = 256):
+        self.max_itens = max_itens
+        self.acertos = 0
+        self.falhas = 0
+        self._itens = OrderedDict()
+        self._em_andamento = {}
+        self._lock = threading.Lock()
+
+    def obter(self, id_resposta: str, formato: str, gerar: Callable[[], object], versao: str = ""):
+        chave = (id_resposta, formato, versao)
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                metricas.incrementar("relatorio_cache_acertos_total", formato=formato)
+                return self._itens[chave]
+            trava = self._em_andamento.setdefault(chave, threading.Lock())
+
+        with trava:
+            with self._lock:
+                if chave in self._itens:
+                    self._itens.move_to_end(chave)
+                    self.acertos += 1
+                    metricas.incrementar("relatorio_cache_acertos_total", formato=formato)
+                    return self._itens[chave]
+            inicio = time.perf_counter()
+            try:
+                conteudo = gerar()
+            except BaseException:
+                with self._lock:
+                    self._em_andamento.pop(chave, None)
+                raise
+            metricas.observar("relatorio_renderizacao_segundos", time.perf_counter() - inicio, formato=formato)
+            # Guarda o resultado e libera a chave no mesmo bloco: quem chegar depois já encontra o item
+            with self._lock:
+                self.falhas += 1
+                metricas.incrementar("relatorio_cache_falhas_total", formato=formato)
+                self._itens[chave] = conteudo
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+                self._em_andamento.pop(chave, None)
+            return conteudo
+
+    def consultar(self, id_resposta: str, formato: str, versao: str = ""):
+        """Conteúdo já renderizado, ou None; nunca gera nem espera uma renderização em curso."""
+        chave = (id_resposta, formato, versao)
+        with self._lock:
+            if chave not in self._itens:
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            metricas.incrementar("relatorio_cache_acertos_total", formato=formato)
+            return self._itens[chave]
+
+    def invalidar(self, id_resposta: str = None):
+        with self._lock:
+            if id_resposta is None:
+                self._itens.clear()
+            else:
+                for chave in [c for c in self._itens if c[0] == id_resposta]:
+                    del self._itens[chave]
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                "itens": len(self._itens),
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "taxa_acerto": self.acertos / total if total else 0.0,
+            }
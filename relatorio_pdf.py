@@ -0,0 +1,524 @@
+"""Geração do PDF do relatório e pool de processos para renderização fora da sessão.
+
+Fica em módulo próprio para que os processos do pool importem só o ReportLab,
+sem executar o script do Streamlit.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from PIL import Image as PILImage
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, HRFlowable, Image
+from reportlab.lib.enums import TA_RIGHT
+
+import metricas
+from ativos import RegistroAtivos
+
+logger = logging.getLogger("observatorio.pdf")
+
+LOGO_PATH = Path("static/publix_logo.png")
+# O logo ocupa 28 mm de largura: 400 px dão ~360 dpi na impressão
+LARGURA_LOGO_PX = 400
+
+_ativos = RegistroAtivos()
+_logos = {}
+_lock_logos = threading.Lock()
+
+
+def _logo_preparado(path: Path):
+    """PNG do logo já reduzido ao tamanho de impressão, preparado uma vez por processo; refeito só se o
+    arquivo mudar. Cada PDF monta a sua Image pública sobre esses bytes, com pouco a decodificar."""
+    ativo = _ativos.obter(path)
+    if ativo is None:
+        return None
+    with _lock_logos:
+        atual = _logos.get(ativo.caminho)
+        if atual is None or atual[0] != ativo.versao:
+            try:
+                imagem = PILImage.open(io.BytesIO(ativo.conteudo))
+                if imagem.width > LARGURA_LOGO_PX:
+                    altura = max(1, round(imagem.height * LARGURA_LOGO_PX / imagem.width))
+                    imagem = imagem.resize((LARGURA_LOGO_PX, altura), PILImage.LANCZOS)
+                saida = io.BytesIO()
+                imagem.save(saida, format="PNG", optimize=True)
+            except Exception:
+                return None
+            atual = (ativo.versao, saida.getvalue())
+            _logos[ativo.caminho] = atual
+        return atual[1]
+
+
+def gerar_pdf_relatorio(registro: dict, medias_dim: dict, logo_path: Path = LOGO_PATH, medias_base: dict = None,
+                        posicao: dict = None, titulo: str = "Relatório de Diagnóstico",
+                        recomendacoes: dict = None) -> bytes:
+    """Gera o PDF do relatório fiel ao layout da tela, sem ID do diagnóstico.
+
+    `medias_base` traz a média da base por dimensão; dimensões sem base ficam de fora da análise.
+    `posicao` traz os percentis entre pares; sem ela a seção não é incluída.
+    `titulo` e `recomendacoes` (dimensão -> (prioridade, recomendação)) vêm do instrumento da
+    resposta (Instrumento.titulo_relatorio e Instrumento.recomendacoes).
+    """
+    from reportlab.graphics.shapes import Drawing, Rect
+    from reportlab.graphics import renderPDF
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        rightMargin=18*mm,
+        leftMargin=18*mm,
+        topMargin=16*mm,
+        bottomMargin=16*mm,
+    )
+
+    PAGE_W = A4[0] - 36*mm  # largura útil
+
+    amarelo      = colors.HexColor("#FFC728")
+    amarelo_grad = colors.HexColor("#FFB300")
+    cinza_claro  = colors.HexColor("#f8f8f8")
+    cinza_borda  = colors.HexColor("#e0e0e0")
+    cinza_texto  = colors.HexColor("#444444")
+    cinza_muted  = colors.HexColor("#666666")
+    preto        = colors.HexColor("#111111")
+
+    def s(name, **kw):
+        base = ParagraphStyle(name, fontName="Helvetica", fontSize=9,
+                              textColor=cinza_texto, leading=13)
+        for k, v in kw.items():
+            setattr(base, k, v)
+        return base
+
+    st_titulo    = s("titulo",   fontName="Helvetica-Bold", fontSize=13, textColor=preto, leading=17, spaceAfter=2)
+    st_sub       = s("sub",      fontSize=8,  textColor=colors.HexColor("#555555"), leading=12, spaceAfter=2)
+    st_secao     = s("secao",    fontName="Helvetica-Bold", fontSize=10, textColor=preto, spaceBefore=8, spaceAfter=5)
+    st_label     = s("label",    fontSize=7.5, textColor=colors.HexColor("#888888"), leading=11)
+    st_valor     = s("valor",    fontName="Helvetica-Bold", fontSize=9, textColor=preto, leading=13)
+    st_normal    = s("normal",   fontSize=8.5, textColor=cinza_texto, leading=13)
+    st_muted     = s("muted",    fontSize=8,   textColor=cinza_muted,  leading=12)
+    st_rodape    = s("rodape",   fontSize=7.5, textColor=colors.HexColor("#aaaaaa"), alignment=TA_RIGHT)
+    st_badge_on  = s("badge_on", fontName="Helvetica-Bold", fontSize=7.5,
+                     textColor=preto, backColor=colors.HexColor("#fff3c4"),
+                     borderColor=amarelo, borderWidth=0.5, borderPadding=3)
+    st_badge_off = s("badge_off", fontSize=7.5, textColor=colors.HexColor("#888888"),
+                     backColor=colors.white, borderColor=cinza_borda,
+                     borderWidth=0.5, borderPadding=3)
+
+    story = []
+
+    # ── Faixa amarela topo ──────────────────────────────────────────────
+    story.append(Table([[""]], colWidths=[PAGE_W], rowHeights=[4],
+        style=TableStyle([("BACKGROUND",(0,0),(-1,-1), amarelo),
+                          ("LINEABOVE",(0,0),(-1,-1),0,colors.white)])))
+    story.append(Spacer(1, 5*mm))
+
+    # ── Cabeçalho: título + logo ────────────────────────────────────────
+    # Logo — tenta carregar do arquivo
+    logo = _logo_preparado(logo_path)
+    if logo is not None:
+        logo_img = Image(io.BytesIO(logo), width=28*mm, height=18*mm, kind="proportional")
+        header_data = [[
+            [Paragraph(titulo, st_titulo),
+             Paragraph("Observatório de Governança para Resultados: Inteligência Artificial", st_sub),
+             Paragraph(f"Emitido em: {registro.get('data_hora','')}", st_sub)],
+            logo_img
+        ]]
+        t_header = Table(header_data, colWidths=[PAGE_W - 32*mm, 32*mm])
+        t_header.setStyle(TableStyle([
+            ("VALIGN",(0,0),(-1,-1),"TOP"),
+            ("ALIGN",(1,0),(1,0),"RIGHT"),
+            ("LEFTPADDING",(0,0),(-1,-1),0),
+            ("RIGHTPADDING",(0,0),(-1,-1),0),
+            ("TOPPADDING",(0,0),(-1,-1),0),
+            ("BOTTOMPADDING",(0,0),(-1,-1),0),
+        ]))
+    else:
+        t_header = Table([[
+            [Paragraph(titulo, st_titulo),
+             Paragraph("Observatório de Governança para Resultados", st_sub),
+             Paragraph(f"Emitido em: {registro.get('data_hora','')}", st_sub)]
+        ]], colWidths=[PAGE_W])
+
+    story.append(t_header)
+    story.append(Spacer(1, 3*mm))
+    story.append(HRFlowable(width="100%", thickness=1, color=cinza_borda, spaceAfter=5))
+
+    # ── Identificação institucional ─────────────────────────────────────
+    story.append(Paragraph("Identificação institucional", st_secao))
+
+    half = PAGE_W / 2 - 1*mm
+    def kpi_cell(label, valor):
+        return [Paragraph(label, st_label), Paragraph(str(valor), st_valor)]
+
+    t_inst = Table([
+        [kpi_cell("Instituição", registro.get("instituicao","")),
+         kpi_cell("Classificação", f"{registro.get('poder','')} | {registro.get('esfera','')} | {registro.get('estado_uf','')}")],
+        [kpi_cell("Respondente", registro.get("nome_respondente","")),
+         kpi_cell("Cargo / contato", f"{registro.get('cargo_funcao','')} | {registro.get('email_respondente','')}")],
+    ], colWidths=[half, half])
+    t_inst.setStyle(TableStyle([
+        ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
+        ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
+        ("INNERGRID",(0,0),(-1,-1), 0.5, cinza_borda),
+        ("LINEBEFORE",(0,0),(0,-1), 3, amarelo),
+        ("LINEBEFORE",(1,0),(1,-1), 3, amarelo),
+        ("TOPPADDING",(0,0),(-1,-1), 6),
+        ("BOTTOMPADDING",(0,0),(-1,-1), 6),
+        ("LEFTPADDING",(0,0),(-1,-1), 8),
+        ("RIGHTPADDING",(0,0),(-1,-1), 6),
+        ("VALIGN",(0,0),(-1,-1),"TOP"),
+    ]))
+    story.append(t_inst)
+    story.append(Spacer(1, 5*mm))
+
+    # ── Resultado geral (sem ID) ────────────────────────────────────────
+    story.append(Paragraph("Resultado geral", st_secao))
+    score_raw = float(registro.get("score_geral", 0) or 0)
+    nivel_txt = str(registro.get("nivel_maturidade",""))
+
+    t_res = Table([
+        [kpi_cell("Score geral", f"{score_raw:.2f} / 3,00"),
+         kpi_cell("Nível de maturidade", nivel_txt)],
+    ], colWidths=[half, half])
+    t_res.setStyle(TableStyle([
+        ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
+        ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
+        ("INNERGRID",(0,0),(-1,-1), 0.5, cinza_borda),
+        ("LINEBEFORE",(0,0),(0,-1), 3, amarelo),
+        ("LINEBEFORE",(1,0),(1,-1), 3, amarelo),
+        ("TOPPADDING",(0,0),(-1,-1), 6),
+        ("BOTTOMPADDING",(0,0),(-1,-1), 6),
+        ("LEFTPADDING",(0,0),(-1,-1), 8),
+        ("RIGHTPADDING",(0,0),(-1,-1), 6),
+        ("VALIGN",(0,0),(-1,-1),"TOP"),
+    ]))
+    story.append(t_res)
+    story.append(Spacer(1, 5*mm))
+
+    # ── Visual executivo — barra de maturidade + badges ─────────────────
+    story.append(Paragraph("Visual executivo", st_secao))
+
+    score_pct = max(0.0, min(score_raw / 3.0, 1.0))
+    BAR_W = PAGE_W - 20*mm   # largura da barra dentro do card
+    BAR_H = 8                 # altura em pts
+
+    if score_raw < 1.0:   active = 0
+    elif score_raw < 2.0: active = 1
+    elif score_raw < 2.6: active = 2
+    else:                  active = 3
+    levels = ["Incipiente", "Em estruturação", "Parcialmente estruturado", "Bem estruturado"]
+
+    # desenha barra usando Drawing
+    bar_drawing = Drawing(BAR_W, BAR_H + 2)
+    bar_drawing.add(Rect(0, 1, BAR_W, BAR_H,
+                         fillColor=colors.HexColor("#f1f1f1"), strokeColor=None))
+    bar_drawing.add(Rect(0, 1, BAR_W * score_pct, BAR_H,
+                         fillColor=amarelo, strokeColor=None))
+
+    badges = []
+    for i, lbl in enumerate(levels):
+        st_b = st_badge_on if i == active else st_badge_off
+        badges.append(Paragraph(lbl, st_b))
+
+    visual_content = [
+        [Paragraph("<b>Indicador visual de maturidade</b>", st_normal)],
+        [Paragraph(f"Score geral: <b>{score_raw:.2f}</b> / 3,0", st_normal)],
+        [bar_drawing],
+        [Paragraph("Escala de 0 a 3", st_muted)],
+        [Table([badges], colWidths=[PAGE_W/4 - 6*mm]*4,
+               style=TableStyle([("ALIGN",(0,0),(-1,-1),"CENTER"),
+                                 ("VALIGN",(0,0),(-1,-1),"MIDDLE"),
+                                 ("LEFTPADDING",(0,0),(-1,-1),2),
+                                 ("RIGHTPADDING",(0,0),(-1,-1),2)]))],
+    ]
+    t_visual = Table(visual_content, colWidths=[PAGE_W - 16*mm])
+    t_visual.setStyle(TableStyle([
+        ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
+        ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
+        ("TOPPADDING",(0,0),(-1,-1), 5),
+        ("BOTTOMPADDING",(0,0),(-1,-1), 4),
+        ("LEFTPADDING",(0,0),(-1,-1), 8),
+        ("RIGHTPADDING",(0,0),(-1,-1), 8),
+    ]))
+    story.append(t_visual)
+    story.append(Spacer(1, 5*mm))
+
+    # ── Análise por dimensão ────────────────────────────────────────────
+    if medias_dim:
+        story.append(Paragraph("Análise por dimensão", st_secao))
+        for dim, media in medias_dim.items():
+            base = (medias_base or {}).get(dim)
+            if base is None:
+                continue
+            diff = round(media - base, 2)
+            sinal = "+" if diff >= 0 else ""
+
+            org_pct  = max(0.0, min(media / 3.0, 1.0))
+            base_pct = max(0.0, min(base  / 3.0, 1.0))
+
+            recomendacao = (recomendacoes or {}).get(dim)
+
+            DIM_W = PAGE_W - 20*mm
+
+            org_bar = Drawing(DIM_W, BAR_H + 2)
+            org_bar.add(Rect(0,1, DIM_W, BAR_H, fillColor=colors.HexColor("#f1f1f1"), strokeColor=None))
+            org_bar.add(Rect(0,1, DIM_W*org_pct, BAR_H, fillColor=amarelo, strokeColor=None))
+
+            base_bar = Drawing(DIM_W, BAR_H + 2)
+            base_bar.add(Rect(0,1, DIM_W, BAR_H, fillColor=colors.HexColor("#f1f1f1"), strokeColor=None))
+            base_bar.add(Rect(0,1, DIM_W*base_pct, BAR_H, fillColor=colors.HexColor("#cfcfcf"), strokeColor=None))
+
+            dim_rows = [
+                [Paragraph(f"<b>{dim}</b>", st_normal)],
+                [Paragraph(
+                    f"Média da organização: <b>{media:.2f}</b> &nbsp;|&nbsp; "
+                    f"Base: <b>{base:.2f}</b> &nbsp;|&nbsp; "
+                    f"Diferença: <b>{sinal}{diff:.2f}</b>",
+                    st_normal)],
+                [Paragraph("<b>Organização</b>", st_muted)],
+                [org_bar],
+                [Paragraph("<b>Base nacional</b>", st_muted)],
+                [base_bar],
+            ]
+            percentil = (posicao or {}).get("dimensoes", {}).get(dim)
+            if percentil is not None:
+                dim_rows.append([Paragraph(f"<b>Percentil entre pares:</b> {percentil}", st_muted)])
+            if recomendacao:
+                dim_rows.append([Paragraph(f"<b>{recomendacao[0]}:</b> {recomendacao[1]}", st_muted)])
+            t_dim = Table(dim_rows, colWidths=[DIM_W])
+            t_dim.setStyle(TableStyle([
+                ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
+                ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
+                ("LINEBEFORE",(0,0),(0,-1), 3, amarelo),
+                ("TOPPADDING",(0,0),(-1,-1), 5),
+                ("BOTTOMPADDING",(0,0),(-1,-1), 4),
+                ("LEFTPADDING",(0,0),(-1,-1), 8),
+                ("RIGHTPADDING",(0,0),(-1,-1), 8),
+            ]))
+            story.append(t_dim)
+            story.append(Spacer(1, 4*mm))
+
+    # ── Posição entre pares ─────────────────────────────────────────────
+    if posicao:
+        story.append(Paragraph("Posição entre pares", st_secao))
+        t_pos = Table([
+            [kpi_cell("Percentil do score geral", posicao["geral"]),
+             kpi_cell("Grupo de comparação", f"{posicao['segmento']} ({posicao['n']} respostas)")],
+        ], colWidths=[half, half])
+        t_pos.setStyle(TableStyle([
+            ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
+            ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
+            ("INNERGRID",(0,0),(-1,-1), 0.5, cinza_borda),
+            ("LINEBEFORE",(0,0),(0,-1), 3, amarelo),
+            ("LINEBEFORE",(1,0),(1,-1), 3, amarelo),
+            ("TOPPADDING",(0,0),(-1,-1), 6),
+            ("BOTTOMPADDING",(0,0),(-1,-1), 6),
+            ("LEFTPADDING",(0,0),(-1,-1), 8),
+            ("RIGHTPADDING",(0,0),(-1,-1), 6),
+            ("VALIGN",(0,0),(-1,-1),"TOP"),
+        ]))
+        story.append(t_pos)
+        story.append(Spacer(1, 3*mm))
+
+        linhas_pos = [[Paragraph("<b>Item</b>", st_muted), Paragraph("<b>Nota</b>", st_muted),
+                       Paragraph("<b>Percentil</b>", st_muted)]]
+        for item, nota, percentil in posicao.get("secoes", []) + posicao.get("questoes", []):
+            linhas_pos.append([Paragraph(str(item), st_normal), Paragraph(f"{nota:.2f}", st_normal),
+                               Paragraph(str(percentil), st_normal)])
+        t_itens = Table(linhas_pos, colWidths=[PAGE_W - 50*mm, 25*mm, 25*mm], repeatRows=1)
+        t_itens.setStyle(TableStyle([
+            ("LINEBELOW",(0,0),(-1,-1), 0.5, cinza_borda),
+            ("TOPPADDING",(0,0),(-1,-1), 2),
+            ("BOTTOMPADDING",(0,0),(-1,-1), 2),
+            ("LEFTPADDING",(0,0),(-1,-1), 4),
+        ]))
+        story.append(t_itens)
+
+    # ── Rodapé ──────────────────────────────────────────────────────────
+    story.append(Spacer(1, 6*mm))
+    story.append(HRFlowable(width="100%", thickness=0.5, color=cinza_borda, spaceAfter=3))
+    story.append(Paragraph("Desenvolvido pelo Instituto Publix — institutopublix.com.br", st_rodape))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+# -------------------
+# POOL DE RENDERIZAÇÃO
+# -------------------
+class FilaPDFCheia(Exception):
+    pass
+
+
+def _aquecer_worker(logo_path: str):
+    # Força a importação, o cache de fontes do ReportLab e a decodificação do logo antes do primeiro pedido real
+    gerar_pdf_relatorio({"data_hora": "", "score_geral": 0}, {}, logo_path=Path(logo_path))
+    return os.getpid()
+
+
+def _renderizar_no_worker(registro: dict, medias_dim: dict, medias_base: dict, logo_path: str, enviado_em: float,
+                          posicao: dict = None, titulo: str = "Relatório de Diagnóstico", recomendacoes: dict = None):
+    inicio = time.time()
+    pdf = gerar_pdf_relatorio(registro, medias_dim, logo_path=Path(logo_path), medias_base=medias_base, posicao=posicao,
+                              titulo=titulo, recomendacoes=recomendacoes)
+    return pdf, inicio - enviado_em, time.time() - inicio
+
+
+_lock_principal = threading.Lock()
+
+
+@contextmanager
+def _sem_script_principal():
+    # O Streamlit executa o app como __main__; no método spawn os filhos reimportariam
+    # o script inteiro. Só durante a criação dos processos, __main__ vira uma cópia sem
+    # __file__/__spec__: quem o ler nesse intervalo vê os mesmos nomes. Ao restaurar, uma
+    # troca feita enquanto isso (nova execução do script) é preservada.
+    with _lock_principal:
+        original = sys.modules.get("__main__")
+        copia = types.ModuleType("__main__")
+        if original is not None:
+            copia.__dict__.update({k: v for k, v in vars(original).items() if k not in ("__file__", "__spec__")})
+        copia.__spec__ = None
+        sys.modules["__main__"] = copia
+        try:
+            yield
+        finally:
+            if sys.modules.get("__main__") is copia:
+                sys.modules["__main__"] = original
+
+
+class PedidoPDF:
+    """Renderização em andamento: `futuro` entrega os bytes do PDF; `cancelar` desiste dela."""
+
+    def __init__(self):
+        self.futuro = Future()
+        self.futuro.set_running_or_notify_cancel()
+        self._interno = None
+
+    def resultado(self, timeout: float = None) -> bytes:
+        return self.futuro.result(timeout=timeout)
+
+    def cancelar(self):
+        if self._interno is not None:
+            self._interno.cancel()
+
+
+class PoolRenderizacaoPDF:
+    """Pool de processos aquecido para o ReportLab, com fila limitada e timeout.
+
+    `renderizar` devolve um PedidoPDF; `gerar` espera os bytes. Se um processo do
+    pool morrer (falta de memória, falha do ReportLab), o pool é recriado e o pedido
+    é repetido uma vez.
+    """
+
+    def __init__(self, processos: int = 2, fila_maxima: int = 8, timeout: float = 60.0,
+                 espera_vaga: float = 5.0, logo_path: Path = LOGO_PATH):
+        self.processos = max(1, processos)
+        self.timeout = timeout
+        self.espera_vaga = espera_vaga
+        self.logo_path = Path(logo_path).resolve()
+        self._vagas = threading.BoundedSemaphore(self.processos + max(0, fila_maxima))
+        self._lock_executor = threading.Lock()
+        self._executor = self._criar_executor()
+
+    def _criar_executor(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            max_workers=self.processos,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        # No spawn cada submit sem worker ocioso cria um processo: sobe todos agora
+        with _sem_script_principal():
+            for _ in range(self.processos):
+                executor.submit(_aquecer_worker, str(self.logo_path))
+        return executor
+
+    def _recriar(self, quebrado: ProcessPoolExecutor):
+        with self._lock_executor:
+            if self._executor is not quebrado:
+                return
+            metricas.incrementar("pdf_pool_recriado_total")
+            logger.warning("Pool de PDF quebrado (processo encerrado); recriando")
+            quebrado.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._criar_executor()
+
+    def _submeter(self, pedido: PedidoPDF, argumentos: tuple, repetir: bool):
+        executor = self._executor
+        try:
+            interno = executor.submit(_renderizar_no_worker, *argumentos)
+        except BrokenProcessPool:
+            if not repetir:
+                raise
+            self._recriar(executor)
+            return self._submeter(pedido, argumentos, False)
+
+        def _concluir(f):
+            if f.cancelled():
+                self._vagas.release()
+                pedido.futuro.cancel()
+                return
+            erro = f.exception()
+            if isinstance(erro, BrokenProcessPool) and repetir:
+                self._recriar(executor)
+                try:
+                    self._submeter(pedido, argumentos, False)
+                    return
+                except Exception as e:
+                    erro = e
+            if erro is not None:
+                self._vagas.release()
+                metricas.incrementar("pdf_erros_total")
+                pedido.futuro.set_exception(erro)
+                return
+            self._vagas.release()
+            pdf, espera_fila, duracao = f.result()
+            metricas.observar("pdf_espera_fila_segundos", max(0.0, espera_fila))
+            metricas.observar("pdf_renderizacao_segundos", duracao)
+            metricas.observar("pdf_tamanho_bytes", len(pdf))
+            pedido.futuro.set_result(pdf)
+
+        pedido._interno = interno
+        interno.add_done_callback(_concluir)
+
+    def renderizar(self, registro: dict, medias_dim: dict, medias_base: dict = None,
+                   posicao: dict = None, titulo: str = "Relatório de Diagnóstico",
+                   recomendacoes: dict = None) -> PedidoPDF:
+        if not self._vagas.acquire(timeout=self.espera_vaga):
+            metricas.incrementar("pdf_rejeitados_total")
+            raise FilaPDFCheia("Fila de geração de PDF cheia. Tente novamente em instantes.")
+
+        pedido = PedidoPDF()
+        argumentos = (dict(registro), dict(medias_dim), dict(medias_base or {}), str(self.logo_path), time.time(),
+                      posicao, titulo, dict(recomendacoes or {}))
+        try:
+            self._submeter(pedido, argumentos, True)
+        except Exception:
+            self._vagas.release()
+            raise
+        return pedido
+
+    def gerar(self, registro: dict, medias_dim: dict, medias_base: dict = None, timeout: float = None,
+              posicao: dict = None, titulo: str = "Relatório de Diagnóstico", recomendacoes: dict = None) -> bytes:
+        pedido = self.renderizar(registro, medias_dim, medias_base, posicao, titulo, recomendacoes)
+        try:
+            return pedido.resultado(timeout=timeout or self.timeout)
+        except FuturesTimeoutError:
+            pedido.cancelar()
+            metricas.incrementar("pdf_timeouts_total")
+            raise Exception("Tempo esgotado na geração do PDF do relatório.")
+
+    def encerrar(self):
+        with self._lock_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
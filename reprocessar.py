@@ -0,0 +1,296 @@
+"""Reprocessa a pontuação de respostas já armazenadas com as regras atuais.
+
+Lê uma exportação (CSV ou XLSX da planilha) ou a base local em lotes, recalcula
+score_geral, nivel_maturidade e score_dim_* com o motor de pontuação vetorizado e
+grava um arquivo com as colunas novas ao lado das antigas, mais um resumo das
+diferenças. Cada linha é pontuada pelo instrumento da sua versao_instrumento
+(a padrão quando vazia ou desconhecida), salvo com --versao. A memória fica
+limitada ao tamanho do lote.
+
+Uso:
+    python reprocessar.py --arquivo respostas.csv --saida reprocessado.csv
+    python reprocessar.py --base dados/respostas.db --saida reprocessado.xlsx --lote 20000
+    python reprocessar.py --arquivo respostas.csv --saida reprocessado.csv --versao agenda_estrategica_v1
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from instrumento import CatalogoInstrumentos, carregar_catalogo
+from pontuacao import classificar_niveis, coluna_dimensao
+
+TOLERANCIA = 0.005  # diferenças menores que o arredondamento em 2 casas não contam
+
+
+# -------------------
+# Leitura em lotes
+# -------------------
+def lotes_csv(caminho: Path, tamanho: int):
+    # Como texto: as colunas antigas saem exatamente como entraram
+    yield from pd.read_csv(caminho, chunksize=tamanho, dtype=str, keep_default_na=False)
+
+
+def lotes_xlsx(caminho: Path, tamanho: int):
+    from openpyxl import load_workbook
+
+    livro = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        linhas = livro.active.iter_rows(values_only=True)
+        cabecalho = [str(c) if c is not None else "" for c in next(linhas, [])]
+        lote = []
+        for linha in linhas:
+            lote.append(linha)
+            if len(lote) >= tamanho:
+                yield pd.DataFrame(lote, columns=cabecalho)
+                lote = []
+        if lote:
+            yield pd.DataFrame(lote, columns=cabecalho)
+    finally:
+        livro.close()
+
+
+def lotes_base(caminho: Path, tamanho: int):
+    from armazenamento import RepositorioRespostas
+
+    for lote in RepositorioRespostas(caminho).iterar(tamanho_lote=tamanho):
+        yield pd.DataFrame(lote)
+
+
+def colunas_base(caminho: Path, tamanho: int) -> list:
+    """União das chaves de todos os registros, na ordem em que aparecem (uma passada a mais pela base)."""
+    from armazenamento import RepositorioRespostas
+
+    colunas = {}
+    for lote in RepositorioRespostas(caminho).iterar(tamanho_lote=tamanho):
+        for registro in lote:
+            colunas.update(dict.fromkeys(registro))
+    return list(colunas)
+
+
+# -------------------
+# Gravação
+# -------------------
+class SaidaCSV:
+    def __init__(self, caminho: Path):
+        self._arquivo = open(caminho, "w", newline="", encoding="utf-8")
+        self._cabecalho = True
+
+    def escrever(self, tabela: pd.DataFrame):
+        tabela.to_csv(self._arquivo, index=False, header=self._cabecalho)
+        self._cabecalho = False
+
+    def fechar(self):
+        self._arquivo.close()
+
+
+class SaidaXLSX:
+    def __init__(self, caminho: Path):
+        from openpyxl import Workbook
+
+        self.caminho = caminho
+        self._livro = Workbook(write_only=True)
+        self._aba = self._livro.create_sheet("respostas")
+        self._cabecalho = True
+
+    def escrever(self, tabela: pd.DataFrame):
+        if self._cabecalho:
+            self._aba.append(list(tabela.columns))
+            self._cabecalho = False
+        for linha in tabela.astype(object).where(tabela.notna(), None).itertuples(index=False, name=None):
+            self._aba.append(linha)
+
+    def fechar(self):
+        self._livro.save(self.caminho)
+
+
+# -------------------
+# Resumo das diferenças
+# -------------------
+class ResumoDiferencas:
+    def __init__(self, colunas_dimensao: list):
+        self.linhas = 0
+        self.sem_respostas = 0
+        self.score_alterado = 0
+        self.comparaveis = 0
+        self.soma_delta = 0.0
+        self.maior_delta = 0.0
+        self.nivel_alterado = 0
+        self.transicoes = Counter()
+        self.versoes = Counter()
+        self.dimensoes = {coluna: Counter() for coluna in colunas_dimensao}
+
+    def acumular(self, antigo_score, novo_score, antigo_nivel, novo_nivel, antigas_dim: dict, novas_dim: dict, versoes):
+        self.linhas += len(novo_score)
+        self.sem_respostas += int(np.isnan(novo_score).sum())
+
+        delta = novo_score - antigo_score
+        comparaveis = ~np.isnan(delta)
+        alterado = (np.abs(np.nan_to_num(delta)) > TOLERANCIA) | (np.isnan(antigo_score) != np.isnan(novo_score))
+        self.score_alterado += int(alterado.sum())
+        self.comparaveis += int(comparaveis.sum())
+        if comparaveis.any():
+            self.soma_delta += float(delta[comparaveis].sum())
+            self.maior_delta = max(self.maior_delta, float(np.abs(delta[comparaveis]).max()))
+
+        mudou_nivel = antigo_nivel != novo_nivel
+        self.nivel_alterado += int(mudou_nivel.sum())
+        self.transicoes.update(zip(antigo_nivel[mudou_nivel].tolist(), novo_nivel[mudou_nivel].tolist()))
+        self.versoes.update(versoes.tolist())
+
+        for coluna, novo in novas_dim.items():
+            antigo = antigas_dim[coluna]
+            sem_antigo = np.isnan(antigo) & ~np.isnan(novo)
+            diferente = np.abs(np.nan_to_num(novo - antigo)) > TOLERANCIA
+            self.dimensoes[coluna].update(novas=int(sem_antigo.sum()), alteradas=int(diferente.sum()))
+
+    def texto(self) -> str:
+        linhas = [
+            f"Linhas processadas: {self.linhas}",
+            f"Linhas sem respostas reconhecidas: {self.sem_respostas}",
+            f"score_geral alterado: {self.score_alterado}"
+            + (f" (maior diferença {self.maior_delta:.2f}; diferença média {self.soma_delta / self.comparaveis:+.4f}"
+               f" em {self.comparaveis} linhas com nota antiga)"
+               if self.comparaveis else ""),
+            f"nivel_maturidade alterado: {self.nivel_alterado}",
+        ]
+        for (antes, depois), n in self.transicoes.most_common(10):
+            linhas.append(f"  {antes or '(vazio)'} -> {depois or '(vazio)'}: {n}")
+        for coluna, contagem in self.dimensoes.items():
+            linhas.append(f"{coluna}: {contagem['alteradas']} alteradas, {contagem['novas']} preenchidas pela primeira vez")
+        linhas.append("Versões do instrumento na origem: " + ", ".join(
+            f"{versao or '(vazio)'}={n}" for versao, n in self.versoes.most_common()
+        ))
+        return "\n".join(linhas)
+
+
+# -------------------
+# Reprocessamento
+# -------------------
+def _numerico(tabela: pd.DataFrame, coluna: str) -> np.ndarray:
+    if coluna not in tabela:
+        return np.full(len(tabela), np.nan)
+    return pd.to_numeric(tabela[coluna], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _texto(tabela: pd.DataFrame, coluna: str) -> np.ndarray:
+    if coluna not in tabela:
+        return np.full(len(tabela), None, dtype=object)
+    valores = tabela[coluna].astype(object).to_numpy()
+    return np.where(pd.isna(valores) | (valores == ""), None, valores)
+
+
+def _pontuar_por_versao(tabela: pd.DataFrame, catalogo: CatalogoInstrumentos, versao: str, colunas_dim: list):
+    """Notas do lote, com cada grupo de linhas pontuado pelo instrumento da sua versão."""
+    n = len(tabela)
+    geral = np.full(n, np.nan)
+    dimensoes = np.full((n, len(colunas_dim)), np.nan)
+    versoes = np.empty(n, dtype=object)
+    if versao:
+        origem = np.full(n, versao, dtype=object)
+    else:
+        origem = np.array([catalogo.obter(v).versao for v in _texto(tabela, "versao_instrumento")], dtype=object)
+
+    for v in pd.unique(origem):
+        instrumento = catalogo.obter(v)
+        linhas = np.flatnonzero(origem == v)
+        motor = instrumento.motor
+        notas = motor.pontuar_lote(motor.matriz_de_colunas(tabela.iloc[linhas]))
+        geral[linhas] = notas["geral"]
+        for j, dim in enumerate(motor.dimensoes):
+            dimensoes[linhas, colunas_dim.index(coluna_dimensao(dim))] = notas["dimensoes"][:, j]
+        versoes[linhas] = instrumento.versao
+    return geral, dimensoes, versoes
+
+
+def _colunas_novas(colunas_dim: list, sufixo: str) -> list:
+    return ["score_geral" + sufixo, "nivel_maturidade" + sufixo, *(c + sufixo for c in colunas_dim),
+            "versao_instrumento" + sufixo]
+
+
+def reprocessar(lotes, saida, sufixo: str = "_reprocessado", catalogo: CatalogoInstrumentos = None,
+                versao: str = None, colunas: list = None) -> ResumoDiferencas:
+    """Com `versao`, todas as linhas são pontuadas por esse instrumento.
+
+    `colunas` fixa as colunas de origem da saída; sem ela vale o cabeçalho do primeiro
+    lote, o que só serve quando todos os lotes têm o mesmo (CSV e XLSX).
+    """
+    catalogo = catalogo or carregar_catalogo()
+    if versao and catalogo.obter(versao).versao != versao:
+        raise Exception(f"Erro ao reprocessar: versão {versao} não encontrada em {catalogo.diretorio}")
+    colunas_dim = list(dict.fromkeys(coluna_dimensao(dim) for i in catalogo for dim in i.dimensoes))
+    resumo = ResumoDiferencas(colunas_dim)
+    colunas_saida = None
+    if colunas is not None:
+        colunas_saida = list(colunas) + [c for c in _colunas_novas(colunas_dim, sufixo) if c not in colunas]
+
+    for tabela in lotes:
+        geral, dimensoes, versoes = _pontuar_por_versao(tabela, catalogo, versao, colunas_dim)
+        novo_nivel = classificar_niveis(geral)
+
+        resumo.acumular(
+            _numerico(tabela, "score_geral"),
+            geral,
+            _texto(tabela, "nivel_maturidade"),
+            novo_nivel,
+            {coluna: _numerico(tabela, coluna) for coluna in colunas_dim},
+            {coluna: dimensoes[:, j] for j, coluna in enumerate(colunas_dim)},
+            _texto(tabela, "versao_instrumento"),
+        )
+
+        novas = {
+            "score_geral" + sufixo: geral,
+            "nivel_maturidade" + sufixo: novo_nivel,
+            **{coluna + sufixo: dimensoes[:, j] for j, coluna in enumerate(colunas_dim)},
+            "versao_instrumento" + sufixo: versoes,
+        }
+        tabela = tabela.assign(**novas)
+        if colunas_saida is None:
+            colunas_saida = list(tabela.columns)
+        saida.escrever(tabela.reindex(columns=colunas_saida))
+
+    return resumo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reprocessa a pontuação das respostas armazenadas.")
+    origem = parser.add_mutually_exclusive_group(required=True)
+    origem.add_argument("--arquivo", type=Path, help="Exportação em CSV ou XLSX")
+    origem.add_argument("--base", type=Path, help="Base local SQLite (respostas.db)")
+    parser.add_argument("--saida", type=Path, required=True, help="Arquivo de saída (.csv ou .xlsx)")
+    parser.add_argument("--lote", type=int, default=50000, help="Linhas por lote (padrão: 50000)")
+    parser.add_argument("--sufixo", default="_reprocessado", help="Sufixo das colunas novas")
+    parser.add_argument("--versao", help="Pontua todas as linhas com esta versão do instrumento")
+    parser.add_argument("--instrumentos", type=Path, help="Pasta dos instrumentos (padrão: instrumentos/)")
+    args = parser.parse_args(argv)
+
+    colunas = None
+    if args.base:
+        # Registros antigos podem não ter todas as chaves: o cabeçalho é a união de toda a base
+        colunas = colunas_base(args.base, args.lote)
+        lotes = lotes_base(args.base, args.lote)
+    elif args.arquivo.suffix.lower() in (".xlsx", ".xlsm"):
+        lotes = lotes_xlsx(args.arquivo, args.lote)
+    else:
+        lotes = lotes_csv(args.arquivo, args.lote)
+
+    catalogo = carregar_catalogo(args.instrumentos) if args.instrumentos else carregar_catalogo()
+    saida = SaidaXLSX(args.saida) if args.saida.suffix.lower() == ".xlsx" else SaidaCSV(args.saida)
+    inicio = time.perf_counter()
+    try:
+        resumo = reprocessar(lotes, saida, args.sufixo, catalogo=catalogo, versao=args.versao,
+                              colunas=colunas)
+    finally:
+        saida.fechar()
+
+    print(resumo.texto())
+    print(f"Concluído em {time.perf_counter() - inicio:.1f} s -> {args.saida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
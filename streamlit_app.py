@@ -1,31 +1,46 @@
 import streamlit as st
-import io
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, HRFlowable
-from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
 import pandas as pd
-import math
 import openai
 import streamlit.components.v1 as components
 import os
 import uuid
 import html
-import base64
+import json
+import contextvars
 from datetime import datetime
 from pathlib import Path
-import smtplib
-import ssl
 from email.message import EmailMessage
 import gspread
 from gspread.exceptions import SpreadsheetNotFound, WorksheetNotFound
 from google.oauth2.service_account import Credentials
+import atexit
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fila_gravacao import FilaGravacao
+from planilhas import ClienteSheets, RegistroEsquemas, erro_do_registro
+from armazenamento import RepositorioRespostas
+from relatorio_pdf import PoolRenderizacaoPDF, gerar_pdf_relatorio
+from fila_email import ConexaoSMTP, FilaEmail, ENVIADO, FALHOU
+import metricas
+import re
+from contexto_ia import GerenciadorContexto, contar_tokens, contar_tokens_mensagens
+from limite_ia import LimitadorIA, LimiteIAExcedido, executar_com_retentativas
+from cache_respostas_ia import CacheRespostasCompartilhado, CacheRespostasIA, versao_cache
+from analise_antecipada import ExecutorAntecipado
+from ativos import RegistroAtivos
+from agregados import AgregadosIncrementais, alvo_questao, alvo_secao, combinar_fotografias
+from base_comparacao import GERAL, MotorBase, normalizar_segmento
+from relatorio_html import CacheRelatorios, gerar_html_relatorio
+from pontuacao import classificar_nivel, coluna_dimensao, coluna_questao
+from instrumento import DIRETORIO_INSTRUMENTOS, carregar_catalogo
+from idempotencia import EMAIL, SALVO, IndiceSubmissoes, chave_submissao
+from estado_compartilhado import BackendSQLite, FilaCompartilhada, criar_backend
+from medicao_execucoes import iniciar_execucao, concluir_execucao, medir_fragmento, execucao_de_fragmento
 
 # -------------------
 # CONFIG GERAIS
@@ -43,15 +58,27 @@ st.set_page_config(
     layout="centered"
 )
 
-LOGO_PATH = Path("publix_logo.png")
+LOGO_PATH = Path("static/publix_logo.png")
+CSS_PATH = Path("static/estilo.css")
+
+logger = logging.getLogger("observatorio")
+iniciar_execucao(st.session_state)
 
 
 # -------------------
 # UTILITÁRIOS DE CONFIG
 # -------------------
+def _secrets_disponiveis():
+    # Sem secrets.toml, st.secrets exibe um st.error a cada chave opcional ausente
+    try:
+        return any(Path(p).exists() for p in st.config.get_option("secrets.files"))
+    except Exception:
+        return True
+
+
 def get_config_value(key: str):
     value = os.getenv(key)
-    if value in (None, ""):
+    if value in (None, "") and _secrets_disponiveis():
         try:
             value = st.secrets.get(key)
         except Exception:
@@ -61,6 +88,24 @@ def get_config_value(key: str):
     return value
 
 
+# Pasta local para diários e bases persistentes (montar como volume em produção)
+DATA_DIR = Path(get_config_value("PUBLIX_DATA_DIR") or "dados")
+# Com várias réplicas no mesmo volume, cada uma guarda as suas bases locais (respostas, e-mails) numa subpasta.
+# Ao ligar o REPLICA_ID (ou o estado compartilhado) numa pasta já usada, as filas antigas em DATA_DIR são
+# drenadas na subida: a primeira réplica a abrir cada fila importa os pendentes (ver obter_fila_gravacao e
+# obter_fila_email). respostas.db antigo continua lido como a base "local" dos agregados; submissoes.db e
+# cache_respostas_ia.db antigos só guardam entradas com prazo e não são migrados.
+REPLICA_ID = get_config_value("REPLICA_ID")
+DATA_DIR_REPLICA = DATA_DIR / "replicas" / REPLICA_ID if REPLICA_ID else DATA_DIR
+
+
+@st.cache_resource
+def obter_estado_compartilhado():
+    # Fila da planilha, chaves de idempotência, limites de API e cache da IA comuns a todas as réplicas;
+    # sem ESTADO_COMPARTILHADO_URL (None), cada processo mantém os seus
+    return criar_backend(get_config_value("ESTADO_COMPARTILHADO_URL"))
+
+
 def formatar_resumo_email(registro: dict, medias_dim: dict) -> str:
     contato_msg = "Sim" if bool(registro.get("deseja_contato_diagnostico_completo", False)) else "Não"
 
@@ -90,23 +135,20 @@ def formatar_resumo_email(registro: dict, medias_dim: dict) -> str:
 
     if medias_dim:
         linhas.append("ANÁLISE POR DIMENSÃO")
+        medias_base = base_observatorio().medias_dimensao()
+        recomendacoes = recomendacoes_relatorio(registro, medias_dim)
         for dim, media in medias_dim.items():
-            base = observatorio_means.get(dim)
+            base = medias_base.get(dim)
             if base is None:
                 continue
             diff = round(media - base, 2)
-            if media < 1.5:
-                mensagem = "Prioridade alta: estruturar fundamentos da agenda estratégica (objetivos, metas, cenários e planos de ação)."
-            elif media < 2.0:
-                mensagem = "Prioridade média: fortalecer consistência, alinhamento e institucionalização das práticas estratégicas."
-            else:
-                mensagem = "Bom nível relativo: foco em consolidar, padronizar e ampliar a disseminação interna das práticas estratégicas."
+            prioridade, recomendacao = recomendacoes[dim]
 
             linhas.append(f"- {dim}:")
             linhas.append(f"  • Média da organização: {media:.2f}")
             linhas.append(f"  • Média da base: {base:.2f}")
             linhas.append(f"  • Diferença: {diff:+.2f}")
-            linhas.append(f"  • Leitura rápida: {mensagem}")
+            linhas.append(f"  • Leitura rápida: {prioridade}: {recomendacao}")
             linhas.append("")
 
     linhas.append("Este é um diagnóstico prévio. Caso tenha assinalado interesse, nossa equipe poderá entrar em contato para um diagnóstico completo.")
@@ -116,277 +158,167 @@ def formatar_resumo_email(registro: dict, medias_dim: dict) -> str:
     return "\n".join(linhas)
 
 
-def gerar_pdf_relatorio(registro: dict, medias_dim: dict) -> bytes:
-    """Gera o PDF do relatório fiel ao layout da tela, sem ID do diagnóstico."""
-    from reportlab.graphics.shapes import Drawing, Rect
-    from reportlab.graphics import renderPDF
+def reexecutar_fragmento():
+    # scope="fragment" só é aceito quando a execução atual já é de fragmento
+    if execucao_de_fragmento():
+        st.rerun(scope="fragment")
+    st.rerun()
 
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        rightMargin=18*mm,
-        leftMargin=18*mm,
-        topMargin=16*mm,
-        bottomMargin=16*mm,
+
+# -------------------
+# OBSERVABILIDADE
+# -------------------
+@st.cache_resource
+def iniciar_observabilidade():
+    # Logs JSON das etapas (observatorio.etapas) e GET /metrics para o Prometheus; METRICAS_PORTA=0 desliga
+    log_etapas = logging.getLogger("observatorio.etapas")
+    if str(get_config_value("LOG_ETAPAS") or "1").lower() not in ("0", "false", "nao"):
+        manipulador = logging.StreamHandler()
+        manipulador.setFormatter(logging.Formatter("%(message)s"))
+        log_etapas.addHandler(manipulador)
+        log_etapas.setLevel(logging.INFO)
+        log_etapas.propagate = False
+
+    porta = int(get_config_value("METRICAS_PORTA") or 9108)
+    if porta <= 0:
+        return None
+    servidor = metricas.ServidorMetricas(porta, get_config_value("METRICAS_ENDERECO") or "0.0.0.0")
+    try:
+        servidor.iniciar()
+    except OSError as e:
+        # Outro processo na mesma máquina já expõe a porta
+        logger.warning("Endpoint de métricas indisponível na porta %s: %s", porta, e)
+        return None
+    atexit.register(servidor.parar)
+    return servidor
+
+
+# -------------------
+# PDF DO RELATÓRIO
+# -------------------
+@st.cache_resource
+def obter_pool_pdf():
+    # PDF_PROCESSOS=0 renderiza na própria thread (útil em desenvolvimento)
+    processos = int(get_config_value("PDF_PROCESSOS") or 2)
+    if processos <= 0:
+        return None
+    pool = PoolRenderizacaoPDF(
+        processos=processos,
+        fila_maxima=int(get_config_value("PDF_FILA_MAXIMA") or 8),
+        timeout=float(get_config_value("PDF_TIMEOUT") or 60),
+        logo_path=LOGO_PATH,
     )
+    atexit.register(pool.encerrar)
+    return pool
 
-    PAGE_W = A4[0] - 36*mm  # largura útil
-
-    amarelo      = colors.HexColor("#FFC728")
-    amarelo_grad = colors.HexColor("#FFB300")
-    cinza_claro  = colors.HexColor("#f8f8f8")
-    cinza_borda  = colors.HexColor("#e0e0e0")
-    cinza_texto  = colors.HexColor("#444444")
-    cinza_muted  = colors.HexColor("#666666")
-    preto        = colors.HexColor("#111111")
-
-    def s(name, **kw):
-        base = ParagraphStyle(name, fontName="Helvetica", fontSize=9,
-                              textColor=cinza_texto, leading=13)
-        for k, v in kw.items():
-            setattr(base, k, v)
-        return base
-
-    st_titulo    = s("titulo",   fontName="Helvetica-Bold", fontSize=13, textColor=preto, leading=17, spaceAfter=2)
-    st_sub       = s("sub",      fontSize=8,  textColor=colors.HexColor("#555555"), leading=12, spaceAfter=2)
-    st_secao     = s("secao",    fontName="Helvetica-Bold", fontSize=10, textColor=preto, spaceBefore=8, spaceAfter=5)
-    st_label     = s("label",    fontSize=7.5, textColor=colors.HexColor("#888888"), leading=11)
-    st_valor     = s("valor",    fontName="Helvetica-Bold", fontSize=9, textColor=preto, leading=13)
-    st_normal    = s("normal",   fontSize=8.5, textColor=cinza_texto, leading=13)
-    st_muted     = s("muted",    fontSize=8,   textColor=cinza_muted,  leading=12)
-    st_rodape    = s("rodape",   fontSize=7.5, textColor=colors.HexColor("#aaaaaa"), alignment=TA_RIGHT)
-    st_badge_on  = s("badge_on", fontName="Helvetica-Bold", fontSize=7.5,
-                     textColor=preto, backColor=colors.HexColor("#fff3c4"),
-                     borderColor=amarelo, borderWidth=0.5, borderPadding=3)
-    st_badge_off = s("badge_off", fontSize=7.5, textColor=colors.HexColor("#888888"),
-                     backColor=colors.white, borderColor=cinza_borda,
-                     borderWidth=0.5, borderPadding=3)
-
-    story = []
-
-    # ── Faixa amarela topo ──────────────────────────────────────────────
-    story.append(Table([[""]], colWidths=[PAGE_W], rowHeights=[4],
-        style=TableStyle([("BACKGROUND",(0,0),(-1,-1), amarelo),
-                          ("LINEABOVE",(0,0),(-1,-1),0,colors.white)])))
-    story.append(Spacer(1, 5*mm))
-
-    # ── Cabeçalho: título + logo ────────────────────────────────────────
-    # Logo — tenta carregar do arquivo
-    logo_b64 = file_to_base64(LOGO_PATH)
-    if logo_b64:
-        from reportlab.platypus import Image as RLImage
-        logo_data = base64.b64decode(logo_b64)
-        logo_buf = io.BytesIO(logo_data)
-        logo_img = RLImage(logo_buf, width=28*mm, height=18*mm, kind="proportional")
-        header_data = [[
-            [Paragraph("Relatório de Diagnóstico — Agenda Estratégica", st_titulo),
-             Paragraph("Observatório de Governança para Resultados: Inteligência Artificial", st_sub),
-             Paragraph(f"Emitido em: {registro.get('data_hora','')}", st_sub)],
-            logo_img
-        ]]
-        t_header = Table(header_data, colWidths=[PAGE_W - 32*mm, 32*mm])
-        t_header.setStyle(TableStyle([
-            ("VALIGN",(0,0),(-1,-1),"TOP"),
-            ("ALIGN",(1,0),(1,0),"RIGHT"),
-            ("LEFTPADDING",(0,0),(-1,-1),0),
-            ("RIGHTPADDING",(0,0),(-1,-1),0),
-            ("TOPPADDING",(0,0),(-1,-1),0),
-            ("BOTTOMPADDING",(0,0),(-1,-1),0),
-        ]))
-    else:
-        t_header = Table([[
-            [Paragraph("Relatório de Diagnóstico — Agenda Estratégica", st_titulo),
-             Paragraph("Observatório de Governança para Resultados", st_sub),
-             Paragraph(f"Emitido em: {registro.get('data_hora','')}", st_sub)]
-        ]], colWidths=[PAGE_W])
-
-    story.append(t_header)
-    story.append(Spacer(1, 3*mm))
-    story.append(HRFlowable(width="100%", thickness=1, color=cinza_borda, spaceAfter=5))
-
-    # ── Identificação institucional ─────────────────────────────────────
-    story.append(Paragraph("Identificação institucional", st_secao))
-
-    half = PAGE_W / 2 - 1*mm
-    def kpi_cell(label, valor):
-        return [Paragraph(label, st_label), Paragraph(str(valor), st_valor)]
-
-    t_inst = Table([
-        [kpi_cell("Instituição", registro.get("instituicao","")),
-         kpi_cell("Classificação", f"{registro.get('poder','')} | {registro.get('esfera','')} | {registro.get('estado_uf','')}")],
-        [kpi_cell("Respondente", registro.get("nome_respondente","")),
-         kpi_cell("Cargo / contato", f"{registro.get('cargo_funcao','')} | {registro.get('email_respondente','')}")],
-    ], colWidths=[half, half])
-    t_inst.setStyle(TableStyle([
-        ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
-        ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
-        ("INNERGRID",(0,0),(-1,-1), 0.5, cinza_borda),
-        ("LINEBEFORE",(0,0),(0,-1), 3, amarelo),
-        ("LINEBEFORE",(1,0),(1,-1), 3, amarelo),
-        ("TOPPADDING",(0,0),(-1,-1), 6),
-        ("BOTTOMPADDING",(0,0),(-1,-1), 6),
-        ("LEFTPADDING",(0,0),(-1,-1), 8),
-        ("RIGHTPADDING",(0,0),(-1,-1), 6),
-        ("VALIGN",(0,0),(-1,-1),"TOP"),
-    ]))
-    story.append(t_inst)
-    story.append(Spacer(1, 5*mm))
-
-    # ── Resultado geral (sem ID) ────────────────────────────────────────
-    story.append(Paragraph("Resultado geral", st_secao))
-    score_raw = float(registro.get("score_geral", 0) or 0)
-    nivel_txt = str(registro.get("nivel_maturidade",""))
-
-    t_res = Table([
-        [kpi_cell("Score geral", f"{score_raw:.2f} / 3,00"),
-         kpi_cell("Nível de maturidade", nivel_txt)],
-    ], colWidths=[half, half])
-    t_res.setStyle(TableStyle([
-        ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
-        ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
-        ("INNERGRID",(0,0),(-1,-1), 0.5, cinza_borda),
-        ("LINEBEFORE",(0,0),(0,-1), 3, amarelo),
-        ("LINEBEFORE",(1,0),(1,-1), 3, amarelo),
-        ("TOPPADDING",(0,0),(-1,-1), 6),
-        ("BOTTOMPADDING",(0,0),(-1,-1), 6),
-        ("LEFTPADDING",(0,0),(-1,-1), 8),
-        ("RIGHTPADDING",(0,0),(-1,-1), 6),
-        ("VALIGN",(0,0),(-1,-1),"TOP"),
-    ]))
-    story.append(t_res)
-    story.append(Spacer(1, 5*mm))
-
-    # ── Visual executivo — barra de maturidade + badges ─────────────────
-    story.append(Paragraph("Visual executivo", st_secao))
-
-    score_pct = max(0.0, min(score_raw / 3.0, 1.0))
-    BAR_W = PAGE_W - 20*mm   # largura da barra dentro do card
-    BAR_H = 8                 # altura em pts
-
-    if score_raw < 1.0:   active = 0
-    elif score_raw < 2.0: active = 1
-    elif score_raw < 2.6: active = 2
-    else:                  active = 3
-    levels = ["Incipiente", "Em estruturação", "Parcialmente estruturado", "Bem estruturado"]
-
-    # desenha barra usando Drawing
-    bar_drawing = Drawing(BAR_W, BAR_H + 2)
-    bar_drawing.add(Rect(0, 1, BAR_W, BAR_H,
-                         fillColor=colors.HexColor("#f1f1f1"), strokeColor=None))
-    bar_drawing.add(Rect(0, 1, BAR_W * score_pct, BAR_H,
-                         fillColor=amarelo, strokeColor=None))
-
-    badges = []
-    for i, lbl in enumerate(levels):
-        st_b = st_badge_on if i == active else st_badge_off
-        badges.append(Paragraph(lbl, st_b))
-
-    visual_content = [
-        [Paragraph("<b>Indicador visual de maturidade</b>", st_normal)],
-        [Paragraph(f"Score geral: <b>{score_raw:.2f}</b> / 3,0", st_normal)],
-        [bar_drawing],
-        [Paragraph("Escala de 0 a 3", st_muted)],
-        [Table([badges], colWidths=[PAGE_W/4 - 6*mm]*4,
-               style=TableStyle([("ALIGN",(0,0),(-1,-1),"CENTER"),
-                                 ("VALIGN",(0,0),(-1,-1),"MIDDLE"),
-                                 ("LEFTPADDING",(0,0),(-1,-1),2),
-                                 ("RIGHTPADDING",(0,0),(-1,-1),2)]))],
-    ]
-    t_visual = Table(visual_content, colWidths=[PAGE_W - 16*mm])
-    t_visual.setStyle(TableStyle([
-        ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
-        ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
-        ("TOPPADDING",(0,0),(-1,-1), 5),
-        ("BOTTOMPADDING",(0,0),(-1,-1), 4),
-        ("LEFTPADDING",(0,0),(-1,-1), 8),
-        ("RIGHTPADDING",(0,0),(-1,-1), 8),
-    ]))
-    story.append(t_visual)
-    story.append(Spacer(1, 5*mm))
-
-    # ── Análise por dimensão ────────────────────────────────────────────
-    if medias_dim:
-        story.append(Paragraph("Análise por dimensão", st_secao))
-        for dim, media in medias_dim.items():
-            base = 1.92
-            diff = round(media - base, 2)
-            sinal = "+" if diff >= 0 else ""
 
-            org_pct  = max(0.0, min(media / 3.0, 1.0))
-            base_pct = max(0.0, min(base  / 3.0, 1.0))
+NOME_ARQUIVO_PDF = "Relatorio_Diagnostico_Publix.pdf"
 
-            if media < 1.5:
-                prioridade  = "Prioridade alta"
-                recomendacao = "Estruturar fundamentos da agenda estratégica (cenários, objetivos, metas e planos de ação)."
-            elif media < 2.0:
-                prioridade  = "Prioridade média"
-                recomendacao = "Fortalecer consistência e institucionalização das práticas estratégicas."
-            else:
-                prioridade  = "Prioridade de consolidação"
-                recomendacao = "Padronizar e ampliar a disseminação interna das práticas já existentes."
-
-            DIM_W = PAGE_W - 20*mm
-
-            org_bar = Drawing(DIM_W, BAR_H + 2)
-            org_bar.add(Rect(0,1, DIM_W, BAR_H, fillColor=colors.HexColor("#f1f1f1"), strokeColor=None))
-            org_bar.add(Rect(0,1, DIM_W*org_pct, BAR_H, fillColor=amarelo, strokeColor=None))
-
-            base_bar = Drawing(DIM_W, BAR_H + 2)
-            base_bar.add(Rect(0,1, DIM_W, BAR_H, fillColor=colors.HexColor("#f1f1f1"), strokeColor=None))
-            base_bar.add(Rect(0,1, DIM_W*base_pct, BAR_H, fillColor=colors.HexColor("#cfcfcf"), strokeColor=None))
-
-            dim_rows = [
-                [Paragraph(f"<b>{dim}</b>", st_normal)],
-                [Paragraph(
-                    f"Média da organização: <b>{media:.2f}</b> &nbsp;|&nbsp; "
-                    f"Base: <b>{base:.2f}</b> &nbsp;|&nbsp; "
-                    f"Diferença: <b>{sinal}{diff:.2f}</b>",
-                    st_normal)],
-                [Paragraph("<b>Organização</b>", st_muted)],
-                [org_bar],
-                [Paragraph("<b>Base nacional</b>", st_muted)],
-                [base_bar],
-                [Paragraph(f"<b>{prioridade}:</b> {recomendacao}", st_muted)],
-            ]
-            t_dim = Table(dim_rows, colWidths=[DIM_W])
-            t_dim.setStyle(TableStyle([
-                ("BOX",(0,0),(-1,-1), 0.5, cinza_borda),
-                ("BACKGROUND",(0,0),(-1,-1), cinza_claro),
-                ("LINEBEFORE",(0,0),(0,-1), 3, amarelo),
-                ("TOPPADDING",(0,0),(-1,-1), 5),
-                ("BOTTOMPADDING",(0,0),(-1,-1), 4),
-                ("LEFTPADDING",(0,0),(-1,-1), 8),
-                ("RIGHTPADDING",(0,0),(-1,-1), 8),
-            ]))
-            story.append(t_dim)
-            story.append(Spacer(1, 4*mm))
-
-    # ── Rodapé ──────────────────────────────────────────────────────────
-    story.append(Spacer(1, 6*mm))
-    story.append(HRFlowable(width="100%", thickness=0.5, color=cinza_borda, spaceAfter=3))
-    story.append(Paragraph("Desenvolvido pelo Instituto Publix — institutopublix.com.br", st_rodape))
-
-    doc.build(story)
-    return buffer.getvalue()
-
-def enviar_resumo_por_email(destinatario: str, registro: dict, medias_dim: dict):
+
+@st.cache_resource
+def obter_cache_relatorios():
+    return CacheRelatorios(max_itens=int(get_config_value("RELATORIO_CACHE_ITENS") or 256))
+
+
+@st.cache_resource
+def obter_executor_relatorios():
+    # Prepara o PDF do botão de download fora da thread do script; as threads só esperam o pool de PDF
+    executor = ThreadPoolExecutor(max_workers=int(get_config_value("PDF_PROCESSOS") or 2) + 2,
+                                  thread_name_prefix="relatorio")
+    atexit.register(executor.shutdown, wait=False, cancel_futures=True)
+    return executor
+
+
+def recursos_relatorio() -> dict:
+    # Resolvidos na thread do script; os workers da fila de e-mail recebem o dicionário pronto
+    # (recursos em cache não são chamados fora de uma execução do script)
+    return {"pool": obter_pool_pdf(), "cache": obter_cache_relatorios(), "motor_base": obter_motor_base()}
+
+
+def titulo_relatorio(registro: dict) -> str:
+    return catalogo_instrumentos().obter(registro.get("versao_instrumento")).titulo_relatorio
+
+
+def recomendacoes_relatorio(registro: dict, medias_dim: dict) -> dict:
+    return catalogo_instrumentos().obter(registro.get("versao_instrumento")).recomendacoes(medias_dim)
+
+
+def _gerar_pdf(registro: dict, medias_dim: dict, posicao: dict, recursos: dict) -> bytes:
+    medias_base = recursos["motor_base"].tabela.medias_dimensao()
+    pool = recursos["pool"]
+    titulo = titulo_relatorio(registro)
+    recomendacoes = recomendacoes_relatorio(registro, medias_dim)
+    with metricas.etapa("gerar_pdf_relatorio", id_resposta=registro.get("id_resposta")) as medicao:
+        if pool is None:
+            pdf = gerar_pdf_relatorio(registro, medias_dim, logo_path=LOGO_PATH, medias_base=medias_base, posicao=posicao,
+                                      titulo=titulo, recomendacoes=recomendacoes)
+        else:
+            pdf = pool.gerar(registro, medias_dim, medias_base, posicao=posicao, titulo=titulo,
+                             recomendacoes=recomendacoes)
+        medicao.bytes = len(pdf)
+    return pdf
+
+
+def renderizar_pdf_relatorio(registro: dict, medias_dim: dict, posicao: dict = None, recursos: dict = None) -> bytes:
+    # Mesmos bytes para o anexo do e-mail e o download na tela
+    recursos = recursos or recursos_relatorio()
+    id_resposta = registro.get("id_resposta")
+    if not id_resposta:
+        return _gerar_pdf(registro, medias_dim, posicao, recursos)
+    return recursos["cache"].obter(id_resposta, "pdf", lambda: _gerar_pdf(registro, medias_dim, posicao, recursos))
+
+
+def renderizar_html_relatorio(registro: dict, medias_dim: dict, posicao: dict = None) -> str:
+    logo_src = url_logo()
+    base = base_observatorio()
+    return obter_cache_relatorios().obter(
+        registro.get("id_resposta"),
+        "html",
+        lambda: gerar_html_relatorio(registro, medias_dim, base.medias_dimensao(), logo_src, posicao,
+                                     titulo=titulo_relatorio(registro),
+                                     recomendacoes=recomendacoes_relatorio(registro, medias_dim)),
+        versao=f"{logo_src or ''}|{base.versao}",
+    )
+
+
+def ler_config_smtp() -> dict:
     smtp_host = get_config_value("SMTP_HOST")
     smtp_port = get_config_value("SMTP_PORT")
     smtp_user = get_config_value("SMTP_USER")
     smtp_password = get_config_value("SMTP_PASSWORD")
     smtp_from_email = get_config_value("SMTP_FROM_EMAIL") or smtp_user
     smtp_from_name = get_config_value("SMTP_FROM_NAME") or "Instituto Publix"
+    # "ssl", "starttls" ou "nenhuma" (servidor SMTP local de testes, sem TLS nem login)
+    smtp_seguranca = (get_config_value("SMTP_SEGURANCA") or "").lower()
 
     faltando = []
     if not smtp_host: faltando.append("SMTP_HOST")
     if not smtp_port: faltando.append("SMTP_PORT")
-    if not smtp_user: faltando.append("SMTP_USER")
-    if not smtp_password: faltando.append("SMTP_PASSWORD")
+    if smtp_seguranca != "nenhuma":
+        if not smtp_user: faltando.append("SMTP_USER")
+        if not smtp_password: faltando.append("SMTP_PASSWORD")
     if not smtp_from_email: faltando.append("SMTP_FROM_EMAIL")
     if faltando:
         raise Exception(f"Configuração de e-mail incompleta. Faltam: {', '.join(faltando)}.")
 
+    port = int(str(smtp_port).strip())
+    if not smtp_seguranca:
+        smtp_seguranca = "ssl" if port == 465 else "starttls"
+
+    return {
+        "host": smtp_host,
+        "porta": port,
+        "usuario": smtp_user,
+        "senha": smtp_password,
+        "from_email": smtp_from_email,
+        "from_name": smtp_from_name,
+        "seguranca": smtp_seguranca,
+    }
+
+
+def montar_email_relatorio(destinatario: str, registro: dict, medias_dim: dict, posicao: dict = None,
+                           recursos: dict = None):
+    config = ler_config_smtp()
     nome = registro.get("nome_respondente", "")
 
     # Corpo institucional do e-mail
@@ -438,12 +370,12 @@ Instituto Publix — institutopublix.com.br
 """
 
     # Gera PDF
-    pdf_bytes = gerar_pdf_relatorio(registro, medias_dim)
+    pdf_bytes = renderizar_pdf_relatorio(registro, medias_dim, posicao, recursos)
 
     # Monta e-mail com anexo
     msg = MIMEMultipart("mixed")
     msg["Subject"] = "Seu relatório de diagnóstico — Observatório de Governança para Resultados"
-    msg["From"] = f"{smtp_from_name} <{smtp_from_email}>"
+    msg["From"] = f"{config['from_name']} <{config['from_email']}>"
     msg["To"] = destinatario
 
     alternativa = MIMEMultipart("alternative")
@@ -456,40 +388,90 @@ Instituto Publix — institutopublix.com.br
     part_pdf.set_payload(pdf_bytes)
     encoders.encode_base64(part_pdf)
     part_pdf.add_header("Content-Disposition", "attachment",
-                        filename="Relatorio_Diagnostico_Publix.pdf")
+                        filename=NOME_ARQUIVO_PDF)
     msg.attach(part_pdf)
+    return msg
+
+
+def preparar_email_relatorio(destinatario: str, dados: dict, recursos: dict = None):
+    # Roda no worker da fila de e-mail: o id_resposta vem do próprio registro
+    with metricas.etapa("montar_email_relatorio", id_resposta=dados["registro"].get("id_resposta")) as medicao:
+        msg = montar_email_relatorio(destinatario, dados["registro"], dados["medias_dim"], dados.get("posicao"),
+                                     recursos)
+        medicao.bytes = len(msg.as_bytes())
+    return msg
+
+
+def criar_conexao_smtp():
+    config = ler_config_smtp()
+    return ConexaoSMTP(
+        config["host"],
+        config["porta"],
+        usuario=config["usuario"],
+        senha=config["senha"],
+        seguranca=config["seguranca"],
+    )
 
-    port = int(str(smtp_port).strip())
-    context = ssl.create_default_context()
 
-    if port == 465:
-        with smtplib.SMTP_SSL(smtp_host, port, context=context, timeout=30) as server:
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-    else:
-        with smtplib.SMTP(smtp_host, port, timeout=30) as server:
-            server.ehlo()
-            server.starttls(context=context)
-            server.ehlo()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+@st.cache_resource
+def obter_fila_email():
+    recursos = recursos_relatorio()
+    fila = FilaEmail(
+        DATA_DIR_REPLICA / "fila_email.db",
+        preparar_mensagem=lambda destinatario, dados: preparar_email_relatorio(destinatario, dados, recursos),
+        criar_conexao=criar_conexao_smtp,
+        trabalhadores=int(get_config_value("SMTP_CONEXOES") or 1),
+    )
+    if DATA_DIR_REPLICA != DATA_DIR:
+        fila.importar(DATA_DIR / "fila_email.db")
+    fila.iniciar()
+    atexit.register(fila.parar)
+    return fila
 
 
-def file_to_base64(path: Path):
-    if not path.exists():
-        return None
+def enviar_resumo_por_email(destinatario: str, registro: dict, medias_dim: dict, posicao: dict = None):
+    # Valida a configuração já no envio do formulário; a entrega ocorre em segundo plano
+    with metricas.etapa("enviar_resumo_por_email", id_resposta=registro["id_resposta"]) as medicao:
+        ler_config_smtp()
+        dados = {"registro": registro, "medias_dim": medias_dim, "posicao": posicao}
+        medicao.bytes = len(json.dumps(dados, ensure_ascii=False, default=str).encode("utf-8"))
+        obter_fila_email().enfileirar(registro["id_resposta"], destinatario, dados)
+
+
+def status_envio_email(id_resposta: str):
     try:
-        with open(path, "rb") as f:
-            return base64.b64encode(f.read()).decode("utf-8")
+        return obter_fila_email().status(id_resposta)
     except Exception:
         return None
 
 
 # -------------------
-# GOOGLE SHEETS
+# ATIVOS ESTÁTICOS
 # -------------------
 @st.cache_resource
+def obter_ativos():
+    return RegistroAtivos(Path("static"))
+
+
+def tag_folha_estilo() -> str:
+    ativos = obter_ativos()
+    # O Streamlit serve /app/static só com tipos de imagem; CSS externo depende do nginx
+    if str(get_config_value("ATIVOS_CSS_EXTERNO") or "").lower() in ("1", "true", "sim"):
+        url = ativos.url(CSS_PATH)
+        if url:
+            return f'<link rel="stylesheet" href="{html.escape(url)}">'
+    return "<style>\n" + ativos.texto(CSS_PATH) + "\n</style>"
+
+
+def url_logo():
+    return obter_ativos().url(LOGO_PATH)
+
+
+# -------------------
+# GOOGLE SHEETS
+# -------------------
 def conectar_google_sheets():
+    # Chamada pelo ClienteSheets, que guarda a aba; roda na thread da fila, sem st.* além dos secrets
     try:
         required_keys = [
             "GCP_TYPE", "GCP_PROJECT_ID", "GCP_PRIVATE_KEY_ID", "GCP_PRIVATE_KEY",
@@ -539,24 +521,120 @@ def conectar_google_sheets():
         raise Exception(f"Erro na conexão com Google Sheets: {e}")
 
 
-def garantir_cabecalho(aba, registro: dict):
+@st.cache_resource
+def obter_registro_esquemas():
+    return RegistroEsquemas()
+
+
+@st.cache_resource
+def obter_cliente_sheets():
+    # Um por processo: todas as gravações e leituras de cabeçalho dividem a cota por minuto da API
+    # (entre réplicas também, com ESTADO_COMPARTILHADO_URL)
+    return ClienteSheets(
+        conectar_google_sheets,
+        leituras_por_minuto=float(get_config_value("SHEETS_LEITURAS_POR_MINUTO") or 60),
+        escritas_por_minuto=float(get_config_value("SHEETS_ESCRITAS_POR_MINUTO") or 60),
+        tentativas=int(get_config_value("SHEETS_TENTATIVAS") or 5),
+        esquemas=obter_registro_esquemas(),
+        backend=obter_estado_compartilhado(),
+    )
+
+
+@metricas.medir("garantir_cabecalho")
+def garantir_cabecalho(aba, registro: dict, esquemas=None):
+    # Cabeçalho lido uma vez por aba; colunas novas entram ao final, no lugar
     try:
-        primeira_linha = aba.row_values(1)
-        cabecalho_esperado = list(registro.keys())
-        if not primeira_linha:
-            aba.insert_row(cabecalho_esperado, 1, value_input_option="USER_ENTERED")
-            return
-        if primeira_linha != cabecalho_esperado:
-            aba.insert_row(cabecalho_esperado, 1, value_input_option="USER_ENTERED")
+        return (esquemas or obter_registro_esquemas()).garantir_colunas(aba, list(registro.keys()))
     except Exception as e:
         raise Exception(f"Erro ao garantir cabeçalho da planilha: {e}")
 
 
+def gravar_lote_google_sheets(registros: list, cliente=None):
+    # Roda na thread da fila: um lote pode reunir respostas de várias sessões numa única escrita.
+    # O cliente chega pronto, criado na thread do script (recursos em cache não são chamados daqui)
+    cliente = cliente or obter_cliente_sheets()
+    ids = [r.get("id_resposta") for r in registros]
+    with metricas.etapa("gravar_lote_google_sheets", registros=len(registros), ids_resposta=ids) as medicao:
+        aba = cliente.aba()
+        colunas = {k: None for r in registros for k in r.keys()}
+        cabecalho = garantir_cabecalho(aba, colunas, cliente.esquemas)
+        # Confere na planilha (pelo id_resposta) o que uma escrita anterior pode ter gravado
+        linhas = cliente.anexar_registros(aba, cabecalho, registros)
+        medicao.bytes = len(json.dumps(linhas, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+@st.cache_resource
+def obter_fila_gravacao():
+    cliente = obter_cliente_sheets()
+    compartilhado = obter_estado_compartilhado()
+    fila = FilaGravacao(
+        DATA_DIR_REPLICA / "fila_planilha.db",
+        lambda registros: gravar_lote_google_sheets(registros, cliente),
+        nome="planilha",
+        tamanho_lote=int(get_config_value("SHEETS_TAMANHO_LOTE") or 50),
+        intervalo=float(get_config_value("SHEETS_INTERVALO_DESCARGA") or 2.0),
+        max_tentativas=int(get_config_value("SHEETS_MAX_TENTATIVAS_REGISTRO") or 5),
+        erro_do_registro=erro_do_registro,
+        # Compartilhada, qualquer réplica descarrega os registros enfileirados pelas outras
+        diario=FilaCompartilhada(
+            compartilhado, "planilha", prazo=float(get_config_value("SHEETS_RESERVA_SEGUNDOS") or 300)
+        ) if compartilhado is not None else None,
+    )
+    # Diários locais que deixaram de ser lidos: o de antes do REPLICA_ID e, com a fila compartilhada,
+    # o da própria réplica
+    antigos = {DATA_DIR / "fila_planilha.db", DATA_DIR_REPLICA / "fila_planilha.db"}
+    if compartilhado is None:
+        antigos.discard(DATA_DIR_REPLICA / "fila_planilha.db")
+    for caminho in sorted(antigos):
+        fila.importar_diario(caminho)
+    fila.iniciar()
+    atexit.register(fila.parar)
+    return fila
+
+
+# -------------------
+# BASE LOCAL DE RESPOSTAS
+# -------------------
+@st.cache_resource
+def obter_repositorio_respostas():
+    return RepositorioRespostas(DATA_DIR_REPLICA / "respostas.db")
+
+
+def salvar_registro(registro: dict):
+    # Base local é a gravação primária; a planilha é espelhada de forma assíncrona.
+    # A gravação é a trava de idempotência: fila e agregados só recebem um id_resposta novo,
+    # e numa nova tentativa de um salvamento que já passou daqui nada é repetido
+    repositorio = obter_repositorio_respostas()
+    try:
+        novo = repositorio.inserir(registro)
+    except Exception as e:
+        raise Exception(f"Erro ao salvar registro na base local: {e}")
+    if not novo:
+        return
+    try:
+        salvar_registro_google_sheets(registro)
+    except Exception:
+        # Sem a linha na fila, desfaz a gravação para que a nova tentativa recomece do início
+        repositorio.remover(registro["id_resposta"])
+        raise
+    obter_agregados().registrar(registro)
+
+
+@st.cache_resource
+def obter_indice_submissoes():
+    # Submissões recentes por chave (sessão + conteúdo): um reenvio reaproveita o registro já salvo
+    return IndiceSubmissoes(
+        obter_estado_compartilhado() or BackendSQLite(DATA_DIR_REPLICA / "submissoes.db"),
+        ttl_segundos=float(get_config_value("SUBMISSOES_TTL_HORAS") or 24) * 3600,
+    )
+
+
 def salvar_registro_google_sheets(registro: dict):
+    # Grava no diário local e retorna; a planilha é atualizada em lote pela fila
     try:
-        aba = conectar_google_sheets()
-        garantir_cabecalho(aba, registro)
-        aba.append_row(list(registro.values()), value_input_option="USER_ENTERED")
+        with metricas.etapa("salvar_registro_google_sheets", id_resposta=registro.get("id_resposta")) as medicao:
+            medicao.bytes = len(json.dumps(registro, ensure_ascii=False, default=str).encode("utf-8"))
+            obter_fila_gravacao().enfileirar(registro)
     except Exception as e:
         raise Exception(f"Erro ao salvar registro no Google Sheets: {e}")
 
@@ -564,243 +642,8 @@ def salvar_registro_google_sheets(registro: dict):
 # -------------------
 # CSS
 # -------------------
-st.markdown(
-    """
-<style>
-[data-testid="stSidebar"] { display: none !important; }
-.block-container { padding-top: 1.2rem !important; max-width: 1200px !important; }
-#MainMenu {visibility: hidden;}
-header {visibility: hidden;}
-footer {visibility: hidden;}
-.stAppDeployButton {display: none !important;}
-button[title="Manage app"] {display: none !important;}
-[data-testid="stStatusWidget"] {display: none !important;}
-button[aria-label="Manage app"],
-div[data-testid="manage-app-button"],
-div[data-testid="ManageAppButton"] { display: none !important; }
-div[data-testid="stSlider"] { margin-bottom: 0.7rem !important; }
-h1, h2, h3 { color: #111; }
-div[data-testid="stAlert"] {
-    background-color: #FFF3C4 !important;
-    border-left: 6px solid #FFC728 !important;
-    border-radius: 8px !important;
-}
-div[data-testid="stAlert"] * { color: #000 !important; }
-
-/* ---- preview de score (antes do e-mail) ---- */
-.preview-banner {
-    background: linear-gradient(135deg, #fffbea 0%, #fff8d6 100%);
-    border: 2px solid #FFC728;
-    border-radius: 14px;
-    padding: 20px 24px;
-    margin: 16px 0;
-    text-align: center;
-}
-.preview-score {
-    font-size: 2.8rem;
-    font-weight: 900;
-    color: #111;
-    line-height: 1.1;
-}
-.preview-nivel {
-    font-size: 1.1rem;
-    color: #555;
-    margin-top: 4px;
-    margin-bottom: 12px;
-}
-.preview-dim-row {
-    display: flex;
-    align-items: center;
-    justify-content: space-between;
-    padding: 7px 0;
-    border-bottom: 1px solid #f0e8c8;
-}
-.preview-dim-row:last-child { border-bottom: none; }
-.preview-dim-name { font-weight: 600; font-size: 0.97rem; }
-.preview-dim-value { font-size: 0.97rem; color: #444; }
-
-/* ---- blur / lock overlay ---- */
-.locked-section {
-    filter: blur(4px);
-    pointer-events: none;
-    user-select: none;
-    opacity: 0.55;
-}
-.unlock-cta {
-    background: #fff;
-    border: 2px solid #FFC728;
-    border-radius: 14px;
-    padding: 20px 24px;
-    margin: 20px 0;
-    text-align: center;
-    box-shadow: 0 4px 18px rgba(255,199,40,0.15);
-}
-.unlock-cta-title {
-    font-size: 1.18rem;
-    font-weight: 800;
-    margin-bottom: 6px;
-}
-.unlock-cta-sub {
-    color: #555;
-    font-size: 0.97rem;
-    margin-bottom: 0;
-}
-
-/* ---- email match indicator ---- */
-.email-match-ok {
-    color: #1a7a3c;
-    font-weight: 700;
-    font-size: 0.92rem;
-    margin-top: -8px;
-    margin-bottom: 8px;
-}
-.email-match-err {
-    color: #c0392b;
-    font-weight: 700;
-    font-size: 0.92rem;
-    margin-top: -8px;
-    margin-bottom: 8px;
-}
-
-.form-card {
-    border: 1px solid #dddddd;
-    border-radius: 10px;
-    padding: 14px;
-    background: #f8f8f8;
-    margin-bottom: 14px;
-}
-.action-box {
-    background: #fff8e1;
-    border: 1px solid #f3d36c;
-    border-radius: 10px;
-    padding: 10px 12px;
-    margin: 8px 0 12px 0;
-}
-.result-card {
-    background: #fff;
-    border: 1px solid #e6e6e6;
-    border-left: 5px solid #FFC728;
-    border-radius: 10px;
-    padding: 10px 12px;
-    margin-bottom: 8px;
-}
-.result-card-title { font-weight: 700; margin-bottom: 3px; }
-.result-card-sub { color: #444; font-size: 0.94rem; }
-.report-wrap {
-    background: #ffffff;
-    border: 1px solid #e8e8e8;
-    border-radius: 14px;
-    padding: 18px;
-    margin: 12px 0 16px 0;
-}
-.report-header {
-    display: flex;
-    align-items: flex-start;
-    justify-content: space-between;
-    gap: 16px;
-    margin-bottom: 10px;
-}
-.report-header-left { flex: 1; min-width: 0; }
-.report-logo { flex: 0 0 auto; display: flex; align-items: center; justify-content: flex-end; }
-.report-logo img { max-height: 42px; width: auto; object-fit: contain; }
-.report-title { font-size: 1.25rem; font-weight: 800; margin-bottom: 2px; }
-.report-subtitle { color: #555; font-size: 0.92rem; margin-bottom: 10px; }
-.publix-band {
-    height: 8px;
-    background: linear-gradient(90deg, #FFC728 0%, #FFB300 100%);
-    border-radius: 999px;
-    margin-bottom: 12px;
-}
-.kpi-grid { display: grid; grid-template-columns: 1fr 1fr; gap: 10px; margin: 10px 0 14px 0; }
-.kpi-card {
-    background: #fff;
-    border: 1px solid #e8e8e8;
-    border-left: 5px solid #FFC728;
-    border-radius: 10px;
-    padding: 10px 12px;
-}
-.kpi-card .label { font-size: 0.82rem; color: #666; margin-bottom: 2px; }
-.kpi-card .value { font-weight: 800; font-size: 1.02rem; color: #111; word-break: break-word; }
-.section-print-title {
-    font-weight: 800;
-    font-size: 1rem;
-    margin: 12px 0 8px 0;
-    padding-bottom: 4px;
-    border-bottom: 1px solid #ececec;
-}
-.dim-card {
-    border: 1px solid #e9e9e9;
-    border-radius: 10px;
-    padding: 10px 12px;
-    margin-bottom: 8px;
-    background: #fff;
-    break-inside: avoid;
-    page-break-inside: avoid;
-}
-.dim-card strong { display: block; margin-bottom: 4px; }
-.muted { color: #666; font-size: 0.9rem; }
-.visual-block {
-    border: 1px solid #e9e9e9;
-    border-radius: 10px;
-    padding: 12px;
-    margin-bottom: 10px;
-    background: #fff;
-    break-inside: avoid;
-    page-break-inside: avoid;
-}
-.visual-title { font-weight: 800; margin-bottom: 8px; }
-.bar-track {
-    width: 100%;
-    height: 12px;
-    background: #f1f1f1;
-    border-radius: 999px;
-    overflow: hidden;
-    margin: 6px 0 4px 0;
-}
-.bar-fill {
-    height: 100%;
-    background: linear-gradient(90deg, #FFC728 0%, #FFB300 100%);
-    border-radius: 999px;
-}
-.bar-legend { font-size: 0.84rem; color: #666; }
-.compare-row { margin-top: 8px; }
-.compare-label { font-size: 0.84rem; font-weight: 700; margin-bottom: 2px; }
-.compare-track { width: 100%; height: 10px; background: #f1f1f1; border-radius: 999px; overflow: hidden; }
-.compare-fill-org { height: 100%; background: #FFC728; border-radius: 999px; }
-.compare-fill-base { height: 100%; background: #cfcfcf; border-radius: 999px; }
-.level-badges { display: flex; gap: 6px; flex-wrap: wrap; margin-top: 8px; }
-.level-badge {
-    font-size: 0.78rem;
-    padding: 4px 8px;
-    border-radius: 999px;
-    border: 1px solid #ddd;
-    background: #fafafa;
-    color: #555;
-}
-.level-badge.active { background: #fff3c4; border-color: #FFC728; color: #111; font-weight: 700; }
-.no-print { display: block; }
-.print-only { display: none; }
-
-@media print {
-    @page { size: A4; margin: 12mm; }
-    html, body { background: #fff !important; }
-    body { -webkit-print-color-adjust: exact !important; print-color-adjust: exact !important; }
-    .print-only { display: block !important; }
-    .block-container { max-width: 100% !important; padding: 0 !important; }
-    h1 { font-size: 18pt !important; margin-bottom: 6px !important; }
-    h2 { font-size: 14pt !important; margin: 10px 0 6px 0 !important; }
-    h3 { font-size: 12pt !important; margin: 8px 0 4px 0 !important; }
-    p, li, div, span { font-size: 10.5pt !important; line-height: 1.35 !important; }
-    .report-wrap, .result-card, .kpi-card, .dim-card, .visual-block {
-        break-inside: avoid !important;
-        page-break-inside: avoid !important;
-    }
-    hr { border: none !important; border-top: 1px solid #dcdcdc !important; margin: 8px 0 !important; }
-}
-</style>
-""",
-    unsafe_allow_html=True,
-)
+# Lida uma vez por processo; com ATIVOS_CSS_EXTERNO=1 (nginx servindo /app/static) vira um <link> versionado
+st.markdown(tag_folha_estilo(), unsafe_allow_html=True)
 
 # -------------------
 # CABEÇALHO
@@ -842,119 +685,156 @@ if not openai_api_key:
 
 openai.api_key = openai_api_key
 
+MODELO_IA = "gpt-4o-mini"
+IA_TENTATIVAS = int(get_config_value("IA_TENTATIVAS") or 3)
+# Reserva de saída feita na admissão; acertada com o consumo real ao fim da chamada
+IA_TOKENS_SAIDA_ESTIMADOS = int(get_config_value("IA_TOKENS_SAIDA_ESTIMADOS") or 800)
+
+
+@st.cache_resource
+def obter_cliente_openai():
+    # Um cliente por processo: o pool HTTP (keep-alive/TLS) é reaproveitado entre sessões.
+    # Sem novas tentativas no SDK: quem repete é executar_com_retentativas, respeitando o limitador
+    return openai.OpenAI(
+        api_key=openai_api_key,
+        timeout=float(get_config_value("OPENAI_TIMEOUT") or 60),
+        max_retries=0,
+    )
+
+
+@st.cache_resource
+def obter_limitador_ia():
+    # Um por processo: todas as sessões disputam os mesmos limites da conta na OpenAI
+    # (entre réplicas também, com ESTADO_COMPARTILHADO_URL)
+    return LimitadorIA(
+        requisicoes_por_minuto=float(get_config_value("IA_REQUISICOES_POR_MINUTO") or 500),
+        tokens_por_minuto=float(get_config_value("IA_TOKENS_POR_MINUTO") or 200000),
+        simultaneas=int(get_config_value("IA_CHAMADAS_SIMULTANEAS") or 16),
+        fila_maxima=int(get_config_value("IA_FILA_MAXIMA") or 64),
+        espera_maxima=float(get_config_value("IA_ESPERA_MAXIMA") or 60),
+        backend=obter_estado_compartilhado(),
+    )
+
 # -------------------
-# QUESTÕES
+# BASE DE COMPARAÇÃO
 # -------------------
-QUESTOES = [
-    {"id": "1.1.1", "texto": "Identificam-se as forças e fraquezas, assim como as oportunidades e ameaças da organização (análise SWOT) como forma de compreender os ambientes internos e externos da organização para formulação/revisão das estratégias.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.1.2", "texto": "Existe elaboração de cenários, ambientes futuros, dos quais situações hipotéticas podem emergir e implicar em redirecionamentos estratégicos.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.1.3", "texto": "Realiza-se a gestão de stakeholders (partes interessadas), que compreende um conjunto de atividades que busca identificar, qualificar, avaliar e melhorar o relacionamento com as diversas partes interessadas, inclusive informações periódicas sobre a opinião e satisfação dos usuários referentes aos serviços oferecidos pela organização.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.1.4", "texto": "Existem analises que buscam compreender o universo de política pública na qual a organização opera, seus princípios, diretrizes, orientações, resultados e disposições programáticas (em planos setoriais, governamentais, plurianuais etc.).", "dimensao": "Agenda Estratégica"},
-    {"id": "1.2.1", "texto": "A organização possui uma definição clara do seu propósito, informando sua razão de ser, seus produtos e os impactos visados aos seus beneficiários.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.2.2", "texto": "A agenda estratégica estabelece uma visão de longo prazo a partir da construção de um ideal transformador do contexto no qual está inserida.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.2.3", "texto": "Existe uma declaração de valores que serve de referência para a retórica (discursos, apresentações etc.) e as práticas organizacionais.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.2.4", "texto": "O propósito da organização é amplamente difundido internamente. Realizam-se campanhas de sensibilização (palestras, workshops etc.) para orientar e motivar os servidores quanto aos propósitos da organização.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.2.5", "texto": "O propósito da organização é sistematicamente divulgado à sociedade. A organização executa estratégias de comunicação às demais partes interessadas (cidadãos, governo, organizações parceiras etc.).", "dimensao": "Agenda Estratégica"},
-    {"id": "1.3.1", "texto": "A programação estratégica (o conjunto de objetivos ou projetos, programas etc.) está alinhada com a visão, representando seu desdobramento.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.3.2", "texto": "A estratégia da organização está explicitada (preferencialmente por meio de um mapa estratégico, roadmap ou outra forma gráfica), expondo as relações de causa e efeito entre seus elementos.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.3.3", "texto": "Há um conjunto minimamente significativo de indicadores e metas de eficiência (relação entre os produtos/serviços gerados com os insumos empregados), eficácia (quantidade e qualidade de produtos/serviços entregues ao usuário) e efetividade (impactos gerados pelos produtos/serviços, processos ou projetos) que buscam mensurar os elementos programáticos da estratégia (objetivos, projetos etc.).", "dimensao": "Agenda Estratégica"},
-    {"id": "1.3.4", "texto": "Há um razoável grau de realismo e desafio das metas, tendo em conta a escala dos problemas e demandas das partes interessadas e a disponibilidade de recursos (materiais, humanos, financeiros etc.)", "dimensao": "Agenda Estratégica"},
-    {"id": "1.4.1", "texto": "Há um conjunto minimamente significativo de iniciativas estratégicas definidas para proporcionar o alcance das metas fixadas.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.4.2", "texto": "As iniciativas estratégicas são detalhadas em ações com prazos, responsáveis e marcos críticos.", "dimensao": "Agenda Estratégica"},
-    {"id": "1.4.3", "texto": "Há um razoável equilíbrio nos níveis de detalhamento das iniciativas em termos de abrangência (cobrindo todas as metas). ", "dimensao": "Agenda Estratégica"},
-    {"id": "1.4.4", "texto": "Há um razoável equilíbrio nos níveis de detalhamento das iniciativas em termos de profundidade (sem sub ou super-especificação).", "dimensao": "Agenda Estratégica"},
-]
+def fotografias_agregados() -> list:
+    # Uma fotografia por base de respostas: "local" para DATA_DIR/respostas.db e o REPLICA_ID para
+    # DATA_DIR/replicas/<id>. Nomes sem base correspondente (hostnames de contêineres antigos) não
+    # somam: seriam as mesmas respostas contadas de novo
+    fotografias = []
+    for caminho in (DATA_DIR / "agregados").glob("agregados-*.json"):
+        nome = caminho.stem[len("agregados-"):]
+        base = DATA_DIR / "respostas.db" if nome == "local" else DATA_DIR / "replicas" / nome
+        if base.exists():
+            fotografias.append(caminho)
+    return fotografias
 
-observatorio_means = {"Agenda Estratégica": 1.92}
 
-BASE_SINTETICA = """
-Base nacional do Observatório de Maturidade – resumo sintético
+@st.cache_resource
+def obter_agregados():
+    # Estatísticas por segmento atualizadas a cada envio; cada réplica fotografa as suas em DATA_DIR/agregados,
+    # com o nome da sua base de respostas (estável entre reinícios, ao contrário do hostname)
+    replica = REPLICA_ID or "local"
+    # Alvos de todos os instrumentos do catálogo: respostas de versões diferentes convivem na mesma base
+    instrumentos = list(catalogo_instrumentos())
+    agregados = AgregadosIncrementais(
+        DATA_DIR / "agregados" / f"agregados-{replica}.json",
+        colunas_dimensao={dim: coluna_dimensao(dim) for i in instrumentos for dim in i.dimensoes},
+        questoes=list(dict.fromkeys(qid for i in instrumentos for qid in i.ids)),
+        secoes={sec: list(qids) for i in instrumentos for sec, qids in i.questoes_por_secao.items()},
+        intervalo_fotografia=float(get_config_value("AGREGADOS_INTERVALO_FOTOGRAFIA") or 30),
+    )
+    repositorio = obter_repositorio_respostas()
+    # Fotografia ausente ou atrasada em relação à base local (queda entre fotografias): uma varredura completa
+    if not agregados.carregar() or agregados.total() != repositorio.contar():
+        agregados.reconstruir(repositorio.iterar(tamanho_lote=1000))
+        agregados.fotografar()
+    agregados.iniciar()
+    atexit.register(agregados.parar)
+    return agregados
 
-1. Perfil da base
-- 259 respondentes, provenientes de 153 organizações.
-- Esferas: 54,8% Federal; 31,6% Estadual; 8,1% Municipal; restante entre privado, 3º setor e organismos internacionais.
-- Poderes: Executivo (144), Legislativo (36), Judiciário (29), Empresas Públicas (24), Privado (11).
 
-2. Maturidade geral
-- Média nacional de maturidade: 1,64 (escala 0 a 3).
+@st.cache_resource
+def obter_motor_base():
+    # Definição versionada da base; os agregados das respostas completam segmentos sem média publicada
+    agregados = obter_agregados()
+    motor = MotorBase(
+        Path(get_config_value("BASE_OBSERVATORIO_ARQUIVO") or "observatorio_base.json"),
+        fonte_segmentos=lambda: combinar_fotografias(agregados, fotografias_agregados()),
+        intervalo=float(get_config_value("BASE_ATUALIZACAO_MINUTOS") or 1) * 60,
+        minimo_respostas=int(get_config_value("BASE_MINIMO_RESPOSTAS") or 30),
+    )
+    motor.iniciar()
+    atexit.register(motor.parar)
+    return motor
 
-3. Médias por dimensão
-- Agenda Estratégica: 1,92
-"""
 
-BASE_MEDIA_POR_PODER = {
-    "organismo internacional": 1.93,
-    "empresa pública": 1.87,
-    "privado": 1.82,
-    "legislativo": 1.73,
-    "executivo": 1.57,
-    "judiciário": 1.57,
-    "ministerio público": 1.57,
-    "ministério público": 1.57,
-}
+def base_observatorio():
+    return obter_motor_base().tabela
 
-BASE_MEDIA_POR_ESFERA = {
-    "federal": 1.76,
-    "estadual": 1.41,
-    "municipal": 1.35,
-    "privado": 1.81,
-    "organismo internacional": 1.93,
-}
 
-PART_TITLES = {"1": "Agenda Estratégica"}
-SECTION_TITLES = {
-    "1.1": "Compreensão do Ambiente Institucional",
-    "1.2": "Estabelecimento do Propósito",
-    "1.3": "Definição de Resultados",
-    "1.4": "Iniciativas Estratégicas",
-}
+# -------------------
+# INSTRUMENTOS
+# -------------------
+def catalogo_instrumentos():
+    # Compilado uma vez por processo; sem st.*, pode ser usado nas threads de segundo plano
+    return carregar_catalogo(
+        Path(get_config_value("INSTRUMENTOS_DIR") or DIRETORIO_INSTRUMENTOS),
+        get_config_value("INSTRUMENTO_PADRAO"),
+    )
+
+
+def instrumento_atual():
+    return catalogo_instrumentos().obter(st.session_state.get("versao_instrumento"))
 
 
 # -------------------
 # FUNÇÕES AUXILIARES
 # -------------------
-def extrair_partes(qid: str):
-    partes = str(qid).split(".")
-    part = partes[0] if len(partes) >= 1 else None
-    sec = ".".join(partes[:2]) if len(partes) >= 2 else None
-    return part, sec
+def pontuar_respostas(respostas: dict, instrumento=None):
+    """Notas por seção, dimensão e geral numa única passada do motor de pontuação."""
+    return (instrumento or instrumento_atual()).pontuar(respostas)
 
 
-def _normalizar_label(texto: str):
-    if not texto:
+def posicao_na_base(poder, esfera, uf, respostas: dict, pontuacao, instrumento=None):
+    """Percentis da organização no grupo de pares mais específico com respostas suficientes (ou None)."""
+    titulos_secoes = (instrumento or instrumento_atual()).titulos_secoes
+    distribuicoes = base_observatorio().distribuicoes
+    encontrado = distribuicoes.segmento(poder, esfera, uf)
+    if encontrado is None or not respostas:
+        return None
+    (p, e, u), n = encontrado
+
+    medias_dim = pontuacao.dimensoes
+    notas_secoes = pontuacao.secoes
+    valores = {GERAL: pontuacao.geral, **medias_dim}
+    valores.update({alvo_secao(sec): nota for sec, nota in notas_secoes.items()})
+    valores.update({alvo_questao(qid): nota for qid, nota in respostas.items()})
+    percentis = distribuicoes.percentis(valores, poder, esfera, uf)
+    if GERAL not in percentis:
         return None
-    t = texto.strip().lower()
-    substituicoes = {
-        "poder executivo": "executivo",
-        "poder legislativo": "legislativo",
-        "poder judiciário": "judiciário",
-        "judiciario": "judiciário",
-        "org. internacional": "organismo internacional",
-        "organismo int.": "organismo internacional",
-        "organismo internacional e terceiro setor": "organismo internacional",
-        "terceiro setor": "privado",
-    }
-    return substituicoes.get(t, t)
-
-
-def calcular_medias_por_dimensao(respostas_dict):
-    df = pd.DataFrame(QUESTOES)
-    df["dim_key"] = df["dimensao"].astype(str).str.strip().str.rstrip(",")
-    df["nota"] = df["id"].map(respostas_dict)
-    return df.groupby("dim_key")["nota"].mean().round(2).to_dict()
-
 
-def classificar_nivel(media_geral: float):
-    if media_geral < 1.0:
-        return "Inexistente / muito incipiente"
-    elif media_geral < 2.0:
-        return "Em estruturação"
-    elif media_geral < 2.6:
-        return "Parcialmente estruturado"
-    return "Bem estruturado"
+    return {
+        "segmento": " · ".join(x for x in (p, e, u) if x) or "Base nacional",
+        "n": n,
+        "geral": percentis[GERAL],
+        "dimensoes": {dim: percentis[dim] for dim in medias_dim if dim in percentis},
+        "secoes": [
+            [f"{sec} {titulos_secoes.get(sec, '')}".strip(), nota, percentis[alvo_secao(sec)]]
+            for sec, nota in notas_secoes.items() if alvo_secao(sec) in percentis
+        ],
+        "questoes": [
+            [qid, nota, percentis[alvo_questao(qid)]]
+            for qid, nota in respostas.items() if alvo_questao(qid) in percentis
+        ],
+    }
 
 
-def montar_perfil_texto(instituicao, poder, esfera, estado, respostas_dict, medias_dimensao):
+@metricas.medir("montar_perfil_texto", tamanho=lambda texto: len(texto.encode("utf-8")))
+def montar_perfil_texto(instituicao, poder, esfera, estado, respostas_dict, medias_dimensao, incluir_textos=True,
+                        posicao=None, instrumento=None):
+    instrumento = instrumento or instrumento_atual()
     linhas = []
     linhas.append(f"Instituição avaliada: {instituicao or 'Não informada'}")
     linhas.append(f"Poder: {poder or 'Não informado'}")
@@ -962,22 +842,23 @@ def montar_perfil_texto(instituicao, poder, esfera, estado, respostas_dict, medi
     linhas.append(f"Estado: {estado or 'Não informado'}")
     linhas.append("")
 
-    poder_norm = _normalizar_label(poder)
-    esfera_norm = _normalizar_label(esfera)
-
-    media_poder_base = BASE_MEDIA_POR_PODER.get(poder_norm) if poder_norm else None
-    media_esfera_base = BASE_MEDIA_POR_ESFERA.get(esfera_norm) if esfera_norm else None
+    base = base_observatorio()
+    media_poder_base = base.media(poder=poder) if normalizar_segmento(poder) else None
+    media_esfera_base = base.media(esfera=esfera) if normalizar_segmento(esfera) else None
 
     if media_poder_base is not None:
         linhas.append(f"No Observatório de Maturidade, a média geral de maturidade para o poder '{poder}' é {media_poder_base:.2f}.")
     if media_esfera_base is not None:
         linhas.append(f"Na esfera '{esfera}', a média geral de maturidade observada na base é {media_esfera_base:.2f}.")
-    if media_poder_base is not None or media_esfera_base is not None:
+    media_segmento = base.media(poder=poder, esfera=esfera, uf=estado) if normalizar_segmento(poder) and normalizar_segmento(esfera) and estado else None
+    if media_segmento is not None:
+        linhas.append(f"Entre as organizações do mesmo poder, esfera e estado ({estado}), a média geral é {media_segmento:.2f}.")
+    if media_poder_base is not None or media_esfera_base is not None or media_segmento is not None:
         linhas.append("")
 
     linhas.append("Resumo das notas por dimensão (escala 0 a 3):")
     for dim, media_orgao in medias_dimensao.items():
-        media_base = observatorio_means.get(dim)
+        media_base = base.media(dim)
         if media_base is not None and not pd.isna(media_base):
             diff = round(media_orgao - media_base, 2)
             if diff > 0.1:
@@ -988,17 +869,78 @@ def montar_perfil_texto(instituicao, poder, esfera, estado, respostas_dict, medi
                 situacao = "próximo da média da base"
             linhas.append(f"- {dim}: {media_orgao:.2f} (média da base: {media_base:.2f}; situação: {situacao}, diferença: {diff:+.2f})")
 
+    if posicao:
+        linhas.append("")
+        linhas.append(f"Posição entre pares ({posicao['segmento']}, {posicao['n']} respostas), em percentis (0 a 100):")
+        linhas.append(f"- Score geral: percentil {posicao['geral']}")
+        for dim, percentil in posicao["dimensoes"].items():
+            linhas.append(f"- {dim}: percentil {percentil}")
+        for item, _, percentil in posicao["secoes"]:
+            linhas.append(f"- Seção {item}: percentil {percentil}")
+
+    percentis_questoes = {qid: percentil for qid, _, percentil in (posicao or {}).get("questoes", [])}
     linhas.append("")
     linhas.append("Notas detalhadas por questão:")
-    for q in QUESTOES:
+    for q in instrumento.questoes:
         nota = respostas_dict.get(q["id"])
-        linhas.append(f"- {q['id']} | {q['texto']} -> nota {nota}")
+        percentil = f", percentil {percentis_questoes[q['id']]}" if q["id"] in percentis_questoes else ""
+        if incluir_textos:
+            linhas.append(f"- {q['id']} | {q['texto']} -> nota {nota}{percentil}")
+        else:
+            # Versão compacta para a IA: o texto integral entra só quando a questão é citada
+            linhas.append(f"- {q['id']} ({instrumento.titulos_secoes.get(q['secao'], '')}) -> nota {nota}{percentil}")
 
     return "\n".join(linhas)
 
 
-def chamar_ia(perfil_texto, chat_history):
-    system_prompt = """
+def questoes_referenciadas(pergunta: str, respostas_dict: dict, maximo_padrao: int = 4, instrumento=None):
+    """IDs de questões citadas na pergunta (por ID, seção ou título da seção).
+
+    Sem citação explícita, devolve as questões de nota mais baixa, que são o
+    assunto padrão das perguntas sobre lacunas.
+    """
+    instrumento = instrumento or instrumento_atual()
+    ids_validos = instrumento.ids
+    texto = (pergunta or "").lower()
+    ids = [qid for qid in re.findall(r"\b\d+\.\d+\.\d+\b", texto) if qid in instrumento.indice]
+
+    # Sem dígito ou ponto colado dos dois lados: em "1.1.4", nem "1.1" nem "1.4" são seções citadas
+    secoes = set(re.findall(r"(?<![\w.])(\d+\.\d+)(?![\d.]*\d)", texto))
+    secoes |= {sec for sec, titulo in instrumento.titulos_secoes.items() if titulo.lower() in texto}
+    for qid in ids_validos:
+        if instrumento.secao_de[qid] in secoes and qid not in ids:
+            ids.append(qid)
+
+    if not ids and respostas_dict:
+        baixas = sorted(
+            (qid for qid in ids_validos if respostas_dict.get(qid) is not None and respostas_dict[qid] <= 1),
+            key=lambda qid: respostas_dict[qid],
+        )
+        ids = baixas[:maximo_padrao]
+    return ids
+
+
+def textos_questoes(ids: list, respostas_dict: dict, instrumento=None) -> str:
+    instrumento = instrumento or instrumento_atual()
+    return "\n".join(
+        f"- {qid} | {instrumento.questao(qid)['texto']} -> nota {respostas_dict.get(qid)}"
+        for qid in ids if qid in instrumento.indice
+    )
+
+
+def criar_contexto_ia():
+    limite_tokens = get_config_value("IA_LIMITE_TOKENS_SESSAO")
+    limite_custo = get_config_value("IA_LIMITE_CUSTO_SESSAO_USD")
+    return GerenciadorContexto(
+        orcamento_tokens=int(get_config_value("IA_ORCAMENTO_TOKENS") or 6000),
+        preco_entrada_1m=float(get_config_value("IA_PRECO_ENTRADA_1M") or 0.15),
+        preco_saida_1m=float(get_config_value("IA_PRECO_SAIDA_1M") or 0.60),
+        limite_tokens=int(limite_tokens) if limite_tokens else None,
+        limite_custo_usd=float(limite_custo) if limite_custo else None,
+    )
+
+
+SYSTEM_PROMPT_IA = """
 Você é o Radar Publix, assistente de IA especializado em gestão pública e maturidade institucional.
 Sua função é analisar o diagnóstico de um órgão e compará-lo com a base nacional do Observatório,
 indicando pontos fortes, fragilidades e caminhos práticos de evolução.
@@ -1009,37 +951,386 @@ Regras:
 - Use linguagem clara e profissional.
 - Quando possível, organize em tópicos curtos.
 """
+
+
+def montar_mensagens_ia(perfil_texto, chat_history, contexto=None, respostas_dict=None, resumir=None, base=None):
+    base = base or base_observatorio()
     messages = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": SYSTEM_PROMPT_IA},
         {"role": "system", "content": "Principais achados da base nacional do Observatório de Maturidade:"},
-        {"role": "system", "content": BASE_SINTETICA},
+        {"role": "system", "content": base.texto_sintetico()},
         {"role": "system", "content": "Diagnóstico estruturado da organização do usuário:"},
         {"role": "system", "content": perfil_texto},
     ]
-    messages.extend(chat_history)
-
-    try:
-        client_oai = openai.OpenAI(api_key=openai_api_key)
-        response = client_oai.chat.completions.create(
-            model="gpt-4o-mini",
+    if contexto is None:
+        messages.extend(chat_history)
+        return messages
+
+    if respostas_dict:
+        ultima_pergunta = next((m["content"] for m in reversed(chat_history) if m["role"] == "user"), "")
+        ids = questoes_referenciadas(ultima_pergunta, respostas_dict)
+        if ids:
+            messages.append({
+                "role": "system",
+                "content": "Texto integral das questões relevantes para a pergunta atual:\n" + textos_questoes(ids, respostas_dict),
+            })
+    return contexto.montar_mensagens(messages, chat_history, resumir=resumir)
+
+
+def resumir_conversa_ia(resumo_atual: str, mensagens: list, contexto=None) -> str:
+    conversa = "\n".join(
+        f"{'Usuário' if m['role'] == 'user' else 'IA'}: {m['content']}" for m in mensagens
+    )
+    messages = [
+        {"role": "system", "content": (
+            "Atualize o resumo de uma conversa sobre o diagnóstico de maturidade de um órgão público. "
+            "Preserve perguntas feitas, recomendações dadas e decisões. Responda só com o resumo, em até 150 palavras."
+        )},
+        {"role": "user", "content": f"Resumo atual:\n{resumo_atual or '(vazio)'}\n\nNovos trechos:\n{conversa}"},
+    ]
+    limitador = obter_limitador_ia()
+    cliente = obter_cliente_openai()
+    with limitador.adquirir(contar_tokens_mensagens(messages) + 300) as permissao:
+        response = executar_com_retentativas(
+            lambda: cliente.chat.completions.create(model=MODELO_IA, messages=messages, temperature=0, max_tokens=300),
+            limitador,
+            tentativas=IA_TENTATIVAS,
+            permissao=permissao,
+        )
+        if response.usage is not None:
+            permissao.registrar_uso(response.usage.total_tokens)
+    if contexto is not None and response.usage is not None:
+        contexto.registrar_uso(response.usage.prompt_tokens, response.usage.completion_tokens)
+    return response.choices[0].message.content
+
+
+def _gerar_stream_ia(messages, contexto=None, cliente=None, limitador=None, ao_esperar=None):
+    """Chamada de streaming à API; exceções (inclusive LimiteIAExcedido) sobem para quem chamou."""
+    # Threads de fundo recebem cliente e limitador prontos, resolvidos na thread do script
+    cliente = cliente or obter_cliente_openai()
+    limitador = limitador or obter_limitador_ia()
+    reserva = contar_tokens_mensagens(messages) + IA_TOKENS_SAIDA_ESTIMADOS
+    # A vaga fica ocupada até o fim do streaming (ou até quem consome o gerador desistir dele)
+    with limitador.adquirir(reserva, ao_esperar=ao_esperar) as permissao:
+        yield from _consumir_stream_ia(messages, contexto, cliente, limitador, permissao)
+
+
+def _consumir_stream_ia(messages, contexto, cliente, limitador, permissao):
+    inicio = time.perf_counter()
+    primeiro_token = None
+    partes = []
+    usage = None
+    stream = executar_com_retentativas(
+        lambda: cliente.chat.completions.create(
+            model=MODELO_IA,
             messages=messages,
             temperature=0.3,
-        )
-        return response.choices[0].message.content
+            stream=True,
+            stream_options={"include_usage": True},
+        ),
+        limitador,
+        tentativas=IA_TENTATIVAS,
+        permissao=permissao,
+    )
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        texto = chunk.choices[0].delta.content
+        if not texto:
+            continue
+        if primeiro_token is None:
+            primeiro_token = time.perf_counter() - inicio
+            metricas.observar("ia_tempo_primeiro_token_segundos", primeiro_token)
+        partes.append(texto)
+        yield texto
+
+    total = time.perf_counter() - inicio
+    metricas.observar("ia_latencia_total_segundos", total)
+    if usage is not None:
+        tokens_entrada, tokens_saida = usage.prompt_tokens, usage.completion_tokens
+    else:
+        tokens_entrada, tokens_saida = contar_tokens_mensagens(messages), contar_tokens("".join(partes))
+    metricas.observar("ia_tokens_entrada", tokens_entrada)
+    metricas.observar("ia_tokens_saida", tokens_saida)
+    permissao.registrar_uso(tokens_entrada + tokens_saida)
+    if contexto is not None:
+        custo_antes = contexto.custo_usd
+        contexto.registrar_uso(tokens_entrada, tokens_saida)
+        metricas.incrementar("ia_custo_usd_total", contexto.custo_usd - custo_antes)
+        logger.info("Consumo da IA na sessão: %s", contexto.consumo())
+    logger.info(
+        "Resposta da IA: primeiro token em %.3fs, total %.3fs, tokens %d/%d",
+        primeiro_token or total, total, tokens_entrada, tokens_saida,
+    )
+
+
+MENSAGEM_ERRO_IA = "Tive um problema técnico para gerar a resposta agora. Tente novamente em instantes."
+MENSAGEM_LIMITE_IA = "Você atingiu o limite de uso da IA nesta sessão. Para continuar a conversa, fale com a equipe do Instituto Publix."
+MENSAGEM_IA_OCUPADA = "Muitas pessoas estão usando a IA agora e não consegui uma vaga a tempo. Tente novamente em alguns instantes."
+
+
+def aviso_fila_ia():
+    """Espaço para o aviso de fila e o callback que o atualiza enquanto a chamada espera vaga."""
+    aviso = st.empty()
+
+    def ao_esperar(posicao, espera):
+        estimativa = f" (cerca de {max(1, round(espera))} s)" if espera else ""
+        aviso.info(f"Muitas pessoas estão usando a IA agora — você é o nº {posicao} na fila{estimativa}. Aguarde...")
+
+    return aviso, ao_esperar
+
+
+def chamar_ia_stream(perfil_texto, chat_history, contexto=None, respostas_dict=None):
+    """Gera a resposta da IA em pedaços, à medida que os tokens chegam."""
+    if contexto is not None and contexto.excedeu_limite():
+        yield MENSAGEM_LIMITE_IA
+        return
+    aviso, ao_esperar = aviso_fila_ia()
+    with metricas.etapa("chamar_ia", origem="chat") as medicao:
+        medicao.bytes = 0
+        try:
+            messages = montar_mensagens_ia(
+                perfil_texto,
+                chat_history,
+                contexto=contexto,
+                respostas_dict=respostas_dict,
+                resumir=lambda resumo, msgs: resumir_conversa_ia(resumo, msgs, contexto),
+            )
+            for texto in _gerar_stream_ia(messages, contexto, ao_esperar=ao_esperar):
+                if not medicao.bytes:
+                    aviso.empty()
+                medicao.bytes += len(texto.encode("utf-8"))
+                yield texto
+        except LimiteIAExcedido as e:
+            medicao.falhar(e)
+            aviso.empty()
+            yield MENSAGEM_IA_OCUPADA
+        except Exception as e:
+            medicao.falhar(e)
+            aviso.empty()
+            metricas.incrementar("ia_erros_total")
+            st.error(f"Erro ao chamar a API de IA: {e}")
+            yield MENSAGEM_ERRO_IA
+
+
+def chamar_ia(perfil_texto, chat_history, contexto=None, respostas_dict=None):
+    return "".join(chamar_ia_stream(perfil_texto, chat_history, contexto=contexto, respostas_dict=respostas_dict))
+
+
+# -------------------
+# CACHE DE RESPOSTAS DA IA
+# -------------------
+def obter_cache_respostas_ia():
+    # IA_CACHE_VERSAO permite invalidar manualmente; prompt, base e modelo já entram na versão.
+    # Da base entra só o que o prompt usa (o resumo arredondado): base.versao resume também os n
+    # de cada segmento e mudaria a cada envio, apagando o cache em disco a todo momento
+    base = base_observatorio()
+    versao = versao_cache(SYSTEM_PROMPT_IA, base.versao_definicao, base.texto_sintetico(), MODELO_IA,
+                          get_config_value("IA_CACHE_VERSAO") or "")
+    return _cache_respostas_ia(versao)
+
+
+@st.cache_resource
+def obter_backend_cache_ia():
+    # IA_CACHE_URL: um Redis só para o cache, com despejo (allkeys-lru). O do estado compartilhado usa
+    # noeviction para não perder fila nem índice de idempotência, e lá o cache só sairia pelo TTL
+    return criar_backend(get_config_value("IA_CACHE_URL"))
+
+
+@st.cache_resource(max_entries=2)
+def _cache_respostas_ia(versao: str):
+    ttl_segundos = float(get_config_value("IA_CACHE_TTL_HORAS") or 168) * 3600
+    compartilhado = obter_backend_cache_ia() or obter_estado_compartilhado()
+    if compartilhado is not None:
+        return CacheRespostasCompartilhado(compartilhado, versao, ttl_segundos=ttl_segundos)
+    return CacheRespostasIA(
+        DATA_DIR_REPLICA / "cache_respostas_ia.db",
+        versao,
+        max_itens=int(get_config_value("IA_CACHE_MAX_ITENS") or 5000),
+        ttl_segundos=ttl_segundos,
+    )
+
+
+def _arredondar_quarto(valor: float) -> float:
+    return round(round(float(valor) * 4) / 4, 2)
+
+
+def impressao_perfil_ia(poder, esfera, respostas_dict: dict, medias_dimensao: dict, instrumento=None) -> dict:
+    """Perfil canônico usado como chave do cache: instrumento, segmento e médias arredondadas a 0,25."""
+    instrumento = instrumento or instrumento_atual()
+    notas_por_secao = {}
+    for qid, nota in (respostas_dict or {}).items():
+        sec = instrumento.secao_de.get(qid)
+        if sec is not None:
+            notas_por_secao.setdefault(sec, []).append(nota)
+    return {
+        "versao": instrumento.versao,
+        "poder": normalizar_segmento(poder) or "",
+        "esfera": normalizar_segmento(esfera) or "",
+        "dimensoes": {dim: _arredondar_quarto(v) for dim, v in sorted((medias_dimensao or {}).items())},
+        "secoes": {sec: _arredondar_quarto(sum(n) / len(n)) for sec, n in sorted(notas_por_secao.items())},
+    }
+
+
+def texto_impressao_perfil(impressao: dict, base=None) -> str:
+    # A resposta cacheada é gerada só com o que está na chave, para valer para todo o grupo
+    linhas = [
+        f"Poder: {impressao['poder'] or 'Não informado'}",
+        f"Esfera: {impressao['esfera'] or 'Não informada'}",
+        "",
+        "Médias por dimensão (escala 0 a 3, arredondadas a 0,25):",
+    ]
+    medias_base = (base or base_observatorio()).medias_dimensao()
+    for dim, media in impressao["dimensoes"].items():
+        base = medias_base.get(dim)
+        extra = f" (média da base: {base:.2f})" if base is not None else ""
+        linhas.append(f"- {dim}: {media:.2f}{extra}")
+    linhas.append("")
+    linhas.append("Médias por seção (arredondadas a 0,25):")
+    titulos_secoes = catalogo_instrumentos().obter(impressao.get("versao")).titulos_secoes
+    for sec, media in impressao["secoes"].items():
+        linhas.append(f"- {sec} {titulos_secoes.get(sec, '')}: {media:.2f}")
+    return "\n".join(linhas)
+
+
+def responder_ia_stream(perfil_texto, chat_history, contexto=None, respostas_dict=None, impressao_perfil=None):
+    """Resposta do copiloto, servindo a primeira pergunta do cache quando possível."""
+    primeira_pergunta = len(chat_history) == 1 and chat_history[0]["role"] == "user"
+    if impressao_perfil is None or not primeira_pergunta:
+        yield from chamar_ia_stream(perfil_texto, chat_history, contexto=contexto, respostas_dict=respostas_dict)
+        return
+    if contexto is not None and contexto.excedeu_limite():
+        yield MENSAGEM_LIMITE_IA
+        return
+
+    try:
+        cache = obter_cache_respostas_ia()
+        chave = cache.chave(chat_history[0]["content"], impressao_perfil)
+        resposta = cache.obter(chave)
     except Exception as e:
+        logger.warning("Cache de respostas da IA indisponível: %s", e)
+        cache, resposta = None, None
+    if resposta:
+        yield resposta
+        return
+
+    partes = []
+    aviso, ao_esperar = aviso_fila_ia()
+    try:
+        messages = montar_mensagens_ia(texto_impressao_perfil(impressao_perfil), chat_history, contexto=contexto)
+        for texto in _gerar_stream_ia(messages, contexto, ao_esperar=ao_esperar):
+            if not partes:
+                aviso.empty()
+            partes.append(texto)
+            yield texto
+    except LimiteIAExcedido:
+        aviso.empty()
+        yield MENSAGEM_IA_OCUPADA
+        return
+    except Exception as e:
+        aviso.empty()
+        metricas.incrementar("ia_erros_total")
         st.error(f"Erro ao chamar a API de IA: {e}")
-        return "Tive um problema técnico para gerar a resposta agora. Tente novamente em instantes."
+        yield MENSAGEM_ERRO_IA
+        return
+    if cache is not None and partes:
+        cache.guardar(chave, "".join(partes))
+
+
+# -------------------
+# ANÁLISE INICIAL ANTECIPADA
+# -------------------
+PERGUNTA_ANALISE_INICIAL = (
+    "Faça uma análise inicial do diagnóstico da minha organização: pontos fortes, "
+    "principais fragilidades em relação à base nacional e prioridades de evolução."
+)
+
+
+@st.cache_resource
+def obter_executor_analises():
+    executor = ExecutorAntecipado(
+        trabalhadores=int(get_config_value("IA_ANALISES_SIMULTANEAS") or 4),
+        pendentes_maximos=int(get_config_value("IA_ANALISES_FILA") or 16),
+    )
+    atexit.register(executor.encerrar)
+    return executor
+
+
+def gerar_analise_inicial(impressao_perfil: dict, contexto, cliente, limitador, cache, base, cancelado):
+    """Roda fora da thread do script: não usa st.* nem recursos em cache do Streamlit."""
+    chave = cache.chave(PERGUNTA_ANALISE_INICIAL, impressao_perfil) if cache is not None else None
+    if chave is not None:
+        resposta = cache.obter(chave)
+        if resposta:
+            return resposta
+
+    messages = montar_mensagens_ia(
+        texto_impressao_perfil(impressao_perfil, base),
+        [{"role": "user", "content": PERGUNTA_ANALISE_INICIAL}],
+        contexto=contexto,
+        base=base,
+    )
+    partes = []
+    with metricas.etapa("chamar_ia", origem="antecipada") as medicao:
+        for texto in _gerar_stream_ia(messages, contexto, cliente=cliente, limitador=limitador):
+            if cancelado.is_set():
+                return None
+            partes.append(texto)
+        resposta = "".join(partes)
+        medicao.bytes = len(resposta.encode("utf-8"))
+    if chave is not None and resposta:
+        cache.guardar(chave, resposta)
+    return resposta
+
+
+def agendar_analise_inicial(impressao_perfil: dict, contexto):
+    if contexto is not None and contexto.excedeu_limite():
+        return None
+    try:
+        cache = obter_cache_respostas_ia()
+    except Exception as e:
+        logger.warning("Cache de respostas da IA indisponível: %s", e)
+        cache = None
+    try:
+        # Contexto copiado: as métricas da thread de fundo levam o id_resposta desta sessão
+        return obter_executor_analises().agendar(
+            contextvars.copy_context().run,
+            gerar_analise_inicial, impressao_perfil, contexto, obter_cliente_openai(), obter_limitador_ia(), cache,
+            base_observatorio(),
+        )
+    except Exception as e:
+        logger.warning("Não foi possível agendar a análise inicial: %s", e)
+        return None
 
 
-def montar_registro_para_salvar(dados_institucionais: dict, dados_pessoais: dict, respostas: dict, medias_dim: dict):
-    media_geral = round(sum(respostas.values()) / len(respostas), 2) if respostas else None
+def incorporar_analise_inicial(timeout: float = None):
+    """Leva a análise concluída para o chat; devolve o texto incorporado (ou None)."""
+    tarefa = st.session_state.analise_inicial_ia
+    if tarefa is None:
+        return None
+    texto = tarefa.resultado(timeout=timeout)
+    if texto is None:
+        tarefa.cancelar()
+    st.session_state.analise_inicial_ia = None
+    if not texto:
+        return None
+    st.session_state.chat_history.append({"role": "assistant", "content": texto})
+    return texto
+
+
+def montar_registro_para_salvar(dados_institucionais: dict, dados_pessoais: dict, respostas: dict, pontuacao,
+                                instrumento=None):
+    instrumento = instrumento or instrumento_atual()
+    media_geral = pontuacao.geral
     nivel = classificar_nivel(media_geral) if media_geral is not None else None
 
     registro = {
         "id_resposta": str(uuid.uuid4()),
         "data_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "versao_instrumento": "agenda_estrategica_v1",
-        "modulo": "Agenda Estratégica",
+        "versao_instrumento": instrumento.versao,
+        "modulo": instrumento.modulo,
         "instituicao": dados_institucionais.get("instituicao", ""),
         "poder": dados_institucionais.get("poder", ""),
         "esfera": dados_institucionais.get("esfera", ""),
@@ -1054,23 +1345,11 @@ def montar_registro_para_salvar(dados_institucionais: dict, dados_pessoais: dict
         "nivel_maturidade": nivel,
     }
 
-    for dim, valor in medias_dim.items():
-        col = (
-            "score_dim_"
-            + dim.lower()
-            .replace(" ", "_")
-            .replace("ã", "a")
-            .replace("á", "a")
-            .replace("é", "e")
-            .replace("í", "i")
-            .replace("ó", "o")
-            .replace("ú", "u")
-            .replace("ç", "c")
-        )
-        registro[col] = round(float(valor), 2)
+    for dim, valor in pontuacao.dimensoes.items():
+        registro[coluna_dimensao(dim)] = round(float(valor), 2)
 
     for qid, nota in respostas.items():
-        registro[f"q_{qid.replace('.', '_')}"] = nota
+        registro[coluna_questao(qid)] = nota
 
     return registro
 
@@ -1080,11 +1359,20 @@ def montar_registro_para_salvar(dados_institucionais: dict, dados_pessoais: dict
 # -------------------
 defaults = {
     "diagnostico_respostas": None,
+    "posicao_base": None,
     "diagnostico_perfil_texto": None,
     "chat_history": [],
-    "respostas_dict": {q["id"]: 1 for q in QUESTOES},
+    "contexto_ia": None,
+    "impressao_perfil_ia": None,
+    "analise_inicial_ia": None,
+    # (id_resposta, Future) do PDF do botão de download, enquanto não está no cache
+    "preparo_pdf": None,
+    "versao_instrumento": catalogo_instrumentos().padrao,
+    "respostas_dict": None,
     "pagina_quest": 1,
+    "rolar_questionario": False,
     "medias_dimensao": None,
+    "pontuacao": None,
     "diagnostico_gerado": False,
     "respondente_salvo": False,
     "registro_salvo": None,
@@ -1095,10 +1383,22 @@ defaults = {
     "email_verificado": False,
     "email_confirmacao_erro": False,
     "email_erro_msg": None,
+    # Identifica a sessão na chave de idempotência do envio
+    "id_sessao": None,
 }
 for k, v in defaults.items():
     if k not in st.session_state:
         st.session_state[k] = v
+# Métricas por etapa e logs estruturados desta execução levam o id_resposta da sessão
+metricas.vincular_id_resposta((st.session_state.registro_salvo or {}).get("id_resposta"))
+if st.session_state.respostas_dict is None:
+    st.session_state.respostas_dict = {qid: 1 for qid in instrumento_atual().ids}
+if st.session_state.id_sessao is None:
+    st.session_state.id_sessao = str(uuid.uuid4())
+
+iniciar_observabilidade()
+# Sobe o pool de PDF já no primeiro acesso, para chegar aquecido ao envio do e-mail
+obter_pool_pdf()
 
 
 # =========================================================
@@ -1161,7 +1461,7 @@ with st.form("form_dados_institucionais", clear_on_submit=False):
                 "consentimento_uso_informacoes": autorizacao_uso,
             }
             st.session_state.etapa1_ok = True
-            st.success("Dados institucionais salvos. Agora preencha a Agenda Estratégica.")
+            st.success(f"Dados institucionais salvos. Agora preencha a {instrumento_atual().modulo}.")
 st.markdown('</div>', unsafe_allow_html=True)
 
 
@@ -1170,105 +1470,158 @@ st.markdown('</div>', unsafe_allow_html=True)
 # =========================================================
 st.markdown('<div class="no-print">', unsafe_allow_html=True)
 st.markdown("---")
-st.subheader("Agenda Estratégica")
 
-if not st.session_state.etapa1_ok:
-    st.info("Preencha os dados institucionais e a autorização acima para liberar o diagnóstico.")
-else:
-    st.caption("Responda cada afirmação em uma escala de 0 a 3.")
 
-    QUESTOES_POR_PAG = 10
-    total_paginas = math.ceil(len(QUESTOES) / QUESTOES_POR_PAG)
-    pagina = st.session_state.pagina_quest
-    inicio = (pagina - 1) * QUESTOES_POR_PAG
-    fim = min(inicio + QUESTOES_POR_PAG, len(QUESTOES))
+def trocar_instrumento():
+    # Outro módulo/versão: respostas e diagnóstico anteriores não se aplicam
+    st.session_state.respostas_dict = {qid: 1 for qid in instrumento_atual().ids}
+    st.session_state.pagina_quest = 1
+    st.session_state.diagnostico_gerado = False
+    st.session_state.pontuacao = None
+    st.session_state.medias_dimensao = None
+
+
+catalogo = catalogo_instrumentos()
+if len(catalogo) > 1:
+    st.selectbox(
+        "Módulo do diagnóstico",
+        catalogo.versoes(),
+        format_func=lambda versao: f"{catalogo.obter(versao).modulo} ({versao})",
+        key="versao_instrumento",
+        on_change=trocar_instrumento,
+    )
+st.subheader(instrumento_atual().modulo)
+
+
+# Em formulário, os sliders de um bloco só vão ao servidor no envio do bloco: uma execução
+# por bloco em vez de uma por slider. QUESTIONARIO_FORMULARIO=0 volta ao modo interativo.
+QUESTIONARIO_EM_FORMULARIO = (get_config_value("QUESTIONARIO_FORMULARIO") or "1").lower() not in ("0", "false", "nao")
+QUESTOES_POR_PAG = 10
+
+SCRIPT_ROLAGEM_QUESTIONARIO = """<script>
+window.parent.document.querySelector('section.main').scrollTo({top: 0, behavior: 'smooth'});
+var els = window.parent.document.querySelectorAll('h2, h3');
+for(var i=0;i<els.length;i++){
+    if(els[i].innerText.includes(__MODULO__)){
+        els[i].scrollIntoView({behavior:'smooth', block:'start'});
+        break;
+    }
+}
+</script>"""
+
+
+def registrar_bloco(ids: tuple, deslocamento: int = 0):
+    # Callback dos botões do bloco: grava as respostas da página de uma vez e, se for o caso, muda de página
+    for qid in ids:
+        chave = f"slider_{qid}"
+        if chave in st.session_state:
+            st.session_state.respostas_dict[qid] = st.session_state[chave]
+    if deslocamento:
+        st.session_state.pagina_quest += deslocamento
+        st.session_state.rolar_questionario = True
+
+
+@st.fragment
+@medir_fragmento("questionario")
+def questionario():
+    # Envio de bloco e, no modo interativo, cada slider reexecutam só o questionário
+    instrumento = instrumento_atual()
+    minimo, maximo = instrumento.escala
+    legenda = instrumento.legenda_escala()
+    st.caption(f"Responda cada afirmação em uma escala de {minimo} a {maximo}.")
+
+    total_paginas = len(instrumento.paginas(QUESTOES_POR_PAG))
+    pagina = min(st.session_state.pagina_quest, total_paginas)
+    # Só as questões da página atual são montadas
+    questoes = instrumento.pagina(pagina, QUESTOES_POR_PAG)
+    ids = tuple(q["id"] for q in questoes)
+
+    if st.session_state.rolar_questionario:
+        # A troca de página já veio do callback: a rolagem vai na mesma execução, sem st.rerun
+        st.session_state.rolar_questionario = False
+        st.components.v1.html(SCRIPT_ROLAGEM_QUESTIONARIO.replace("__MODULO__", json.dumps(instrumento.modulo)), height=0)
 
     st.write(f"Bloco {pagina} de {total_paginas}")
 
-    part_atual = None
-    sec_atual = None
-
-    for q in QUESTOES[inicio:fim]:
-        qid = q["id"]
-        part, sec = extrair_partes(qid)
-
-        if part != part_atual:
-            titulo = PART_TITLES.get(part, "")
-            st.markdown("---")
-            st.markdown(f"## {part}. {titulo}" if titulo else f"## {part}")
-            part_atual = part
-            sec_atual = None
-
-        if sec and sec != sec_atual:
-            subtitulo = SECTION_TITLES.get(sec, "")
-            st.markdown(f"### {sec}. {subtitulo}" if subtitulo else f"### {sec}")
-            sec_atual = sec
-
-        atual = st.session_state.respostas_dict.get(qid, 1)
-        novo_valor = st.slider(
-            label=f"{qid} — {q['texto']}",
-            min_value=0,
-            max_value=3,
-            value=atual,
-            step=1,
-            help="0 = Inexistente | 1 = Muito incipiente | 2 = Parcialmente estruturado | 3 = Bem estruturado",
-            key=f"slider_{qid}",
-        )
-        st.session_state.respostas_dict[qid] = novo_valor
-
-    col1, col2, col3 = st.columns([1, 1, 2])
-
-    def ir_anterior():
-        if st.session_state.pagina_quest > 1:
-            st.session_state.pagina_quest -= 1
-
-    def ir_proximo():
-        if st.session_state.pagina_quest < total_paginas:
-            st.session_state.pagina_quest += 1
-
-    with col1:
-        st.button("Anterior", key="btn_anterior", disabled=(pagina == 1), on_click=ir_anterior)
-    with col2:
-        if st.button("Próximo", key="btn_proximo", disabled=(pagina == total_paginas)):
-            ir_proximo()
-            st.components.v1.html(
-                """<script>
-                window.parent.document.querySelector('section.main').scrollTo({top: 0, behavior: 'smooth'});
-                var els = window.parent.document.querySelectorAll('h2, h3');
-                for(var i=0;i<els.length;i++){
-                    if(els[i].innerText.includes('Agenda Estratégica')){
-                        els[i].scrollIntoView({behavior:'smooth', block:'start'});
-                        break;
-                    }
-                }
-                </script>""",
-                height=0,
+    bloco = st.form("form_questionario", border=False) if QUESTIONARIO_EM_FORMULARIO else st.container()
+    botao = st.form_submit_button if QUESTIONARIO_EM_FORMULARIO else st.button
+    with bloco:
+        part_atual = None
+        sec_atual = None
+
+        for q in questoes:
+            qid = q["id"]
+            part, sec = q["parte"], q["secao"]
+
+            if part != part_atual:
+                titulo = instrumento.titulos_partes.get(part, "")
+                st.markdown("---")
+                st.markdown(f"## {part}. {titulo}" if titulo else f"## {part}")
+                part_atual = part
+                sec_atual = None
+
+            if sec and sec != sec_atual:
+                subtitulo = instrumento.titulos_secoes.get(sec, "")
+                st.markdown(f"### {sec}. {subtitulo}" if subtitulo else f"### {sec}")
+                sec_atual = sec
+
+            atual = st.session_state.respostas_dict.get(qid, 1)
+            novo_valor = st.slider(
+                label=f"{qid} — {q['texto']}",
+                min_value=minimo,
+                max_value=maximo,
+                value=atual,
+                step=1,
+                help=legenda,
+                key=f"slider_{qid}",
             )
-            st.rerun()
-    with col3:
-        ultimo_bloco = (pagina == total_paginas)
-        gerar = st.button(
-            "Gerar diagnóstico",
-            key="btn_gerar",
-            use_container_width=True,
-            disabled=not ultimo_bloco,
-        )
-        if not ultimo_bloco:
-            st.caption("Finalize todos os blocos para habilitar o diagnóstico.")
+            st.session_state.respostas_dict[qid] = novo_valor
+
+        col1, col2, col3 = st.columns([1, 1, 2])
+        with col1:
+            botao("Anterior", disabled=(pagina == 1), on_click=registrar_bloco, args=(ids, -1))
+        with col2:
+            botao("Próximo", disabled=(pagina == total_paginas), on_click=registrar_bloco, args=(ids, 1))
+        with col3:
+            ultimo_bloco = (pagina == total_paginas)
+            gerar = botao(
+                "Gerar diagnóstico",
+                use_container_width=True,
+                disabled=not ultimo_bloco,
+                on_click=registrar_bloco,
+                args=(ids,),
+            )
+            if not ultimo_bloco:
+                st.caption("Finalize todos os blocos para habilitar o diagnóstico.")
 
     if gerar:
         respostas = st.session_state.respostas_dict.copy()
         st.session_state.diagnostico_respostas = respostas
-        medias_dim = calcular_medias_por_dimensao(respostas)
-        st.session_state.medias_dimensao = medias_dim
+        pontuacao = pontuar_respostas(respostas)
+        st.session_state.pontuacao = pontuacao
+        st.session_state.medias_dimensao = pontuacao.dimensoes
         st.session_state.diagnostico_gerado = True
         # Reseta estados de verificação ao regerar
         st.session_state.email_verificado = False
         st.session_state.respondente_salvo = False
         st.session_state.diagnostico_perfil_texto = None
         st.session_state.registro_salvo = None
+        st.session_state.posicao_base = None
         st.session_state.chat_history = []
+        st.session_state.contexto_ia = None
+        st.session_state.impressao_perfil_ia = None
+        if st.session_state.analise_inicial_ia is not None:
+            st.session_state.analise_inicial_ia.cancelar()
+            st.session_state.analise_inicial_ia = None
         st.session_state.dados_pessoais = None
+        # Preview, formulário de e-mail e chat dependem do novo diagnóstico
+        st.rerun()
+
+
+if not st.session_state.etapa1_ok:
+    st.info("Preencha os dados institucionais e a autorização acima para liberar o diagnóstico.")
+else:
+    questionario()
 
 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -1279,17 +1632,19 @@ st.markdown('</div>', unsafe_allow_html=True)
 if st.session_state.diagnostico_gerado:
     respostas_preview = st.session_state.diagnostico_respostas or {}
     medias_preview = st.session_state.medias_dimensao or {}
-    score_geral_preview = round(sum(respostas_preview.values()) / len(respostas_preview), 2) if respostas_preview else 0
+    pontuacao_preview = st.session_state.pontuacao or pontuar_respostas(respostas_preview)
+    score_geral_preview = pontuacao_preview.geral or 0
     nivel_preview = classificar_nivel(score_geral_preview)
 
     st.markdown("---")
     st.markdown('<div class="no-print">', unsafe_allow_html=True)
-    st.subheader("Resultado parcial do diagnóstico: Agenda Estratégica")
+    st.subheader(f"Resultado parcial do diagnóstico: {instrumento_atual().modulo}")
 
     # --- Banner com score e resumo por dimensão ---
     dims_html = ""
+    medias_base_preview = base_observatorio().medias_dimensao()
     for dim, media in medias_preview.items():
-        base = observatorio_means.get(dim, None)
+        base = medias_base_preview.get(dim, None)
         diff_txt = ""
         if base is not None:
             diff = round(media - base, 2)
@@ -1415,32 +1770,51 @@ if st.session_state.diagnostico_gerado and not st.session_state.email_verificado
                 dados_inst = st.session_state.dados_institucionais or {}
                 respostas = st.session_state.diagnostico_respostas or {}
                 medias_dim = st.session_state.medias_dimensao or {}
+                pontuacao = st.session_state.pontuacao or pontuar_respostas(respostas)
 
-                registro = montar_registro_para_salvar(
+                # Clique duplo ou reenvio após reconexão: mesma chave, mesmo registro, sem gravar nem enviar de novo
+                indice = obter_indice_submissoes()
+                chave = chave_submissao(
+                    st.session_state.id_sessao, instrumento_atual().versao,
+                    dados_inst, st.session_state.dados_pessoais, respostas,
+                )
+                submissao = indice.obter(chave) or indice.registrar(chave, montar_registro_para_salvar(
                     dados_institucionais=dados_inst,
                     dados_pessoais=st.session_state.dados_pessoais,
                     respostas=respostas,
-                    medias_dim=medias_dim,
+                    pontuacao=pontuacao,
+                ))
+                registro = submissao.registro
+                metricas.vincular_id_resposta(registro["id_resposta"])
+                # Percentis calculados uma vez: tela, PDF, e-mail e copiloto mostram os mesmos números
+                posicao = posicao_na_base(
+                    dados_inst.get("poder"), dados_inst.get("esfera"), dados_inst.get("estado_uf"),
+                    respostas, pontuacao,
                 )
 
-                # Salva no Google Sheets
-                try:
-                    salvar_registro_google_sheets(registro)
-                except Exception as e:
-                    st.error(str(e))
-                    st.info("O diagnóstico foi gerado, mas houve falha no salvamento. Verifique os Secrets, o nome da planilha/aba e a permissão da service account.")
-                    st.stop()
-
-                # Envia e-mail com resumo — falha não bloqueia o fluxo
+                # Salva na base local (espelhada no Google Sheets em segundo plano)
+                if not submissao.concluiu(SALVO):
+                    try:
+                        salvar_registro(registro)
+                    except Exception as e:
+                        st.error(str(e))
+                        st.info("O diagnóstico foi gerado, mas houve falha no salvamento. Verifique a pasta de dados (PUBLIX_DATA_DIR) e a permissão de escrita.")
+                        st.stop()
+                    indice.concluir(submissao, SALVO)
+
+                # Enfileira o e-mail com o relatório — falha não bloqueia o fluxo
                 email_erro_msg = None
-                try:
-                    enviar_resumo_por_email(
-                        destinatario=st.session_state.dados_pessoais["email_respondente"],
-                        registro=registro,
-                        medias_dim=medias_dim,
-                    )
-                except Exception as e:
-                    email_erro_msg = str(e)
+                if not submissao.concluiu(EMAIL):
+                    try:
+                        enviar_resumo_por_email(
+                            destinatario=st.session_state.dados_pessoais["email_respondente"],
+                            registro=registro,
+                            medias_dim=medias_dim,
+                            posicao=posicao,
+                        )
+                        indice.concluir(submissao, EMAIL)
+                    except Exception as e:
+                        email_erro_msg = str(e)
 
                 # Monta perfil para IA
                 perfil_txt = montar_perfil_texto(
@@ -1450,12 +1824,23 @@ if st.session_state.diagnostico_gerado and not st.session_state.email_verificado
                     dados_inst.get("estado_uf"),
                     respostas,
                     medias_dim,
+                    incluir_textos=False,
+                    posicao=posicao,
                 )
 
                 st.session_state.diagnostico_perfil_texto = perfil_txt
+                st.session_state.contexto_ia = criar_contexto_ia()
+                st.session_state.impressao_perfil_ia = impressao_perfil_ia(
+                    dados_inst.get("poder"), dados_inst.get("esfera"), respostas, medias_dim
+                )
+                # A primeira análise já começa a ser gerada enquanto o relatório é exibido
+                st.session_state.analise_inicial_ia = agendar_analise_inicial(
+                    st.session_state.impressao_perfil_ia, st.session_state.contexto_ia
+                )
                 st.session_state.email_verificado = True
                 st.session_state.respondente_salvo = True
                 st.session_state.registro_salvo = registro
+                st.session_state.posicao_base = posicao
                 st.session_state.email_erro_msg = email_erro_msg
 
                 st.rerun()
@@ -1466,6 +1851,36 @@ st.markdown('</div>', unsafe_allow_html=True)
 # =========================================================
 # ETAPA 5 — Relatório completo (só após e-mail confirmado)
 # =========================================================
+def exibir_status_email(status: dict, email_dest: str):
+    situacao = (status or {}).get("status")
+    if situacao == ENVIADO:
+        st.success(f"✅ Relatório enviado para **{email_dest}**. Verifique sua caixa de entrada!")
+    elif situacao == FALHOU:
+        st.warning(
+            f"⚠️ Dados salvos, mas não conseguimos entregar o e-mail para **{email_dest}**: {status.get('ultimo_erro')}\n\n"
+            "Você ainda pode acessar o relatório e a IA abaixo."
+        )
+    else:
+        st.info(f"📨 Seu relatório está sendo enviado para **{email_dest}**. Você já pode acessar o relatório e a IA abaixo.")
+
+
+@st.fragment(run_every=3)
+def acompanhar_status_email(id_resposta: str, email_dest: str):
+    # Só esta parte é reexecutada enquanto o envio está pendente
+    status = status_envio_email(id_resposta)
+    if status and status.get("status") in (ENVIADO, FALHOU):
+        st.rerun()
+    exibir_status_email(status, email_dest)
+
+
+@st.fragment(run_every=1)
+def acompanhar_preparo_pdf():
+    preparo = st.session_state.preparo_pdf
+    if preparo is None or preparo[1].done():
+        st.rerun()
+    st.caption("Preparando o PDF do relatório para download...")
+
+
 if st.session_state.respondente_salvo and st.session_state.registro_salvo:
     # Mostra status do e-mail persistido antes do rerun
     if st.session_state.get("email_erro_msg"):
@@ -1475,152 +1890,72 @@ if st.session_state.respondente_salvo and st.session_state.registro_salvo:
         )
     else:
         email_dest = st.session_state.registro_salvo.get("email_respondente", "")
-        st.success(f"✅ Relatório enviado para **{email_dest}**. Verifique sua caixa de entrada!")
+        id_resposta_atual = st.session_state.registro_salvo.get("id_resposta", "")
+        status_email = status_envio_email(id_resposta_atual)
+        if status_email and status_email.get("status") in (ENVIADO, FALHOU):
+            exibir_status_email(status_email, email_dest)
+        else:
+            acompanhar_status_email(id_resposta_atual, email_dest)
 
     r = st.session_state.registro_salvo
     medias_dim = st.session_state.medias_dimensao or {}
+    posicao = st.session_state.posicao_base
 
-    score_geral_raw = float(r.get("score_geral", 0) or 0)
-    score_geral = html.escape(str(r.get("score_geral", "")))
-    nivel = html.escape(str(r.get("nivel_maturidade", "")))
-    data_relatorio = html.escape(str(r.get("data_hora", "")))
-    instituicao_txt = html.escape(str(r.get("instituicao", "")))
-    poder_txt = html.escape(str(r.get("poder", "")))
-    esfera_txt = html.escape(str(r.get("esfera", "")))
-    uf_txt = html.escape(str(r.get("estado_uf", "")))
-    respondente_txt = html.escape(str(r.get("nome_respondente", "")))
-    cargo_txt = html.escape(str(r.get("cargo_funcao", "")))
-    email_txt = html.escape(str(r.get("email_respondente", "")))
-    diag_id_txt = html.escape(str(r.get("id_resposta", "")))
-
-    score_pct = max(0, min((score_geral_raw / 3) * 100, 100))
-
-    if score_geral_raw < 1.0:
-        active_level = 1
-    elif score_geral_raw < 2.0:
-        active_level = 2
-    elif score_geral_raw < 2.6:
-        active_level = 3
-    else:
-        active_level = 4
-
-    level_badges_html = (
-        f'<div class="level-badges">'
-        f'<div class="level-badge{" active" if active_level == 1 else ""}">Incipiente</div>'
-        f'<div class="level-badge{" active" if active_level == 2 else ""}">Em estruturação</div>'
-        f'<div class="level-badge{" active" if active_level == 3 else ""}">Parcialmente estruturado</div>'
-        f'<div class="level-badge{" active" if active_level == 4 else ""}">Bem estruturado</div>'
-        f'</div>'
-    )
-
-    cards_html_list = []
-    for dim, media in medias_dim.items():
-        base = observatorio_means.get(dim, None)
-        if base is None:
-            continue
-        diff = round(media - base, 2)
-        org_pct = max(0, min((media / 3) * 100, 100))
-        base_pct = max(0, min((base / 3) * 100, 100))
-
-        if media < 1.5:
-            prioridade = "Prioridade alta"
-            recomendacao = "Estruturar fundamentos da agenda estratégica (cenários, objetivos, metas e planos de ação)."
-        elif media < 2.0:
-            prioridade = "Prioridade média"
-            recomendacao = "Fortalecer consistência e institucionalização das práticas estratégicas."
-        else:
-            prioridade = "Prioridade de consolidação"
-            recomendacao = "Padronizar e ampliar a disseminação interna das práticas já existentes."
-
-        cards_html_list.append(
-            f'<div class="dim-card">'
-            f'<strong>{html.escape(dim)}</strong>'
-            f'<div><b>Média da organização:</b> {media:.2f} | <b>Base:</b> {base:.2f} | <b>Diferença:</b> {diff:+.2f}</div>'
-            f'<div class="compare-row"><div class="compare-label">Organização</div>'
-            f'<div class="compare-track"><div class="compare-fill-org" style="width:{org_pct:.1f}%;"></div></div></div>'
-            f'<div class="compare-row"><div class="compare-label">Base nacional</div>'
-            f'<div class="compare-track"><div class="compare-fill-base" style="width:{base_pct:.1f}%;"></div></div></div>'
-            f'<div class="muted" style="margin-top:6px;"><b>{html.escape(prioridade)}:</b> {html.escape(recomendacao)}</div>'
-            f'</div>'
+    if posicao:
+        st.markdown(
+            f"**Posição entre pares:** percentil **{posicao['geral']}** no score geral, "
+            f"entre {posicao['n']} respostas do grupo {posicao['segmento']}."
         )
-
-    html_dim_cards = "".join(cards_html_list)
-
-    logo_b64 = file_to_base64(LOGO_PATH)
-    logo_html = ""
-    if logo_b64:
-        logo_html = (
-            '<div class="report-logo">'
-            f'<img src="data:image/png;base64,{logo_b64}" alt="Logo Publix">'
-            '</div>'
+    st.markdown(renderizar_html_relatorio(r, medias_dim, posicao), unsafe_allow_html=True)
+
+    # O PDF costuma já estar no cache (o e-mail gera o mesmo); senão é preparado em segundo
+    # plano e o botão aparece quando ficar pronto, sem segurar esta execução
+    pdf_relatorio = obter_cache_relatorios().consultar(r["id_resposta"], "pdf")
+    if pdf_relatorio is None:
+        preparo = st.session_state.preparo_pdf
+        if preparo is None or preparo[0] != r["id_resposta"]:
+            preparo = (r["id_resposta"], obter_executor_relatorios().submit(
+                renderizar_pdf_relatorio, r, medias_dim, posicao, recursos_relatorio()
+            ))
+            st.session_state.preparo_pdf = preparo
+        if not preparo[1].done():
+            acompanhar_preparo_pdf()
+        elif preparo[1].exception() is not None:
+            logger.warning("PDF do relatório %s indisponível para download: %s", r["id_resposta"],
+                           preparo[1].exception())
+        else:
+            pdf_relatorio = preparo[1].result()
+    if pdf_relatorio:
+        st.download_button(
+            "Baixar relatório em PDF",
+            data=pdf_relatorio,
+            file_name=NOME_ARQUIVO_PDF,
+            mime="application/pdf",
+            use_container_width=True,
         )
 
-    visual_score_html = (
-        '<div class="visual-block">'
-        '<div class="visual-title">Indicador visual de maturidade</div>'
-        f'<div><b>Score geral:</b> {score_geral} / 3,0</div>'
-        f'<div class="bar-track"><div class="bar-fill" style="width:{score_pct:.1f}%;"></div></div>'
-        '<div class="bar-legend">Escala de 0 a 3</div>'
-        + level_badges_html +
-        '</div>'
-    )
-
-    html_relatorio = (
-        '<div id="report-print-root" class="print-only">'
-        '<div class="report-wrap">'
-        '<div class="publix-band"></div>'
-        '<div class="report-header">'
-        '<div class="report-header-left">'
-        '<div class="report-title">Relatório de Diagnóstico — Agenda Estratégica</div>'
-        f'<div class="report-subtitle">Observatório de Governança para Resultados: Inteligência Artificial<br>Emitido em: {data_relatorio}</div>'
-        '</div>'
-        + logo_html +
-        '</div>'
-        '<div class="section-print-title">Identificação institucional</div>'
-        '<div class="kpi-grid">'
-        '<div class="kpi-card"><div class="label">Instituição</div><div class="value">' + instituicao_txt + '</div></div>'
-        '<div class="kpi-card"><div class="label">Classificação</div><div class="value">' + poder_txt + ' | ' + esfera_txt + ' | ' + uf_txt + '</div></div>'
-        '<div class="kpi-card"><div class="label">Respondente</div><div class="value">' + respondente_txt + '</div></div>'
-        '<div class="kpi-card"><div class="label">Cargo / contato</div><div class="value">' + cargo_txt + ' | ' + email_txt + '</div></div>'
-        '</div>'
-        '<div class="section-print-title">Resultado geral</div>'
-        '<div class="kpi-grid" style="grid-template-columns: 1fr 1fr 1fr;">'
-        '<div class="kpi-card"><div class="label">Score geral</div><div class="value">' + score_geral + '</div></div>'
-        '<div class="kpi-card"><div class="label">Nível de maturidade</div><div class="value">' + nivel + '</div></div>'
-        '<div class="kpi-card"><div class="label">ID do diagnóstico</div><div class="value">' + diag_id_txt + '</div></div>'
-        '</div>'
-        '<div class="section-print-title">Visual executivo</div>'
-        + visual_score_html +
-        '<div class="section-print-title">Análise por dimensão</div>'
-        + html_dim_cards +
-        '</div>'
-        '</div>'
-    )
-
-    st.markdown(html_relatorio, unsafe_allow_html=True)
-
 
 # =========================================================
 # ETAPA 6 — Chat com IA (só após e-mail confirmado)
 # =========================================================
-st.markdown('<div class="no-print">', unsafe_allow_html=True)
-st.markdown("---")
-st.subheader("Converse com a IA sobre o seu diagnóstico")
+@st.fragment(run_every=1)
+def acompanhar_analise_inicial():
+    tarefa = st.session_state.analise_inicial_ia
+    if tarefa is None or tarefa.pronta():
+        # Uma única execução completa por diagnóstico, para a análise entrar no histórico
+        st.rerun()
+    with st.chat_message("assistant"):
+        st.markdown("_Preparando a análise inicial do seu diagnóstico..._")
+
+
+@st.fragment
+@medir_fragmento("chat")
+def secao_chat():
+    # Cada pergunta reexecuta só o chat; relatório e questionário não são reenviados
+    analise_pendente = st.session_state.analise_inicial_ia
+    if analise_pendente is not None and analise_pendente.pronta():
+        incorporar_analise_inicial()
 
-if not st.session_state.email_verificado or st.session_state.diagnostico_perfil_texto is None:
-    if st.session_state.diagnostico_gerado:
-        # Mostra seção "travada" visualmente para incentivar o preenchimento
-        st.markdown(
-            '<div class="locked-section">',
-            unsafe_allow_html=True,
-        )
-        st.markdown(
-            "_Exemplo de análise da IA: 'Sua organização está abaixo da média nacional em Agenda Estratégica. "
-            "Os maiores gaps estão em Definição de Metas e Alinhamento com a Agenda de Desenvolvimento...'_"
-        )
-        st.markdown('</div>', unsafe_allow_html=True)
-        st.caption("🔒 Confirme seu e-mail acima para desbloquear a IA especialista.")
-else:
     for msg in st.session_state.chat_history:
         if msg["role"] == "user":
             with st.chat_message("user"):
@@ -1629,23 +1964,66 @@ else:
             with st.chat_message("assistant"):
                 st.markdown(msg["content"])
 
-    prompt = st.chat_input("Faça uma pergunta para a IA sobre o diagnóstico da sua organização...")
+    limite_ia_atingido = st.session_state.contexto_ia is not None and st.session_state.contexto_ia.excedeu_limite()
+    if limite_ia_atingido:
+        st.caption("Limite de uso da IA nesta sessão atingido.")
+    prompt = st.chat_input(
+        "Faça uma pergunta para a IA sobre o diagnóstico da sua organização...",
+        disabled=limite_ia_atingido,
+    )
+
+    if st.session_state.analise_inicial_ia is not None and not prompt:
+        acompanhar_analise_inicial()
 
     if prompt:
+        if st.session_state.analise_inicial_ia is not None:
+            # A análise já está em andamento: esperar sai mais barato que descartá-la
+            with st.spinner("Concluindo a análise inicial..."):
+                analise = incorporar_analise_inicial(timeout=float(get_config_value("OPENAI_TIMEOUT") or 60))
+            if analise:
+                with st.chat_message("assistant"):
+                    st.markdown(analise)
+
         user_msg = {"role": "user", "content": prompt}
         with st.chat_message("user"):
             st.markdown(prompt)
         st.session_state.chat_history.append(user_msg)
 
         with st.chat_message("assistant"):
-            with st.spinner("Gerando resposta da IA..."):
-                resposta = chamar_ia(
+            resposta = st.write_stream(
+                responder_ia_stream(
                     st.session_state.diagnostico_perfil_texto,
                     st.session_state.chat_history,
+                    contexto=st.session_state.contexto_ia,
+                    respostas_dict=st.session_state.diagnostico_respostas,
+                    impressao_perfil=st.session_state.impressao_perfil_ia,
                 )
-                st.markdown(resposta)
+            )
 
         st.session_state.chat_history.append({"role": "assistant", "content": resposta})
+        if not limite_ia_atingido and st.session_state.contexto_ia is not None and st.session_state.contexto_ia.excedeu_limite():
+            reexecutar_fragmento()
+
+
+st.markdown('<div class="no-print">', unsafe_allow_html=True)
+st.markdown("---")
+st.subheader("Converse com a IA sobre o seu diagnóstico")
+
+if not st.session_state.email_verificado or st.session_state.diagnostico_perfil_texto is None:
+    if st.session_state.diagnostico_gerado:
+        # Mostra seção "travada" visualmente para incentivar o preenchimento
+        st.markdown(
+            '<div class="locked-section">',
+            unsafe_allow_html=True,
+        )
+        st.markdown(
+            "_Exemplo de análise da IA: 'Sua organização está abaixo da média nacional em Agenda Estratégica. "
+            "Os maiores gaps estão em Definição de Metas e Alinhamento com a Agenda de Desenvolvimento...'_"
+        )
+        st.markdown('</div>', unsafe_allow_html=True)
+        st.caption("🔒 Confirme seu e-mail acima para desbloquear a IA especialista.")
+else:
+    secao_chat()
 
 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -1679,7 +2057,7 @@ if st.session_state.respondente_salvo:
                 if (!printWindow) { alert("Não foi possível abrir a janela de impressão. Verifique se o navegador bloqueou pop-up."); return; }
 
                 printWindow.document.open();
-                printWindow.document.write(`<!DOCTYPE html><html><head><meta charset="UTF-8" /><title>Relatório de Diagnóstico</title>${styles}${extraPrintCss}</head><body>${report.outerHTML}</body></html>`);
+                printWindow.document.write(`<!DOCTYPE html><html><head><meta charset="UTF-8" /><base href="${rootDoc.baseURI}"><title>Relatório de Diagnóstico</title>${styles}${extraPrintCss}</head><body>${report.outerHTML}</body></html>`);
                 printWindow.document.close();
                 printWindow.onload = function() { printWindow.focus(); printWindow.print(); printWindow.close(); };
             } catch (e) { console.error(e); alert("Erro ao gerar impressão do relatório."); }
@@ -1708,4 +2086,6 @@ st.markdown(
 """,
     unsafe_allow_html=True,
 )
-st.markdown('</div>', unsafe_allow_html=True)
\ No newline at end of file
+st.markdown('</div>', unsafe_allow_html=True)
+
+concluir_execucao(st.session_state)
@@ -0,0 +1,595 @@
+"""Teste de carga sem navegador da jornada completa do respondente.
+
+Cada sessão simulada percorre, com o AppTest do Streamlit, ETAPA 1 → blocos do
+questionário → gerar diagnóstico → confirmação do e-mail → pergunta no chat.
+Google Sheets, SMTP e OpenAI são substituídos por dublês locais com latência e
+taxa de falhas configuráveis, e todas as sessões dividem o mesmo processo (os
+recursos em cache são os de um contêiner real). O relatório traz vazão,
+p50/p95/p99 por etapa e memória por sessão.
+
+Com --replicas N, as sessões são divididas entre N processos, como N contêineres
+atrás do nginx: cada um com seu REPLICA_ID, todos na mesma pasta de dados e no
+mesmo estado compartilhado (--estado; padrão: SQLite na pasta de dados). O
+relatório soma a vazão das réplicas e as linhas e e-mails entregues por todas.
+
+Uso:
+    python teste_carga.py --sessoes 40 --simultaneas 8
+    python teste_carga.py --sessoes 100 --simultaneas 20 --latencia-ia 1.5 --falhas-planilha 0.05 --json carga.json
+    python teste_carga.py --sessoes 80 --simultaneas 8 --replicas 4
+    python teste_carga.py --sessoes 80 --simultaneas 8 --replicas 4 --estado redis://localhost:6379/0
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ETAPAS = ("abertura", "etapa1", "questionario", "gerar", "envio", "chat")
+
+
+# -------------------
+# Dublês dos serviços externos
+# -------------------
+class Servico:
+    """Latência média em segundos (±50% de variação) e fração de chamadas que falham."""
+
+    def __init__(self, nome: str, latencia: float = 0.0, falhas: float = 0.0, semente: int = 0):
+        self.nome = nome
+        self.latencia = latencia
+        self.falhas = falhas
+        self.chamadas = 0
+        self.falhas_injetadas = 0
+        self._rng = random.Random(semente)
+        self._lock = threading.Lock()
+
+    def chamar(self, erro):
+        with self._lock:
+            self.chamadas += 1
+            espera = self.latencia * self._rng.uniform(0.5, 1.5) if self.latencia else 0.0
+            falhar = self._rng.random() < self.falhas
+            if falhar:
+                self.falhas_injetadas += 1
+        if espera:
+            time.sleep(espera)
+        if falhar:
+            raise erro()
+
+
+class AbaLocal:
+    title = "respostas"
+    id = 1
+
+    def __init__(self, servico: Servico):
+        self._servico = servico
+        self._lock = threading.Lock()
+        self.linhas = []
+        self.col_count = 26
+        self.row_count = 1000
+
+    def _chamar(self):
+        self._servico.chamar(lambda: ConnectionError("falha simulada do Google Sheets"))
+
+    def row_values(self, i):
+        self._chamar()
+        with self._lock:
+            return list(self.linhas[i - 1]) if len(self.linhas) >= i else []
+
+    def col_values(self, j):
+        self._chamar()
+        with self._lock:
+            return [linha[j - 1] if len(linha) >= j else "" for linha in self.linhas]
+
+    def add_cols(self, n):
+        self._chamar()
+        self.col_count += n
+
+    def update(self, values=None, range_name=None, **kwargs):
+        from gspread.utils import a1_to_rowcol
+
+        self._chamar()
+        linha, coluna = a1_to_rowcol(range_name or "A1")
+        with self._lock:
+            while len(self.linhas) < linha:
+                self.linhas.append([])
+            atual = self.linhas[linha - 1]
+            while len(atual) < coluna - 1:
+                atual.append("")
+            atual[coluna - 1:coluna - 1 + len(values[0])] = list(values[0])
+
+    def append_rows(self, valores, **kwargs):
+        self._chamar()
+        with self._lock:
+            self.linhas.extend(list(v) for v in valores)
+
+    def append_row(self, valores, **kwargs):
+        self.append_rows([valores])
+
+
+class ClienteSheetsLocal:
+    def __init__(self, aba: AbaLocal):
+        self._aba = aba
+
+    def open(self, nome):
+        return self
+
+    def worksheet(self, nome):
+        return self._aba
+
+
+class SMTPLocal:
+    servico = None
+    enviados = 0
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def ehlo(self):
+        pass
+
+    def starttls(self, **kwargs):
+        pass
+
+    def login(self, usuario, senha):
+        pass
+
+    def noop(self):
+        return (250, b"ok")
+
+    def send_message(self, msg):
+        import smtplib
+
+        self.servico.chamar(lambda: smtplib.SMTPDataError(451, b"falha simulada do SMTP"))
+        with SMTPLocal._lock:
+            SMTPLocal.enviados += 1
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Objeto:
+    def __init__(self, **campos):
+        self.__dict__.update(campos)
+
+
+class OpenAILocal:
+    """Resposta fixa; no streaming, a latência vale até o primeiro token e o texto chega em pedaços."""
+
+    servico = None
+    RESPOSTA = ("Sua organização apresenta bases importantes de planejamento, mas ainda precisa "
+                "consolidar o monitoramento e a revisão periódica da estratégia.")
+
+    def __init__(self, *args, **kwargs):
+        self.chat = _Objeto(completions=_Objeto(create=self._criar))
+
+    def _falha(self):
+        import openai
+
+        # Como o limite da conta: 429 com Retry-After curto, que o app deve respeitar e repetir
+        resposta = _Objeto(status_code=429, headers={"retry-after": "0.2"}, request=None)
+        return openai.RateLimitError("falha simulada da OpenAI", response=resposta, body=None)
+
+    def _criar(self, stream=False, **kwargs):
+        self.servico.chamar(self._falha)
+        saida = len(self.RESPOSTA.split())
+        uso = _Objeto(prompt_tokens=1200, completion_tokens=saida, total_tokens=1200 + saida)
+        if not stream:
+            mensagem = _Objeto(role="assistant", content=self.RESPOSTA)
+            return _Objeto(choices=[_Objeto(message=mensagem, finish_reason="stop")], usage=uso)
+
+        def pedacos():
+            for palavra in self.RESPOSTA.split(" "):
+                yield _Objeto(choices=[_Objeto(delta=_Objeto(content=palavra + " "), finish_reason=None)], usage=None)
+            yield _Objeto(choices=[], usage=uso)
+
+        return pedacos()
+
+
+def instalar_dubles(planilha: Servico, smtp: Servico, ia: Servico) -> AbaLocal:
+    """Troca os clientes reais pelos dublês; chamar antes da primeira execução do app."""
+    import google.oauth2.service_account as conta_servico
+    import gspread
+    import openai
+    import smtplib
+
+    aba = AbaLocal(planilha)
+    gspread.authorize = lambda credenciais, **kwargs: ClienteSheetsLocal(aba)
+    conta_servico.Credentials.from_service_account_info = classmethod(lambda cls, info, scopes=None: object())
+    SMTPLocal.servico = smtp
+    smtplib.SMTP = smtplib.SMTP_SSL = SMTPLocal
+    OpenAILocal.servico = ia
+    openai.OpenAI = OpenAILocal
+    _preparar_apptest()
+    return aba
+
+
+def _preparar_apptest():
+    """Ajustes no AppTest 1.38 para várias sessões ao mesmo tempo no mesmo processo."""
+    import streamlit.testing.v1.app_test as app_test
+    import streamlit.testing.v1.element_tree as arvore
+    import streamlit.testing.v1.local_script_runner as executor_local
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    original = arvore.get_widget_state
+    if getattr(original, "_publix", False):
+        return
+
+    # Levanta KeyError ao ler o estado de widgets sem valor (ex.: chat_input já enviado)
+    def get_widget_state(node):
+        try:
+            return original(node)
+        except KeyError:
+            return None
+
+    get_widget_state._publix = True
+    arvore.get_widget_state = get_widget_state
+
+    # Cada execução troca o Runtime global por um simulado e o zera ao terminar, e liga/desliga
+    # global.appTest: com execuções simultâneas, uma derrubaria a outra. O último Runtime simulado
+    # fica valendo para todas, e a opção fica ligada durante todo o teste.
+    ultimo = {}
+    instancia_original = Runtime.instance.__func__
+
+    def instance(cls):
+        if cls._instance is not None:
+            ultimo["runtime"] = cls._instance
+            return cls._instance
+        if "runtime" in ultimo:
+            return ultimo["runtime"]
+        return instancia_original(cls)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or "runtime" in ultimo)
+    # Um bytecode do script para todas as execuções, como no servidor: compilar em várias threads
+    # ao mesmo tempo dispara "AST constructor recursion depth mismatch" no CPython 3.11
+    cache_script = ScriptCache()
+    executor_local.ScriptCache = lambda: cache_script
+
+    config.get_config_options()
+    config._set_option("global.appTest", True, "teste_carga")
+    app_test.patch_config_options = lambda opcoes: contextlib.nullcontext()
+
+
+# -------------------
+# Jornada de um respondente
+# -------------------
+class FalhaEtapa(Exception):
+    pass
+
+
+def memoria_rss() -> int:
+    """RSS atual em bytes (pico do processo quando /proc não existe)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        fator = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * fator
+
+
+class Jornada:
+    PODERES = ("Executivo", "Legislativo", "Judiciário")
+    ESFERAS = ("Federal", "Estadual", "Municipal")
+    UFS = ("DF", "SP", "MG", "BA", "RS", "PE")
+
+    def __init__(self, numero: int, app: str, timeout: float, pergunta: str):
+        self.numero = numero
+        self.app = app
+        self.timeout = timeout
+        self.pergunta = pergunta
+        self.rng = random.Random(numero)
+        self.tempos = {}
+        self.alertas = defaultdict(int)
+        self.erro = None
+        self.at = None
+
+    def _executar(self, etapa: str, acao=None):
+        inicio = time.perf_counter()
+        if acao is not None:
+            acao()
+        self.at.run(timeout=self.timeout)
+        self.tempos[etapa] = self.tempos.get(etapa, 0.0) + time.perf_counter() - inicio
+        if self.at.exception:
+            raise FalhaEtapa(f"{etapa}: {self.at.exception[0].value}")
+        # Falhas que o app contorna e mostra ao respondente (st.error) não interrompem a jornada
+        self.alertas[etapa] += len(self.at.error)
+
+    def _campo(self, colecao, rotulo):
+        for elemento in colecao:
+            if elemento.label.startswith(rotulo):
+                return elemento
+        raise FalhaEtapa(f"elemento '{rotulo}' não encontrado")
+
+    def executar(self):
+        from streamlit.testing.v1 import AppTest
+
+        self.at = at = AppTest.from_file(self.app, default_timeout=self.timeout)
+        try:
+            self._executar("abertura")
+
+            def etapa1():
+                self._campo(at.text_input, "1.1").input(f"Organização {self.numero}")
+                self._campo(at.selectbox, "1.2").select(self.rng.choice(self.PODERES))
+                self._campo(at.selectbox, "1.3").select(self.rng.choice(self.ESFERAS))
+                self._campo(at.selectbox, "1.4").select(self.rng.choice(self.UFS))
+                at.checkbox[0].check()
+                self._campo(at.button, "Continuar").click()
+
+            self._executar("etapa1", etapa1)
+
+            # Um envio por bloco; o último bloco é enviado pelo próprio "Gerar diagnóstico"
+            while True:
+                for i in range(len(at.slider)):
+                    at.slider[i].set_value(self.rng.randint(0, 3))
+                proximo = self._campo(at.button, "Próximo")
+                if proximo.disabled:
+                    break
+                self._executar("questionario", proximo.click)
+            self._executar("gerar", self._campo(at.button, "Gerar diagnóstico").click)
+
+            def envio():
+                email = f"respondente{self.numero}@carga.local"
+                self._campo(at.text_input, "Nome").input(f"Respondente {self.numero}")
+                self._campo(at.text_input, "E-mail").input(email)
+                self._campo(at.text_input, "Confirme").input(email)
+                self._campo(at.button, "Confirmar e-mail").click()
+
+            self._executar("envio", envio)
+            if not at.session_state["email_verificado"]:
+                avisos = [e.value for e in (*at.error, *at.warning)]
+                raise FalhaEtapa(f"envio: e-mail não confirmado {avisos}")
+
+            if not at.chat_input:
+                raise FalhaEtapa("chat: campo de conversa indisponível")
+            self._executar("chat", lambda: at.chat_input[0].set_value(self.pergunta))
+        except FalhaEtapa as e:
+            self.erro = str(e)
+        except Exception as e:
+            self.erro = f"{type(e).__name__}: {e}"
+        return self
+
+
+# -------------------
+# Execução e relatório
+# -------------------
+def percentis(valores: list) -> dict:
+    if not valores:
+        return {"n": 0}
+    p50, p95, p99 = np.percentile(valores, [50, 95, 99])
+    return {"n": len(valores), "media": float(np.mean(valores)), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def executar_carga(sessoes: int, simultaneas: int, app: str = "streamlit_app.py", timeout: float = 120.0,
+                   pergunta: str = "Quais são os principais pontos de melhoria?", rampa: float = 0.0,
+                   aquecimento: int = 1) -> dict:
+    # Jornadas fora da medição: importações, recursos em cache e pool de PDF não entram na memória por sessão
+    for numero in range(aquecimento):
+        Jornada(-1 - numero, app, timeout, pergunta).executar()
+    memoria_inicial = memoria_rss()
+    jornadas = []
+    inicio = time.perf_counter()
+
+    def rodar(numero):
+        if rampa:
+            time.sleep(rampa * numero / max(1, sessoes))
+        return Jornada(numero, app, timeout, pergunta).executar()
+
+    with ThreadPoolExecutor(max_workers=simultaneas, thread_name_prefix="carga") as executor:
+        for jornada in executor.map(rodar, range(sessoes)):
+            jornadas.append(jornada)
+    duracao = time.perf_counter() - inicio
+    # As sessões continuam vivas até aqui, como num contêiner com todos os respondentes conectados
+    memoria_final = memoria_rss()
+
+    tempos = defaultdict(list)
+    erros = defaultdict(int)
+    alertas = defaultdict(int)
+    for jornada in jornadas:
+        for etapa, segundos in jornada.tempos.items():
+            tempos[etapa].append(segundos)
+        for etapa, n in jornada.alertas.items():
+            alertas[etapa] += n
+        if jornada.erro:
+            erros[jornada.erro.split(":")[0]] += 1
+    concluidas = sum(1 for j in jornadas if not j.erro)
+    tempos["jornada"] = [sum(j.tempos.values()) for j in jornadas if not j.erro]
+
+    return {
+        "sessoes": sessoes,
+        "simultaneas": simultaneas,
+        "concluidas": concluidas,
+        "duracao_s": duracao,
+        "vazao_jornadas_min": concluidas / duracao * 60 if duracao else 0.0,
+        "etapas": {etapa: {**percentis(tempos[etapa]), "alertas": alertas[etapa]} for etapa in (*ETAPAS, "jornada")},
+        "erros": dict(erros),
+        "exemplos_erro": [j.erro for j in jornadas if j.erro][:5],
+        "memoria_inicial_mb": memoria_inicial / 2**20,
+        "memoria_final_mb": memoria_final / 2**20,
+        "memoria_por_sessao_mb": (memoria_final - memoria_inicial) / 2**20 / max(1, sessoes),
+    }
+
+
+def texto_relatorio(resultado: dict, servicos: list) -> str:
+    linhas = [
+        f"Sessões: {resultado['concluidas']}/{resultado['sessoes']} concluídas, {resultado['simultaneas']} simultâneas",
+        f"Duração: {resultado['duracao_s']:.1f} s | vazão: {resultado['vazao_jornadas_min']:.1f} jornadas/min",
+        "",
+        f"{'etapa':<14}{'n':>6}{'média':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'alertas':>9}  (segundos)",
+    ]
+    for etapa, p in resultado["etapas"].items():
+        if p["n"]:
+            linhas.append(
+                f"{etapa:<14}{p['n']:>6}{p['media']:>9.3f}{p['p50']:>9.3f}{p['p95']:>9.3f}{p['p99']:>9.3f}"
+                f"{p['alertas']:>9}"
+            )
+        else:
+            linhas.append(f"{etapa:<14}{0:>6}")
+    linhas.append("")
+    linhas.append(
+        f"Memória: {resultado['memoria_inicial_mb']:.0f} MB -> {resultado['memoria_final_mb']:.0f} MB "
+        f"({resultado['memoria_por_sessao_mb']:.2f} MB por sessão)"
+    )
+    for servico in servicos:
+        linhas.append(f"{servico.nome}: {servico.chamadas} chamadas, {servico.falhas_injetadas} falhas injetadas")
+    if resultado["erros"]:
+        linhas.append("Jornadas interrompidas por etapa: " + ", ".join(f"{k}={v}" for k, v in resultado["erros"].items()))
+        for exemplo in resultado["exemplos_erro"]:
+            linhas.append(f"  {exemplo}")
+    return "\n".join(linhas)
+
+
+def executar_replicas(args) -> int:
+    """Roda as sessões divididas entre `args.replicas` processos e soma os resultados."""
+    dados = args.dados or tempfile.mkdtemp(prefix="publix-carga-")
+    estado = args.estado or f"sqlite:///{os.path.join(os.path.abspath(dados), 'estado.db')}"
+    processos = []
+    for i in range(args.replicas):
+        # Sobras da divisão vão para as primeiras réplicas
+        sessoes = args.sessoes // args.replicas + (1 if i < args.sessoes % args.replicas else 0)
+        saida = os.path.join(dados, f"carga-replica{i + 1}.json")
+        comando = [
+            sys.executable, os.path.abspath(__file__),
+            "--sessoes", str(sessoes), "--simultaneas", str(args.simultaneas), "--rampa", str(args.rampa),
+            "--aquecimento", str(args.aquecimento), "--timeout", str(args.timeout), "--drenar", str(args.drenar),
+            "--dados", dados, "--estado", estado, "--json", saida,
+        ]
+        for servico in ("planilha", "smtp", "ia"):
+            comando += [f"--latencia-{servico}", str(getattr(args, f"latencia_{servico}")),
+                        f"--falhas-{servico}", str(getattr(args, f"falhas_{servico}"))]
+        log = open(os.path.join(dados, f"carga-replica{i + 1}.log"), "w", encoding="utf-8")
+        processos.append((saida, log, subprocess.Popen(
+            comando, env={**os.environ, "REPLICA_ID": f"replica{i + 1}"}, stdout=log, stderr=subprocess.STDOUT,
+        )))
+
+    resultados = []
+    for i, (saida, log, processo) in enumerate(processos):
+        processo.wait()
+        log.close()
+        if not os.path.exists(saida):
+            print(f"Réplica {i + 1} terminou sem resultado (código {processo.returncode}); ver {log.name}")
+            continue
+        with open(saida, encoding="utf-8") as f:
+            resultados.append(json.load(f))
+
+    concluidas = sum(r["concluidas"] for r in resultados)
+    duracao = max((r["duracao_s"] for r in resultados), default=0.0)
+    agregado = {
+        "replicas": args.replicas,
+        "estado": estado,
+        "sessoes": args.sessoes,
+        "concluidas": concluidas,
+        "duracao_s": duracao,
+        # Medida de ponta a ponta: a réplica mais lenta define quando a carga terminou
+        "vazao_jornadas_min": concluidas / duracao * 60 if duracao else 0.0,
+        "linhas_planilha": sum(r["linhas_planilha"] for r in resultados),
+        "emails_enviados": sum(r["emails_enviados"] for r in resultados),
+        "por_replica": resultados,
+    }
+
+    print(f"{'réplica':<10}{'sessões':>9}{'duração':>10}{'vazão/min':>11}{'jornada p95':>13}")
+    for i, r in enumerate(resultados):
+        jornada = r["etapas"]["jornada"]
+        print(f"{i + 1:<10}{r['concluidas']:>5}/{r['sessoes']:<3}{r['duracao_s']:>10.1f}"
+              f"{r['vazao_jornadas_min']:>11.1f}{jornada.get('p95', 0.0):>13.3f}")
+    print("")
+    print(f"Réplicas: {args.replicas} | estado compartilhado: {estado}")
+    print(f"Sessões: {concluidas}/{args.sessoes} concluídas | duração: {duracao:.1f} s | "
+          f"vazão agregada: {agregado['vazao_jornadas_min']:.1f} jornadas/min")
+    print(f"Linhas na planilha: {agregado['linhas_planilha']} | e-mails entregues: {agregado['emails_enviados']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(agregado, f, ensure_ascii=False, indent=2)
+    return 0 if concluidas == args.sessoes else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga da jornada do respondente, sem navegador.")
+    parser.add_argument("--sessoes", type=int, default=20, help="Jornadas simuladas (padrão: 20)")
+    parser.add_argument("--simultaneas", type=int, default=5, help="Jornadas em paralelo (padrão: 5)")
+    parser.add_argument("--rampa", type=float, default=0.0, help="Segundos para iniciar todas as sessões")
+    parser.add_argument("--aquecimento", type=int, default=1, help="Jornadas iniciais fora da medição (padrão: 1)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Limite por execução do script, em segundos")
+    parser.add_argument("--dados", help="Pasta de dados do app (padrão: pasta temporária nova)")
+    for servico, latencia in (("planilha", 0.3), ("smtp", 0.2), ("ia", 0.8)):
+        parser.add_argument(f"--latencia-{servico}", type=float, default=latencia,
+                            help=f"Latência média do dublê de {servico}, em segundos (padrão: {latencia})")
+        parser.add_argument(f"--falhas-{servico}", type=float, default=0.0,
+                            help=f"Fração das chamadas ao dublê de {servico} que falham (padrão: 0)")
+    parser.add_argument("--drenar", type=float, default=5.0, help="Espera final pelas filas de fundo, em segundos")
+    parser.add_argument("--json", help="Grava o resultado completo neste arquivo")
+    parser.add_argument("--replicas", type=int, default=1, help="Processos que dividem as sessões (padrão: 1)")
+    parser.add_argument("--estado", help="URL do estado compartilhado (redis://… ou sqlite:///…)")
+    args = parser.parse_args(argv)
+
+    if args.replicas > 1:
+        return executar_replicas(args)
+
+    # Configuração do app antes da primeira execução: credenciais fictícias e dados isolados
+    os.environ["PUBLIX_DATA_DIR"] = args.dados or tempfile.mkdtemp(prefix="publix-carga-")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-carga")
+    os.environ.setdefault("LOG_ETAPAS", "0")
+    if args.estado:
+        os.environ["ESTADO_COMPARTILHADO_URL"] = args.estado
+    for chave in ("GCP_TYPE", "GCP_PROJECT_ID", "GCP_PRIVATE_KEY_ID", "GCP_PRIVATE_KEY", "GCP_CLIENT_EMAIL",
+                  "GCP_CLIENT_ID", "GCP_AUTH_URI", "GCP_TOKEN_URI", "GCP_AUTH_PROVIDER_X509_CERT_URL",
+                  "GCP_CLIENT_X509_CERT_URL", "GCP_UNIVERSE_DOMAIN"):
+        os.environ.setdefault(chave, "carga")
+    for chave, valor in (("SMTP_HOST", "smtp.local"), ("SMTP_PORT", "587"), ("SMTP_USER", "carga"),
+                         ("SMTP_PASSWORD", "carga")):
+        os.environ.setdefault(chave, valor)
+
+    servicos = [
+        Servico("planilha", args.latencia_planilha, args.falhas_planilha, semente=1),
+        Servico("smtp", args.latencia_smtp, args.falhas_smtp, semente=2),
+        Servico("ia", args.latencia_ia, args.falhas_ia, semente=3),
+    ]
+    aba = instalar_dubles(*servicos)
+
+    resultado = executar_carga(args.sessoes, args.simultaneas, timeout=args.timeout, rampa=args.rampa,
+                               aquecimento=args.aquecimento)
+    time.sleep(args.drenar)
+    resultado["linhas_planilha"] = max(0, len(aba.linhas) - 1)
+    resultado["emails_enviados"] = SMTPLocal.enviados
+    # Quebra do lado do servidor: onde está a cauda de cada jornada (planilha, PDF, e-mail, IA)
+    import metricas
+
+    resultado["etapas_servidor"] = {
+        chave[len("etapa_duracao_segundos"):].strip("{}").replace("etapa=", ""): valores
+        for chave, valores in metricas.resumo()["observacoes"].items()
+        if chave.startswith("etapa_duracao_segundos")
+    }
+    resultado["servicos"] = {
+        s.nome: {"latencia_s": s.latencia, "falhas": s.falhas, "chamadas": s.chamadas,
+                 "falhas_injetadas": s.falhas_injetadas}
+        for s in servicos
+    }
+
+    print(texto_relatorio(resultado, servicos))
+    print("")
+    print(f"{'etapa no servidor':<32}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for nome, p in sorted(resultado["etapas_servidor"].items()):
+        print(f"{nome:<32}{p['n']:>6}{p['p50']:>9.3f}{p['p95']:>9.3f}{p['p99']:>9.3f}")
+    print(f"Linhas na planilha: {resultado['linhas_planilha']} | e-mails entregues: {resultado['emails_enviados']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    return 0 if resultado["concluidas"] == resultado["sessoes"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Verifica um backend de estado compartilhado contra o contrato usado pelo app.
+
+Exercita, num prefixo/arquivo descartável, as operações de que as réplicas
+dependem: chave-valor com TTL (índice de submissões), baldes de tokens e pausa
+(cota das APIs) e a fila com reserva e renovação (planilha), inclusive os
+scripts Lua do Redis. Sai com código 1 se alguma verificação falhar.
+
+Com `fakeredis`, os scripts Lua rodam num Redis em memória (pacote
+`fakeredis[lua]`), sem servidor; com uma URL redis://, use um banco vazio.
+
+Uso:
+    python verificar_estado.py fakeredis
+    python verificar_estado.py redis://localhost:6379/15
+    python verificar_estado.py sqlite:///tmp/estado-teste.db
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+
+from estado_compartilhado import BackendRedis, FilaCompartilhada, criar_backend, criar_baldes
+from idempotencia import IndiceSubmissoes
+
+
+class Verificacao:
+    def __init__(self):
+        self.falhas = []
+        self.total = 0
+
+    def __call__(self, condicao, descricao: str):
+        self.total += 1
+        if not condicao:
+            self.falhas.append(descricao)
+        print(f"{'ok   ' if condicao else 'FALHA'} {descricao}")
+
+
+def abrir_backend(url: str):
+    if url == "fakeredis":
+        try:
+            import fakeredis
+        except ImportError as e:
+            raise Exception(f"Erro ao abrir o fakeredis: pacote fakeredis[lua] não instalado ({e})")
+        return BackendRedis("fakeredis://", prefixo=f"verificacao-{uuid.uuid4().hex[:8]}",
+                            cliente=fakeredis.FakeRedis(decode_responses=True))
+    backend = criar_backend(url)
+    if isinstance(backend, BackendRedis):
+        # Chaves isoladas: um banco em uso não é alterado fora deste prefixo
+        backend.prefixo = f"verificacao-{uuid.uuid4().hex[:8]}"
+    return backend
+
+
+# -------------------
+# Verificações
+# -------------------
+def verificar_chave_valor(backend, v: Verificacao):
+    backend.definir("kv:a", "1")
+    v(backend.obter("kv:a") == "1", "definir/obter")
+    v(backend.definir_se_ausente("kv:b", "x", ttl=0.3), "definir_se_ausente grava chave nova")
+    v(not backend.definir_se_ausente("kv:b", "y", ttl=0.3), "definir_se_ausente não sobrescreve")
+    v(backend.obter("kv:b") == "x", "valor original preservado")
+    time.sleep(0.4)
+    v(backend.obter("kv:b") is None, "chave expira pelo TTL")
+    v(backend.definir_se_ausente("kv:b", "z"), "chave expirada pode ser gravada de novo")
+    backend.remover("kv:a")
+    v(backend.obter("kv:a") is None, "remover")
+
+    indice = IndiceSubmissoes(backend, ttl_segundos=60)
+    primeira = indice.registrar("k1", {"id_resposta": "r1"})
+    segunda = indice.registrar("k1", {"id_resposta": "r2"})
+    v(segunda.registro["id_resposta"] == "r1", "índice de submissões: vale o primeiro registro")
+    indice.concluir(primeira, "salvo")
+    v(indice.obter("k1").concluiu("salvo"), "índice de submissões: etapa concluída")
+
+
+def verificar_baldes(backend, v: Verificacao):
+    baldes = criar_baldes({"requisicoes": 600, "tokens": 6000}, backend, prefixo="verificacao")
+    v(baldes.tentar({"requisicoes": 1, "tokens": 100}) == 0.0, "balde cheio admite")
+    v(baldes.tentar({"requisicoes": 1, "tokens": 6000}) > 0, "sem saldo de tokens, devolve espera")
+    v(baldes.tentar({"requisicoes": 1, "tokens": 1}) == 0.0, "pedido recusado não consome dos outros baldes")
+    baldes.esvaziar("requisicoes")
+    espera = baldes.tentar({"requisicoes": 1})
+    v(0 < espera <= 0.2, f"balde esvaziado repõe no ritmo da cota (espera {espera:.3f} s)")
+    time.sleep(espera + 0.02)
+    v(baldes.tentar({"requisicoes": 1}) == 0.0, "reposição libera o pedido")
+    baldes.ajustar("tokens", 100000)
+    v(baldes.tentar({"tokens": 1}) > 0, "ajustar debita o consumo real")
+    baldes.ajustar("tokens", -200000)
+    v(baldes.tentar({"tokens": 1}) == 0.0, "ajuste negativo devolve saldo")
+    baldes.pausar(0.3)
+    pausa = baldes.pausado_por()
+    v(0.1 < pausa <= 0.3, f"pausa registrada ({pausa:.3f} s)")
+    v(baldes.tentar({"requisicoes": 1}) >= 0.1, "pausa segura as admissões")
+    baldes.pausar(0.05)
+    v(baldes.pausado_por() > 0.1, "pausa mais curta não encurta a vigente")
+    time.sleep(0.35)
+    v(baldes.pausado_por() == 0.0 and baldes.tentar({"requisicoes": 1}) == 0.0, "pausa termina")
+
+
+def verificar_fila(backend, v: Verificacao):
+    fila = FilaCompartilhada(backend, f"verificacao-{uuid.uuid4().hex[:6]}", prazo=0.3)
+    outra = FilaCompartilhada(backend, fila.nome, prazo=0.3)
+    for i in range(5):
+        fila.incluir(json.dumps({"id_resposta": f"r{i}"}))
+    v(fila.profundidade() == 5, "incluir")
+
+    lote = fila.reservar(3)
+    v([json.loads(p)["id_resposta"] for _, p, _ in lote] == ["r0", "r1", "r2"], "reservar na ordem de chegada")
+    v(all(t == 0 for _, _, t in lote), "tentativas começam em zero")
+    resto = outra.reservar(10)
+    v([json.loads(p)["id_resposta"] for _, p, _ in resto] == ["r3", "r4"], "reservados não vão para outra réplica")
+    v(outra.reservar(10) == [], "tudo reservado: nada disponível")
+
+    ids = [i for i, _, _ in lote]
+    fila.falhar(ids[:1])
+    fila.falhar(ids[1:2], contar=False)
+    devolvidos = {i: t for i, _, t in outra.reservar(10)}
+    v(devolvidos == {ids[0]: 1, ids[1]: 0}, "falhar devolve já, contando só quando pedido")
+
+    fila.confirmar([ids[2]])
+    v(fila.profundidade() == 4, "confirmar remove da fila")
+    fila.descartar([ids[0]], "erro de teste")
+    v(fila.profundidade() == 3, "descartar remove da fila")
+
+    renovado = [i for i, _, _ in resto][:1]
+    time.sleep(0.2)
+    v(fila.renovar(renovado) == 1, "renovar estende reserva vigente")
+    time.sleep(0.15)
+    expirados = sorted(i for i, _, _ in fila.reservar(10))
+    v(renovado[0] not in expirados, "reserva renovada não vence no prazo original")
+    v(fila.renovar([ids[1]]) == 1 and outra.renovar([ids[2]]) == 0, "só renova o que ainda está reservado")
+    fila.confirmar(renovado)
+    v(expirados == sorted([ids[1]] + [i for i, _, _ in resto][1:]), "reserva vencida volta a ficar disponível")
+    fila.confirmar(expirados)
+    v(fila.profundidade() == 0, "fila vazia ao fim")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica um backend de estado compartilhado.")
+    parser.add_argument("url", help="fakeredis, redis://… (banco vazio) ou sqlite:///…")
+    args = parser.parse_args(argv)
+
+    backend = abrir_backend(args.url)
+    print(f"Backend: {backend!r}")
+    v = Verificacao()
+    for etapa in (verificar_chave_valor, verificar_baldes, verificar_fila):
+        print(f"-- {etapa.__name__.removeprefix('verificar_').replace('_', '-')}")
+        etapa(backend, v)
+    print(f"{v.total - len(v.falhas)}/{v.total} verificações ok")
+    return 1 if v.falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())